@@ -0,0 +1,237 @@
+"""
+Compile whole trees of jade templates, in parallel.
+
+    python -m jade.batch [-j N] [-f] [-w] [--compact] src_dir dst_dir
+"""
+import os
+import sys
+import time
+import errno
+import codecs
+import argparse
+from multiprocessing import Pool
+
+from .compile import compile_string
+from .deps import DependencyGraph
+from .parse import LexError
+
+# Where compile_tree keeps the dependency graph, relative to dst_dir
+GRAPH_FILE = '.jade-deps.json'
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def find_templates(src_dir, extensions=('.jade',)):
+    """
+    Yield paths of all templates under `src_dir`, relative to it.
+    """
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(extensions):
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, src_dir)
+
+
+def output_path(path, suffix):
+    if suffix is None:
+        return path
+    return os.path.splitext(path)[0] + suffix
+
+
+def is_fresh(src, dst):
+    """
+    Whether `dst` exists and is newer than `src`.
+    """
+    try:
+        return os.path.getmtime(dst) >= os.path.getmtime(src)
+    except OSError:
+        return False
+
+
+def compile_file(src, dst, **options):
+    """
+    Compile the jade template at `src` into `dst`, passing `options` to the
+    Compiler.  Returns the names of the templates it depends on.
+    """
+    with codecs.open(src, encoding='utf8') as f:
+        deps = []
+        compiled = compile_string(f.read(), deps, **options)
+    makedirs(os.path.dirname(dst) or '.')
+    tmp = dst + '.tmp'
+    with codecs.open(tmp, 'w', encoding='utf8') as f:
+        f.write(compiled)
+    os.rename(tmp, dst)
+    return deps
+
+
+def _compile_job(job):
+    """
+    Compile one file for compile_tree.  Returns (path, error, deps), where
+    error is None on success and a printable diagnostic otherwise.
+    """
+    path, src, dst, options = job
+    try:
+        deps = compile_file(src, dst, **options)
+    except LexError as e:
+        return path, e.pprint(), None
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        return path, str(e), None
+    return path, None, deps
+
+
+def compile_tree(src_dir, dst_dir, processes=None, force=False,
+                 suffix=None, extensions=('.jade',), names=None,
+                 **options):
+    """
+    Compile every template under `src_dir` into the mirrored location under
+    `dst_dir`, under the same name, so that extends and include tags naming
+    other templates find them there, or with the extension replaced by
+    `suffix` if given; template names in the output are left as they are.
+    Templates whose output is newer than the source and the templates it
+    depends on are skipped unless `force` is true.  If `names` is given, only
+    those templates are considered.  `options` are passed to the Compiler.
+
+    The dependency graph is kept in GRAPH_FILE under `dst_dir`.
+
+    The work is spread over a pool of `processes` processes (by default one
+    per CPU).  Errors don't stop the run; a list of (path, error) tuples is
+    returned, one for each template compiled, with error being None on
+    success.
+    """
+    graph_file = os.path.join(dst_dir, GRAPH_FILE)
+    graph = DependencyGraph.load(graph_file)
+
+    jobs = []
+    for path in find_templates(src_dir, extensions):
+        if names is not None and path not in names:
+            continue
+        src = os.path.join(src_dir, path)
+        dst = os.path.join(dst_dir, output_path(path, suffix))
+        if (force or not is_fresh(src, dst) or
+                not all(is_fresh(os.path.join(src_dir, dep), dst)
+                        for dep in graph.dependencies(path)
+                        if os.path.exists(os.path.join(src_dir, dep)))):
+            jobs.append((path, src, dst, options))
+
+    if processes == 1 or len(jobs) <= 1:
+        results = map(_compile_job, jobs)
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_compile_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    for path, error, deps in results:
+        if deps is not None:
+            graph.update(path, deps)
+    if results:
+        makedirs(dst_dir)
+        graph.save(graph_file)
+    return [(path, error) for path, error, deps in results]
+
+
+def _scan(src_dir, extensions):
+    mtimes = {}
+    for path in find_templates(src_dir, extensions):
+        try:
+            mtimes[path] = os.path.getmtime(os.path.join(src_dir, path))
+        except OSError:
+            pass
+    return mtimes
+
+
+def watch(src_dir, dst_dir, processes=None, suffix=None,
+          extensions=('.jade',), interval=1.0, report=None, **options):
+    """
+    Poll `src_dir` every `interval` seconds, and whenever templates change,
+    recompile them together with all templates that depend on them.  Output
+    of removed templates is removed.  Results of each round are passed to
+    `report`.  Never returns.
+    """
+    graph_file = os.path.join(dst_dir, GRAPH_FILE)
+    mtimes = _scan(src_dir, extensions)
+    while True:
+        time.sleep(interval)
+        new_mtimes = _scan(src_dir, extensions)
+        changed = set(path for path, mtime in new_mtimes.items()
+                      if mtimes.get(path) != mtime)
+        removed = set(mtimes) - set(new_mtimes)
+        mtimes = new_mtimes
+        if not changed and not removed:
+            continue
+
+        graph = DependencyGraph.load(graph_file)
+        affected = graph.dependents(changed | removed) - removed
+        if removed:
+            for path in removed:
+                graph.remove(path)
+                try:
+                    os.remove(os.path.join(dst_dir,
+                                           output_path(path, suffix)))
+                except OSError:
+                    pass
+            graph.save(graph_file)
+        results = compile_tree(src_dir, dst_dir, processes, True, suffix,
+                               extensions, affected, **options)
+        if report:
+            report(results)
+
+
+def report_results(results):
+    failed = 0
+    for path, error in results:
+        if error is not None:
+            failed += 1
+            print >>sys.stderr, '%s:' % path
+            print >>sys.stderr, error
+    print >>sys.stderr, '%d compiled, %d failed' % (
+        len(results) - failed, failed)
+    return failed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog='python -m jade.batch',
+        description='Compile a tree of jade templates to Jinja2.')
+    ap.add_argument('src_dir')
+    ap.add_argument('dst_dir')
+    ap.add_argument('-j', '--jobs', type=int, default=None,
+                    help='number of worker processes (default: CPU count)')
+    ap.add_argument('-f', '--force', action='store_true',
+                    help='recompile templates that are up to date')
+    ap.add_argument('-s', '--suffix', default=None,
+                    help='replace the extension of output files with this; '
+                         'extends and include tags still name the '
+                         'originals (default: keep the names)')
+    ap.add_argument('-w', '--watch', action='store_true',
+                    help='keep running and recompile templates, and those '
+                         'depending on them, as they change')
+    ap.add_argument('--compact', action='store_true',
+                    help='drop newlines and indentation between tags; use '
+                         'with -f when switching')
+    args = ap.parse_args(argv)
+
+    options = {'compact': args.compact}
+    results = compile_tree(args.src_dir, args.dst_dir, args.jobs,
+                           args.force, args.suffix, **options)
+    failed = report_results(results)
+    if args.watch:
+        try:
+            watch(args.src_dir, args.dst_dir, args.jobs, args.suffix,
+                  report=report_results, **options)
+        except KeyboardInterrupt:
+            pass
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Measure lexing and compiling throughput.
+
+    python -m jade.bench [-n REPEAT] [-o results.json] [-c baseline.json]
+
+Runs the conformity tests plus generated stress templates, reporting for each
+the time spent in the parser alone and in the compiler on top of it, chars
+and lines per second, and how much compiling it adds to peak memory.
+"""
+import os
+import sys
+import json
+import time
+import string
+import codecs
+import argparse
+import platform
+import resource
+
+from . import __version__
+from .compile import Compiler
+from .parse import Parser, LexError
+from .sink import Sink
+
+
+CONFORMITY_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'conformity-tests')
+
+
+class NullCompiler(object):
+    """
+    A compiler that does nothing, for timing the parser alone.
+    """
+    def start(self, parser):
+        pass
+
+    def start_block(self, tag):
+        pass
+
+    def end_block(self):
+        pass
+
+    def literal(self, text):
+        pass
+
+    def newlines(self, text):
+        pass
+
+    def end(self):
+        pass
+
+
+def deep_nesting(depth=300):
+    return u''.join(u'  ' * i + u'div.level%d\n' % i for i in range(depth))
+
+
+def huge_verbatim(lines=20000):
+    body = u''.join(u'  line %d of some verbatim text, <b>as is</b>\n' % i
+                    for i in range(lines))
+    return u'p.\n' + body + u':markdown\n' + body
+
+
+def wide_attributes(tags=200, attrs=50):
+    # attribute keys can't contain digits
+    attr = u', '.join(u'data-%s=item.f%d + "-%d"' % (
+        string.ascii_lowercase[i // 26] + string.ascii_lowercase[i % 26],
+        i, i) for i in range(attrs))
+    return u'a(%s) link\n' % attr * tags
+
+
+def if_chain(branches=500):
+    lines = [u'if x == 0\n  p zero\n']
+    for i in range(1, branches):
+        lines.append(u'elif x == %d\n  p branch %d\n' % (i, i))
+    lines.append(u'else\n  p other\n')
+    return u''.join(lines)
+
+
+def case_table(branches=500):
+    lines = [u'case status\n']
+    for i in range(branches):
+        lines.append(u'  when "s%d"\n    i.icon-%d\n' % (i, i))
+    lines.append(u'  default\n    i.icon-unknown\n')
+    return u''.join(lines)
+
+
+generators = [deep_nesting, huge_verbatim, wide_attributes, if_chain,
+              case_table]
+
+
+def load_corpus(directory=CONFORMITY_DIR):
+    corpus = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.jade'):
+                with codecs.open(os.path.join(directory, name),
+                                 encoding='utf8') as f:
+                    corpus.append((name, f.read()))
+    for gen in generators:
+        corpus.append((gen.__name__, gen()))
+    return corpus
+
+
+def time_best(f, repeat, min_time=0.02):
+    """
+    Return the best time per call of `f` out of `repeat` runs.  Each run
+    calls `f` enough times to take at least `min_time` seconds, so that
+    small templates are measured above timer resolution.
+    """
+    loops = 1
+    while True:
+        t = time.time()
+        for i in xrange(loops):
+            f()
+        t = time.time() - t
+        if t >= min_time:
+            break
+        loops *= 2
+    best = t
+    for i in range(repeat - 1):
+        t = time.time()
+        for i in xrange(loops):
+            f()
+        best = min(best, time.time() - t)
+    return best / loops
+
+
+def parse_only(text):
+    Parser(text, NullCompiler())()
+
+
+def parse_and_compile(text):
+    Parser(text, Compiler(Sink()))()
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def peak_growth_kb(f):
+    """
+    Return how much calling `f` grows the peak RSS, in KiB.
+
+    `f` is called in a child process, whose peak starts out at its RSS when
+    forked, so that the result isn't hidden by the peak of templates measured
+    earlier.  Pages the child copies on write add a small constant to every
+    result.  Returns None if the child failed.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            before = peak_rss_kb()
+            f()
+            os.write(w, str(peak_rss_kb() - before))
+        finally:
+            os._exit(0)
+    os.close(w)
+    with os.fdopen(r) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    return int(data) if data else None
+
+
+def bench(corpus, repeat=5):
+    """
+    Benchmark each (name, text) in `corpus`.  Returns a dict mapping names to
+    dicts of measurements.  Templates that fail to compile are recorded with
+    their error and skipped.
+    """
+    results = {}
+    for name, text in corpus:
+        try:
+            parse_and_compile(text)
+        except LexError as e:
+            results[name] = {'error': e.msg}
+            continue
+        parse_time = time_best(lambda: parse_only(text), repeat)
+        total_time = time_best(lambda: parse_and_compile(text), repeat)
+        chars = len(text)
+        lines = text.count(u'\n') + 1
+        results[name] = {
+            'chars': chars,
+            'lines': lines,
+            'parse_time': parse_time,
+            'compile_time': max(total_time - parse_time, 0.0),
+            'total_time': total_time,
+            'chars_per_sec': chars / total_time if total_time else None,
+            'lines_per_sec': lines / total_time if total_time else None,
+            'peak_kb': peak_growth_kb(lambda: parse_and_compile(text)),
+        }
+    return results
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Yield (name, old_time, new_time, regressed) for templates measured in
+    both runs.
+    """
+    for name in sorted(new):
+        if name not in old or 'error' in old[name] or 'error' in new[name]:
+            continue
+        before = old[name]['total_time']
+        after = new[name]['total_time']
+        yield name, before, after, after > before * (1 + threshold)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog='python -m jade.bench',
+        description='Benchmark jade lexing and compiling.')
+    ap.add_argument('-n', '--repeat', type=int, default=5,
+                    help='runs per template; the best is kept (default: 5)')
+    ap.add_argument('-o', '--output', help='save results as JSON')
+    ap.add_argument('-c', '--compare', metavar='JSON',
+                    help='compare with results saved earlier')
+    ap.add_argument('-t', '--threshold', type=float, default=0.1,
+                    help='slowdown reported as regression (default: 0.1)')
+    args = ap.parse_args(argv)
+
+    results = bench(load_corpus(), args.repeat)
+
+    print '%-26s %9s %9s %9s %12s %10s %9s' % (
+        'template', 'parse', 'compile', 'total', 'chars/s', 'lines/s',
+        'peak')
+    for name in sorted(results):
+        r = results[name]
+        if 'error' in r:
+            print '%-26s error: %s' % (name, r['error'])
+            continue
+        print '%-26s %8.2fms %8.2fms %8.2fms %12.0f %10.0f %6sKiB' % (
+            name, r['parse_time'] * 1e3, r['compile_time'] * 1e3,
+            r['total_time'] * 1e3, r['chars_per_sec'], r['lines_per_sec'],
+            r['peak_kb'] if r['peak_kb'] is not None else '?')
+    print 'peak RSS: %d KiB' % peak_rss_kb()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'time': time.time(),
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+
+    regressed = 0
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+        print
+        for name, before, after, bad in compare(old, results, args.threshold):
+            regressed += bad
+            print '%-26s %8.2fms -> %8.2fms %+6.1f%%%s' % (
+                name, before * 1e3, after * 1e3,
+                (after / before - 1) * 100 if before else 0,
+                '  REGRESSION' if bad else '')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import os
+import json
+import errno
+import codecs
+import marshal
+import hashlib
+import tempfile
+import threading
+from copy import copy
+
+from . import __version__
+from .compile import compile_string, control_blocks, doctypes
+from .parse import control_tags, control_tag_aliases
+
+
+def _fingerprint(value):
+    """
+    Return a byte string identifying `value`, which is either a string or a
+    function from one of the compiler tables.
+    """
+    if callable(value):
+        return marshal.dumps(value.func_code)
+    return repr(value)
+
+
+def _tables():
+    return control_tags, control_tag_aliases, doctypes, control_blocks
+
+
+# Copies of the tables the last fingerprint was computed from, and the
+# fingerprint
+_last_fingerprint = [None, None]
+
+
+def tables_fingerprint():
+    """
+    Return a byte string identifying the parser and compiler tables, so that
+    cached output is invalidated when they are modified.
+
+    The fingerprint is only computed again when the tables differ from the
+    last time; comparing them is much cheaper than marshalling the functions
+    in control_blocks.
+    """
+    tables, fingerprint = _last_fingerprint
+    if tables == _tables():
+        return fingerprint
+    parts = [__version__, repr(sorted(control_tags)),
+             repr(sorted(control_tag_aliases.items())),
+             repr(sorted(doctypes.items()))]
+    default = control_blocks.default_factory()
+    parts.extend(map(_fingerprint, default))
+    for name in sorted(control_blocks):
+        start, end = control_blocks[name]
+        if (start, end) == default:
+            # Added by the compiler looking up a tag without an entry
+            continue
+        parts.extend((name.encode('utf8'), _fingerprint(start),
+                      _fingerprint(end)))
+    fingerprint = '\0'.join(parts)
+    _last_fingerprint[:] = [tuple(map(copy, _tables())), fingerprint]
+    return fingerprint
+
+
+class FileCache(object):
+    """
+    A persistent, content-addressed cache of compiled jade output.
+
+    Entries are keyed by a hash of the jade source, the compiler options,
+    the jadepy version and the compiler tables.  They are written
+    atomically, so several processes may share one directory.  When the
+    total size of the entries exceeds `max_size` bytes, the least recently
+    used ones are evicted.
+
+    The directory is only listed on the first write and when the running
+    estimate of the total size goes over `max_size`, so entries written by
+    other processes are only accounted for then.
+
+    An instance can be shared by several threads.
+    """
+    suffix = '.jinja'
+    # Version of the entry format, part of the key so that entries written
+    # in another format are never read
+    format = 2
+    # Fraction of max_size entries are evicted down to once it is exceeded,
+    # so that the directory isn't listed again on the next few writes
+    low_water = 0.75
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        # Estimated total size of the entries, None until listed
+        self.size = None
+        # Guards size, so that a prune doesn't race another thread's write
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, text, options=None):
+        h = hashlib.sha1(tables_fingerprint())
+        h.update('\0%d\0' % self.format)
+        if options:
+            h.update(repr(sorted(options.items())))
+        h.update('\0')
+        h.update(text.encode('utf8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, text, dependencies=None, **options):
+        """
+        Return the cached output for jade source `text` compiled with
+        `options`, or None.  If `dependencies` is a list, the recorded
+        dependencies of the template are appended to it on a hit.
+
+        Entries that can't be read back are removed and count as misses.
+        """
+        path = self._path(self.key(text, options))
+        try:
+            with codecs.open(path, encoding='utf8') as f:
+                # The first line holds the dependencies
+                deps = json.loads(f.readline())
+                compiled = f.read()
+            if not isinstance(deps, list):
+                raise ValueError('bad dependencies')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        except ValueError:
+            # Truncated or corrupt; UnicodeDecodeError is a ValueError too
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Bump mtime, which is used for LRU eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        if dependencies is not None:
+            dependencies.extend(deps)
+        return compiled
+
+    def set(self, text, compiled, dependencies=(), **options):
+        """
+        Store the output for jade source `text` compiled with `options`,
+        along with the names of the templates it depends on.
+        """
+        # The first line holds the dependencies
+        data = json.dumps(list(dependencies)) + '\n' + compiled.encode('utf8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, self._path(self.key(text, options)))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            if self.size is None:
+                self._prune(self.max_size)
+            else:
+                # Replaced entries are counted twice until the next prune
+                self.size += len(data)
+                if self.size > self.max_size:
+                    self._prune(int(self.max_size * self.low_water))
+
+    def compile(self, text, dependencies=None, **options):
+        """
+        Like compile_string, but go through the cache.
+        """
+        compiled = self.get(text, dependencies, **options)
+        if compiled is None:
+            deps = []
+            compiled = compile_string(text, deps, **options)
+            self.set(text, compiled, deps, **options)
+            if dependencies is not None:
+                dependencies.extend(deps)
+        return compiled
+
+    def prune(self, target=None):
+        """
+        Evict least recently used entries until the cache fits in `target`
+        bytes, max_size by default.
+        """
+        if target is None:
+            target = self.max_size
+        with self.lock:
+            self._prune(target)
+
+    def _prune(self, target):
+        # Called with the lock held
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        with self.lock:
+            self.size = None
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
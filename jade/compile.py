@@ -1,7 +1,14 @@
+import re
+import json
 from sys import stdout
 from collections import defaultdict
 
-from .parse import main, HTMLTag
+from .parse import argument_parser, main as parse_main, Parser, HTMLTag
+from .runtime import _jade_class
+from .sink import Sink
+from .stream import flush_marker
+from .tree import build, replay, run_passes
+from .utils import escape
 
 
 def maybe_call(f, *args, **kwargs):
@@ -10,18 +17,98 @@ def maybe_call(f, *args, **kwargs):
     return f
 
 
+# Tags whose content is whitespace-sensitive and left alone in compact mode
+preformatted_tags = ('pre', 'textarea', 'script', 'style')
+
+# Tags that whitespace around doesn't render next to, so that compact mode
+# drops newlines at their start and end tags.  Other tags are taken as inline,
+# and a newline between two pieces of inline content is kept as a space.
+block_tags = frozenset([
+    'address', 'article', 'aside', 'base', 'blockquote', 'body', 'caption',
+    'col', 'colgroup', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'head', 'header', 'hgroup', 'hr', 'html', 'li', 'link',
+    'main', 'meta', 'nav', 'ol', 'optgroup', 'option', 'p', 'pre', 'section',
+    'summary', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'title', 'tr',
+    'ul'])
+
+# Whitespace spanning lines in text; \s is ASCII-only without re.U, so
+# non-breaking spaces are kept
+line_break_space = re.compile(r'[ \t\r\f\v]*\n\s*')
+
+# Tags timed when instrumenting, with the hooks around the whole tag or just
+# inside it; mixin tags are timed depending on whether they have a body
+profiled_outside = frozenset(['for', 'include', 'cache', '=', '!='])
+profiled_inside = frozenset(['block', 'append', 'prepend'])
+leave_hook = u'{{ _jade_profile.leave() }}'
+# Output first by instrumented templates, so that the profiler forgets the
+# lines a previous render left open by raising.  Templates this one extends
+# or includes see _jade_profiled and leave the stack alone.
+start_hook = (u'{% if _jade_profiled is not defined %}'
+              u'{{ _jade_profile.start() }}{% endif %}'
+              u'{% set _jade_profiled = true %}')
+
+
 class Compiler(object):
-    def __init__(self, stream):
+    """
+    Compiles parser events into Jinja2 source.
+
+    Output goes to `stream`, which is either a Sink or any target a Sink
+    accepts.  The sink is flushed whenever a top-level block closes and
+    enough output is buffered, and when compiling ends.
+
+    By default, output lines correspond to source lines.  With `compact`
+    set, newlines and indentation are dropped instead where they are next to
+    the start or end tag of block_tags, and collapsed into a single space
+    between other tags and text, as is whitespace spanning lines in text;
+    preformatted_tags are left alone.
+
+    A flush marker (see jade.stream) is output after the closing tag of
+    elements whose names are in `flush_after`, as well as for flush tags.
+
+    If `instrument` is set to the name of the template (or True for an
+    unnamed one), loops, mixin calls and definitions, blocks, includes,
+    cache tags and expressions are wrapped in calls to the profiler of
+    jade.profiler, tagged with their source line.  The calls output
+    nothing and don't add lines.
+    """
+    def __init__(self, stream, compact=False, flush_after=(),
+                 instrument=None):
+        if not isinstance(stream, Sink):
+            stream = Sink(stream)
         self.stream = stream
+        self.compact = compact
+        self.flush_after = frozenset(flush_after)
+        self.instrument = (u'<template>' if instrument is True else
+                           instrument or None)
+        if self.instrument:
+            # The source line of the next event, and for each open block,
+            # where its leave hook goes: 'outside', 'inside' or None
+            self.line = 1
+            self.hooks = []
+            self.pending_line = None
         self.blocks = []
         self.deferred_endif = ()
+        # A mixin or + tag, until it is known whether it has a body
+        self.pending_mixin = None
         self.tmpvar_count = 0
+        # names of templates pulled in with extends or include
+        self.dependencies = []
+        # number of open preformatted_tags
+        self.preformatted = 0
+        # In compact mode, whether the last output was inline content, and
+        # whether a newline has been dropped since then; a space is then
+        # needed before the next inline content
+        self.after_inline = False
+        self.dropped_newline = False
 
     def start(self, parser):
         """
         Called by the parser to start compiling.
         """
         self.parser = parser
+        if self.instrument:
+            self.stream.write(start_hook)
 
     def put_tmpvar(self, val):
         """
@@ -44,7 +131,7 @@ class Compiler(object):
         [endif, newlines].
         """
         if self.deferred_endif:
-            self.stream.write(self.deferred_endif[1])
+            self.stream.write_static(self.deferred_endif[1])
             self.deferred_endif = ()
 
     def put_endif(self):
@@ -52,47 +139,99 @@ class Compiler(object):
         Output an endif.
         """
         if self.deferred_endif:
-            self.stream.write(''.join(self.deferred_endif))
+            self.stream.write(self.deferred_endif[0])
+            self.stream.write_static(self.deferred_endif[1])
             self.deferred_endif = ()
 
+    def separate(self, inline):
+        """
+        In compact mode, called before outputting text, an expression or a
+        tag, with `inline` false for the tags of block_tags.  Output the space
+        that a dropped newline between two pieces of inline content stands
+        for.
+        """
+        if self.dropped_newline and self.after_inline and inline:
+            self.stream.write_static(u' ')
+        self.dropped_newline = False
+        self.after_inline = inline
+
+    def enter_hook(self, tag, line, mixin=None):
+        """
+        Return the profiler call that starts timing `tag`, on source line
+        `line`.
+        """
+        label = tag.name + u' ' + (tag.head or u'').strip()
+        return u'{{ _jade_profile.enter(%s, %d, %s%s) }}' % (
+            json.dumps(self.instrument), line, json.dumps(label.strip()),
+            u', ' + json.dumps(mixin) if mixin else u'')
+
+    def put_mixin(self):
+        """
+        Output the start of a pending mixin or + tag, which turned out to have
+        a body: a macro definition or a call with a caller.
+
+        A mixin tag without a body calls the mixin, like a + tag without a
+        body.  Whether there is a body is only known from the next parser
+        event, so the tag is kept in self.pending_mixin until then.
+        """
+        if self.pending_mixin:
+            tag = self.pending_mixin
+            self.pending_mixin = None
+            start = maybe_call(control_blocks[tag.name][0], tag)
+            if not self.instrument:
+                self.stream.write(start)
+            elif tag.name == '+':
+                self.stream.write(self.enter_hook(tag, self.pending_line))
+                self.stream.write(start)
+                self.hooks[-1] = 'outside'
+            else:
+                name = mixin_call(tag.head).split(u'(', 1)[0].strip()
+                self.stream.write(start)
+                self.stream.write(self.enter_hook(tag, self.pending_line,
+                                                  name))
+                self.hooks[-1] = 'inside'
+
     def start_block(self, tag):
         """
         Called by the parser to start a block.  `tag` can be either an HTMLTag
         or a ControlTag.
         """
+        self.put_mixin()
         if tag.name in ('elif', 'else'):
             self.dismiss_endif()
         else:
             self.put_endif()
 
         self.blocks.append(tag)
+        if self.instrument:
+            hook = None
+            if isinstance(tag, HTMLTag):
+                self.line += sum(a.count(u'\n') for a in tag.attr
+                                 if isinstance(a, basestring))
+            elif tag.name in ('mixin', '+'):
+                self.pending_line = self.line
+            elif tag.name in profiled_outside:
+                self.stream.write(self.enter_hook(tag, self.line))
+                hook = 'outside'
+            elif tag.name in profiled_inside:
+                hook = 'inside'
+            self.hooks.append(hook)
+        if self.compact and (isinstance(tag, HTMLTag) or
+                             tag.name in ('=', '!=')):
+            self.separate(tag.name not in block_tags)
         if isinstance(tag, HTMLTag):
-            self.stream.write(u'<%s' % tag.name)
-
-            for a in tag.attr:
-                if isinstance(a, basestring):
-                    self.literal(a)
-                    continue
-                k, v = a
-                if k == 'id':
-                    # tag(id=xxx) takes precedence over tag#xxx
-                    tag.id_ = None
-                elif k == 'class':
-                    # merge tag(class=xxx) with tag.xxx
-                    self.stream.write(
-                        u' class="%s{{ _jade_class(%s) |escape}}"' %
-                        (tag.class_ and tag.class_ + u' ' or u'', v))
-                    tag.class_ = None
-                    continue
-                self.stream.write(u' %s="{{ %s |escape}}"' % (k, v))
-
-            if tag.id_:
-                self.stream.write(u' id="%s"' % tag.id_)
-
-            if tag.class_:
-                self.stream.write(u' class="%s"' % tag.class_)
-
-            self.stream.write('>')
+            # Markup is written as static text, so that it is coalesced
+            # with the surrounding markup
+            for part in start_tag(tag, self.compact):
+                if isinstance(part, basestring):
+                    self.stream.write_static(part)
+                elif part[1]:
+                    self.stream.write(u'{{ _jade_class(%s) |escape}}' %
+                                      part[0])
+                else:
+                    self.stream.write(u'{{ %s}}' % escaped_value(part[0]))
+            if tag.name in preformatted_tags:
+                self.preformatted += 1
         elif tag.name == 'case':
             tag.var = self.put_tmpvar(tag.head)
             tag.seen_when = tag.seen_default = False
@@ -115,17 +254,41 @@ class Compiler(object):
                     raise self.parser.error('default tag before when tag')
                 self.stream.write(u'{% else %}')
                 case_tag.seen_default = True
+        elif tag.name in ('mixin', '+'):
+            self.pending_mixin = tag
         else:
-            self.stream.write(maybe_call(control_blocks[tag.name][0], tag))
+            if tag.name in ('extends', 'include'):
+                name = template_name(include_head(tag.head)
+                                     if tag.name == 'include' else tag.head)
+                if name:
+                    self.dependencies.append(name)
+            if not (self.compact and tag.name == '//-'):
+                self.stream.write(maybe_call(control_blocks[tag.name][0],
+                                             tag))
+            if self.instrument and self.hooks[-1] == 'inside':
+                self.stream.write(self.enter_hook(tag, self.line))
 
     def end_block(self):
         """
         Called by the parser to end a block.  The parser doesn't keep track of
         active blocks.
         """
+        # An if block ending the block this ends
+        self.put_endif()
         tag = self.blocks.pop()
+        hook = self.hooks.pop() if self.instrument else None
+        if not self.blocks:
+            self.stream.maybe_flush()
+        if hook == 'inside':
+            self.stream.write(leave_hook)
         if isinstance(tag, HTMLTag):
-            self.stream.write('</%s>' % tag.name)
+            if self.compact:
+                self.separate(tag.name not in block_tags)
+            if tag.name in preformatted_tags:
+                self.preformatted -= 1
+            self.stream.write_static(u'</%s>' % tag.name)
+            if tag.name in self.flush_after:
+                self.stream.write_static(flush_marker)
         elif tag.name in ('if', 'elif'):
             self.deferred_endif = [u'{% endif %}', '']
         elif tag.name == 'case':
@@ -134,31 +297,68 @@ class Compiler(object):
             self.stream.write('{% endif %}')
         elif tag.name in ('when', 'default'):
             pass
-        else:
+        elif tag.name in ('mixin', '+') and self.pending_mixin:
+            self.pending_mixin = None
+            if self.instrument:
+                self.stream.write(self.enter_hook(tag, self.pending_line))
+                hook = 'outside'
+            self.stream.write(u'{{ %s }}' % mixin_call(tag.head))
+        elif not (self.compact and tag.name == '//-'):
             self.stream.write(maybe_call(control_blocks[tag.name][1], tag))
+        if hook == 'outside':
+            self.stream.write(leave_hook)
 
     def literal(self, text):
         """
         Called by the parser to output literal text.  The parser doesn't keep
         track of active blocks.
         """
+        self.put_mixin()
         self.put_endif()
-        self.stream.write(text)
+        if self.instrument:
+            self.line += text.count(u'\n')
+        if self.blocks and self.blocks[-1].name == '//-':
+            # Comments are dropped, except for newlines to keep lines in
+            # correspondence, which stay in the Jinja2 comment
+            if not self.compact:
+                self.stream.write_static(u'\n' * text.count(u'\n'))
+        elif self.blocks and self.blocks[-1].name == '#':
+            # A Jinja2 comment holding the newlines of nodes that tree passes
+            # dropped
+            if not self.compact:
+                self.stream.write(text)
+        elif self.compact and not self.preformatted and self.blocks and (
+                isinstance(self.blocks[-1], HTMLTag) or
+                self.blocks[-1].name == '|'):
+            # Text, as opposed to code
+            self.separate(True)
+            self.stream.write(line_break_space.sub(u' ', text))
+        else:
+            self.stream.write(text)
 
     def newlines(self, text):
         """
         Called by the parser to output newlines that are part of the indent.
         """
+        self.put_mixin()
+        if self.instrument:
+            self.line += text.count(u'\n')
+        if self.compact and not self.preformatted:
+            self.dropped_newline = True
+            text = u''
         if self.deferred_endif:
-            self.deferred_endif[1] = text
+            # Tree passes may output several Newlines in a row
+            self.deferred_endif[1] += text
         else:
-            self.literal(text)
+            self.put_endif()
+            self.stream.write_static(text)
 
     def end(self):
         """
         Called by the parser to terminate compiling.
         """
         self.put_endif()
+        self.stream.flush()
 
 
 doctypes = {
@@ -184,6 +384,89 @@ doctypes = {
 }
 
 
+def start_tag(tag, compact=False):
+    """
+    Yield the parts of the start tag of HTMLTag `tag`: strings of markup, and
+    (expr, is_class) tuples for attribute values only known at render time,
+    which are to be escaped and, if is_class is true, passed through
+    _jade_class first.  The tag is left untouched, so that it can be compiled
+    again.
+
+    With `compact` set, newlines between attributes are left out.
+    """
+    yield u'<' + tag.name
+    id_, class_ = tag.id_, tag.class_
+
+    for a in tag.attr:
+        if isinstance(a, basestring):
+            # Newlines between attributes
+            if not compact:
+                yield a
+            continue
+        k, v = a
+        # Literal values are escaped at compile time
+        value = literal_value(v)
+        if k == 'id':
+            # tag(id=xxx) takes precedence over tag#xxx
+            id_ = None
+        elif k == 'class':
+            # merge tag(class=xxx) with tag.xxx
+            yield u' class="%s' % (class_ and class_ + u' ' or u'')
+            class_ = None
+            if value is not None:
+                value = fold_constant(_jade_class(value))
+            yield value if value is not None else (v, True)
+            yield u'"'
+            continue
+        if value is not None:
+            value = fold_constant(value)
+        yield u' %s="' % k
+        yield value if value is not None else (v, False)
+        yield u'"'
+
+    if id_:
+        yield u' id="%s"' % id_
+
+    if class_:
+        yield u' class="%s"' % class_
+
+    yield u'>'
+
+
+# String literals, brackets and + operators in Jinja2 source
+sum_token = re.compile(r''''[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*"|
+                       ([([{])|([)\]}])|(\+)''', re.X)
+
+
+def is_sum(expr):
+    """
+    Whether Jinja2 expression `expr` adds operands with + at the top level.
+    """
+    depth = 0
+    for m in sum_token.finditer(expr):
+        if m.group(1):
+            depth += 1
+        elif m.group(2):
+            depth -= 1
+        elif m.group(3) and not depth and expr[:m.start()].strip():
+            return True
+    return False
+
+
+def escaped_value(expr):
+    """
+    Return Jinja2 source escaping the value of attribute expression `expr`.
+
+    Filters bind tighter than operators, so the value is parenthesized.
+    Sums are left as they are, since templates concatenate with +, as in
+    '/users/' + user.id: the Markup that |escape makes of the last operand
+    escapes the others when added to them.
+    """
+    if is_sum(expr):
+        return u'%s |escape' % expr
+    return u'(%s) |escape' % expr
+
+
 def default_start(tag):
     return '{%% %s %s %%}' % (tag.name, tag.head)
 
@@ -192,6 +475,93 @@ def default_end(tag):
     return '{%% end%s %%}' % tag.name
 
 
+string_literal = re.compile(r'''^(?:'([^'\\]*)'|"([^"\\]*)")$''')
+int_literal = re.compile(r'^-?\d+$')
+sequence_literal = re.compile(r'''^([[(])\s*(
+                                  (?:(?:'[^'\\]*'|"[^"\\]*")\s*,\s*)*
+                                  (?:'[^'\\]*'|"[^"\\]*")?
+                                  )\s*([])])$''',
+                              re.X)
+sequence_item = re.compile(r'''\'([^'\\]*)'|"([^"\\]*)"''')
+
+
+def literal_value(expr):
+    """
+    Return the value of `expr` if it is a string literal without escapes, an
+    integer literal, or a list or tuple of such strings, and None otherwise.
+    """
+    expr = expr.strip()
+    m = string_literal.match(expr)
+    if m:
+        return m.group(1) if m.group(1) is not None else m.group(2)
+    if int_literal.match(expr):
+        return int(expr)
+    m = sequence_literal.match(expr)
+    if m and m.group(1) + m.group(3) in ('[]', '()'):
+        items = [i.group(1) if i.group(1) is not None else i.group(2)
+                 for i in sequence_item.finditer(m.group(2))]
+        if m.group(1) == '[':
+            return items
+        if ',' in m.group(2) or not items:
+            return tuple(items)
+        # A parenthesized string
+        return items[0]
+    return None
+
+
+def fold_constant(value):
+    """
+    Return the escaped text for `value` as output by Jinja2, or None if it
+    can't be determined at compile time.
+    """
+    if not isinstance(value, (basestring, int)):
+        return None
+    return escape(unicode(value))
+
+
+def template_name(head):
+    """
+    Return the name of the template referred to by the head of an extends or
+    include tag, or None if it is not known at compile time.
+
+    The head is a Jinja2 expression, passed on as is; the name is only known
+    when it is a string literal.
+    """
+    m = string_literal.match(head.strip())
+    return m and (m.group(1) if m.group(1) is not None else m.group(2))
+
+
+# A path as jade takes it after include, e.g. includes/head or content.html;
+# expressions don't divide names, or take these attributes of them
+bare_path = re.compile(r'''^\s*((?:[\w.-]+/)+[\w.-]+|
+                           [\w.-]+\.(?:jade|html?|xml|svg|txt|md|markdown|
+                                     css|js))\s*$''', re.X)
+
+
+def include_head(head):
+    """
+    Return the head of an include tag as a Jinja2 expression: bare paths,
+    which jade's include takes, are quoted, adding the .jade extension when
+    the file name has none.  Other heads are Jinja2 expressions already.
+    """
+    m = bare_path.match(head)
+    if not m:
+        return head
+    path = m.group(1)
+    if '.' not in path.rsplit('/', 1)[-1]:
+        path += '.jade'
+    return u'"%s"' % path
+
+
+def mixin_call(head):
+    """
+    Turn the head of a mixin or + tag into a call, adding the parentheses
+    that may be left out when there are no arguments.
+    """
+    head = head.strip()
+    return head if head.endswith(')') else head + u'()'
+
+
 def doctype(tag):
     return doctypes.get(tag.head.lower() or 'default',
                         '<!DOCTYPE %s>' % tag.head)
@@ -207,19 +577,71 @@ control_blocks = defaultdict(
         '//':      (lambda tag: '<!--%s' % tag.head,
                     '-->'),
         '//-':     ('{#', '#}'),
+        '#':       ('', ''),
         ':':       (lambda tag: '{%% filter %s %%}' % tag.head,
                     '{% endfilter %}'),
-        'mixin':   (lambda tag: '{%% macro %s %%}' % tag.head,
+        'mixin':   (lambda tag: '{%% macro %s %%}' % mixin_call(tag.head),
                     '{% endmacro %}'),
+        '+':       (lambda tag: '{%% call %s %%}' % mixin_call(tag.head),
+                    '{% endcall %}'),
+        'cache':   (lambda tag: '{%% call _jade_fragment(%s) %%}' % tag.head,
+                    '{% endcall %}'),
+        'flush':   (flush_marker, ''),
         'prepend': (lambda tag: '{%% block %s %%}' % tag.head,
                     '{{ super() }} {% endblock %}'),
         'append':  (lambda tag: '{%% block %s %%} {{ super() }}' % tag.head,
                     '{% endblock %}'),
         'extends': (default_start, ''),
+        'include': (lambda tag: '{%% include %s %%}' %
+                    include_head(tag.head), ''),
         'doctype': (doctype, ''),
         'else':    ('{% else %}', '{% endif %}'),
     })
 
 
+def compile_string(text, dependencies=None, passes=(), **options):
+    """
+    Compile jade source `text` and return the resulting Jinja2 source.
+    LexError is propagated to the caller.
+
+    If `dependencies` is a list, the names of templates that `text` extends
+    or includes are appended to it, along with those of templates passes
+    inlined.
+
+    If `passes` is non-empty, the template is first built into a tree, which
+    is run through the passes in order (see jade.tree).  `options` are passed
+    to Compiler.
+    """
+    sink = Sink()
+    compiler = Compiler(sink, **options)
+    if passes:
+        tree = run_passes(build(text), passes)
+        replay(tree, compiler)
+        if dependencies is not None:
+            dependencies.extend(tree.dependencies)
+    else:
+        Parser(text, compiler)()
+    if dependencies is not None:
+        dependencies.extend(compiler.dependencies)
+    return sink.getvalue()
+
+
+def main(argv=None):
+    ap = argument_parser()
+    ap.add_argument('--compact', action='store_true',
+                    help='drop newlines and indentation between tags')
+    ap.add_argument('--flush-after', metavar='TAGS', default='',
+                    help='comma-separated names of elements to put a flush '
+                         'point after')
+    ap.add_argument('--instrument', metavar='NAME',
+                    help='add render-time profiling hooks, tagged with the '
+                         'template name NAME')
+    parse_main(lambda args: Compiler(
+        stdout, compact=args.compact,
+        flush_after=filter(None, args.flush_after.split(',')),
+        instrument=args.instrument and args.instrument.decode('utf8')),
+        argv, ap)
+
+
 if __name__ == '__main__':
-    main(Compiler(stdout))
+    main()
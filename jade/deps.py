@@ -0,0 +1,67 @@
+import json
+
+
+class DependencyGraph(object):
+    """
+    Records which templates each template depends on through `extends` and
+    `include`.  Template names are those used by the loader, i.e. relative to
+    the template root.
+    """
+    def __init__(self, deps=None):
+        # template -> set of templates it depends on
+        self.deps = dict((k, set(v)) for k, v in (deps or {}).items())
+
+    def update(self, name, deps):
+        self.deps[name] = set(deps)
+
+    def remove(self, name):
+        self.deps.pop(name, None)
+
+    def dependencies(self, name):
+        """
+        Return the set of templates that `name` depends on, directly or
+        indirectly.
+        """
+        result = set()
+        todo = list(self.deps.get(name, ()))
+        while todo:
+            dep = todo.pop()
+            if dep not in result:
+                result.add(dep)
+                todo.extend(self.deps.get(dep, ()))
+        result.discard(name)
+        return result
+
+    def dependents(self, names):
+        """
+        Return the set of templates that depend on any of `names`, directly
+        or indirectly, including `names` themselves.
+        """
+        rdeps = {}
+        for name, deps in self.deps.items():
+            for dep in deps:
+                rdeps.setdefault(dep, set()).add(name)
+        result = set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name not in result:
+                result.add(name)
+                todo.extend(rdeps.get(name, ()))
+        return result
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict((k, sorted(v)) for k, v in self.deps.items()), f,
+                      indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a graph saved with save.  A missing file gives an empty graph.
+        """
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except IOError:
+            return cls()
@@ -0,0 +1,115 @@
+"""
+Stores for the fragment cache, which keeps the rendered HTML of `cache`
+blocks:
+
+    cache 'menu', 300
+      ul#menu
+        ...
+
+renders the block once and reuses the HTML for 300 seconds.  Without a ttl,
+the HTML is kept until the store evicts it.  Keys are global; include
+whatever the fragment depends on, e.g. `cache ('menu', lang), 300`.
+
+Templates use the Fragments object in the `_jade_fragment` global (see
+jade.runtime), which by default keeps fragments in an LRUStore.  Any object
+implementing FragmentStore can be used instead, e.g. a memcached client.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class FragmentStore(object):
+    """
+    The interface of fragment stores.  Values are unicode strings.
+    """
+    def get(self, key):
+        """
+        Return the value stored for `key`, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Store `value` for `key`, for `ttl` seconds if it is not None.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Return a dictionary of counters.
+        """
+        return {}
+
+
+class LRUStore(FragmentStore):
+    """
+    An in-process store holding up to `max_entries` values totalling up to
+    `max_size` characters, evicting the least recently used ones beyond
+    that.  Values expire after their ttl, or `default_ttl` if they have
+    none.  It may be shared between threads.
+    """
+    def __init__(self, max_entries=1024, max_size=16 * 1024 * 1024,
+                 default_ttl=None, clock=time.time):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.clock = clock
+        # key -> (value, expiry time or None), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= self.clock():
+                self.size -= len(value)
+                self.expirations += 1
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.default_ttl
+        if len(value) > self.max_size:
+            return
+        expires = None if ttl is None else self.clock() + ttl
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = (value, expires)
+            self.size += len(value)
+            while (len(self.entries) > self.max_entries or
+                   self.size > self.max_size):
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[0])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'size': self.size,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
@@ -0,0 +1,137 @@
+import os
+
+from jinja2 import BaseLoader, TemplateSyntaxError, TemplateNotFound
+
+from .compile import compile_string
+from .deps import DependencyGraph
+from .parse import LexError
+from .runtime import helpers, install
+
+
+class JadeLoader(BaseLoader):
+    """
+    A Jinja2 loader that wraps another loader and compiles templates whose
+    names end with one of `extensions` from jade on demand.  Other templates
+    are passed through untouched.
+
+    Compiled sources are kept in memory, keyed on the template name and the
+    modification time of its file (or the source itself when the wrapped
+    loader doesn't give a filename), so that reloading an unchanged template
+    never goes through the parser again.
+
+    If `cache` is given, it should be a FileCache and is consulted before
+    compiling, unless a tree pass reads other templates.  Other keyword
+    arguments are passed to the Compiler, so that for example an environment
+    for production can use compact output.  With `instrument=True`, the
+    profiling hooks of each template are tagged with its name.
+
+    The runtime helpers called by compiled templates are installed in the
+    environment the first time a jade template is loaded.
+
+    The templates each template extends or includes are recorded in
+    `graph`, and a template is reported as out of date to Jinja2 whenever one
+    of them changes.  With tree passes that inline those templates, the
+    template is then compiled again.  The sources of those templates are
+    only read again when the uptodate function the wrapped loader gave for
+    them says they changed.
+    """
+    def __init__(self, loader, extensions=('.jade',), cache=None,
+                 **options):
+        self.loader = loader
+        self.extensions = tuple(extensions)
+        self.cache = cache
+        self.options = options
+        self.reads_templates = any(p.reads_templates
+                                   for p in options.get('passes', ()))
+        # template name -> (stamp, compiled source)
+        self.compiled = {}
+        # dependency name -> (stamp, uptodate function of the wrapped loader)
+        self.dependencies = {}
+        self.graph = DependencyGraph()
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(
+            environment, template)
+        if not template.endswith(self.extensions):
+            return source, filename, uptodate
+        if not helpers.viewkeys() <= environment.globals.viewkeys():
+            install(environment)
+
+        stamp = self._stamp(source, filename)
+        if self.reads_templates:
+            # The output includes the templates this one depends on
+            stamp = (stamp, self._dependency_stamps(environment, template))
+        cached = self.compiled.get(template)
+        if cached and cached[0] == stamp:
+            compiled = cached[1]
+        else:
+            deps = []
+            options = self.options
+            if options.get('instrument') is True:
+                options = dict(options, instrument=template)
+            try:
+                if self.cache is not None and not self.reads_templates:
+                    compiled = self.cache.compile(source, deps, **options)
+                else:
+                    compiled = compile_string(source, deps, **options)
+            except LexError as e:
+                raise TemplateSyntaxError(e.msg, e.pos[0], template, filename)
+            self.graph.update(template, deps)
+            if self.reads_templates:
+                stamp = (stamp[0],
+                         self._dependency_stamps(environment, template))
+            self.compiled[template] = (stamp, compiled)
+        return compiled, filename, self._uptodate(environment, template,
+                                                  uptodate)
+
+    def _uptodate(self, environment, template, uptodate):
+        """
+        Combine the uptodate function of `template` with those of all the
+        templates it depends on.
+        """
+        checks = [uptodate] if uptodate else []
+        for dep in self.graph.dependencies(template):
+            loaded = self._dependency(environment, dep)
+            if loaded:
+                checks.append(loaded[1])
+        if not checks:
+            return uptodate
+        return lambda: all(check() for check in checks if check)
+
+    def _dependency_stamps(self, environment, template):
+        stamps = []
+        for dep in sorted(self.graph.dependencies(template)):
+            loaded = self._dependency(environment, dep)
+            if loaded:
+                stamps.append((dep, loaded[0]))
+        return tuple(stamps)
+
+    def _dependency(self, environment, dep):
+        """
+        Return the stamp and uptodate function of template `dep`, or None if
+        it doesn't exist.  The source is only read when the stored uptodate
+        function is missing or reports a change.
+        """
+        loaded = self.dependencies.get(dep)
+        if loaded and loaded[1] and loaded[1]():
+            return loaded
+        try:
+            source, filename, uptodate = self.loader.get_source(
+                environment, dep)
+        except TemplateNotFound:
+            self.dependencies.pop(dep, None)
+            return None
+        loaded = self.dependencies[dep] = (self._stamp(source, filename),
+                                           uptodate)
+        return loaded
+
+    def _stamp(self, source, filename):
+        if filename:
+            try:
+                return os.path.getmtime(filename)
+            except OSError:
+                pass
+        return source
+
+    def list_templates(self):
+        return self.loader.list_templates()
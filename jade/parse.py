@@ -1,10 +1,12 @@
+import re
+import codecs
 import string
+import argparse
 
 from sys import stdin, stderr
 from functools import wraps
-from bisect import bisect_left
 
-from .utils import has_proper_prefix, repr_calling, find_all
+from .utils import has_proper_prefix, repr_calling
 
 
 class LexError(Exception):
@@ -31,36 +33,162 @@ class LexerBug(LexError):
     pass
 
 
+# Compiled patterns for AbstractLexer.accept_run, keyed by the string of
+# valid characters
+_run_patterns = {}
+
+
+def run_pattern(valid):
+    """
+    Return a compiled pattern matching a (possibly empty) run of characters
+    in the string `valid`.
+    """
+    try:
+        return _run_patterns[valid]
+    except KeyError:
+        pattern = _run_patterns[valid] = re.compile(
+            u'[%s]*' % u''.join(re.escape(c) for c in valid))
+        return pattern
+
+
 class AbstractLexer(object):
     """
     A lexer keeps the state of lex parsing.
 
     This is the abstract class that provides helpers but define no states.
+
+    `text` is either a string, or a file-like object that is read in chunks
+    of `chunk_size` as the lexer needs more input.  Byte strings read from
+    it are decoded as UTF-8.  When reading from a file, states may call
+    `discard` to throw away text that has been consumed.
+
+    When `stats` is set to a ParseStats, time and characters consumed by each
+    state are recorded there.
     """
+    stats = None
+    chunk_size = 64 * 1024
 
     def __init__(self, text, init_state=None):
-        self.text = text
+        if hasattr(text, 'read'):
+            self.reader = text
+            self.decoder = codecs.getincrementaldecoder('utf8')()
+            self.text = u''
+        else:
+            self.reader = None
+            self.text = text
 
         self.pos = self.start = 0
         self.init_state = init_state
-        self.newline_pos = ([-1] + list(find_all(self.text, '\n')) +
-                            [len(self.text)])
+        # Number of characters and lines discarded from the start of text
+        self.offset = self.line_offset = 0
 
     def __call__(self):
+        if self.stats is not None:
+            return self._profiled_call()
         state = self.init_state
         while state is not None:
             if self.start != self.pos:
                 raise self.error('State starts with inconsistent state')
             state = state()
 
+    def _profiled_call(self):
+        stats = self.stats
+        timer = stats.timer
+        state = self.init_state
+        prev = None
+        while state is not None:
+            if self.start != self.pos:
+                raise self.error('State starts with inconsistent state')
+            name = state.__name__
+            pos = self.offset + self.pos
+            t = timer()
+            state = state()
+            stats.record(prev, name, timer() - t,
+                         self.offset + self.pos - pos)
+            prev = name
+
     def error(self, msg, cls=LexError):
-        lineno = bisect_left(self.newline_pos, self.start)
-        last_newline = self.newline_pos[lineno - 1]
+        last_newline = self.text.rfind(u'\n', 0, self.start)
+        lineno = self.line_offset + self.text.count(u'\n', 0, self.start) + 1
         colno = self.pos - last_newline
-        line = self.text[last_newline + 1:self.newline_pos[lineno]]
+        end = self._find(u'\n', self.start)
+        if end == -1:
+            end = len(self.text)
+        line = self.text[last_newline + 1:end]
         return cls(msg, (lineno, colno), line)
 
+    def _fill(self):
+        """
+        Read another chunk of input.  Returns whether there was any.
+        """
+        if self.reader is None:
+            return False
+        # Read at least as much as is already buffered, so that a token
+        # spanning many chunks is copied a bounded number of times
+        chunks = [self.text]
+        size = 0
+        while size < max(len(self.text), 1):
+            chunk = self.reader.read(self.chunk_size)
+            if not chunk:
+                self.reader = None
+                # Complain about truncated UTF-8
+                self.decoder.decode('', True)
+                break
+            if isinstance(chunk, str):
+                chunk = self.decoder.decode(chunk)
+            chunks.append(chunk)
+            size += len(chunk)
+        if not size:
+            return False
+        self.text = u''.join(chunks)
+        return True
+
+    def _need(self, end):
+        """
+        Try to make text at least `end` characters long.
+        """
+        while len(self.text) < end and self._fill():
+            pass
+
+    def _find(self, sub, start):
+        i = self.text.find(sub, start)
+        while i == -1 and self.reader is not None:
+            searched = max(len(self.text) - len(sub) + 1, start)
+            if not self._fill():
+                break
+            i = self.text.find(sub, searched)
+        return i
+
+    def _search(self, pattern):
+        """
+        Search for the single-character `pattern` from the current position.
+        """
+        m = pattern.search(self.text, self.pos)
+        while m is None and self.reader is not None:
+            searched = len(self.text)
+            if not self._fill():
+                break
+            m = pattern.search(self.text, searched)
+        return m
+
+    def discard(self):
+        """
+        Throw away consumed text when reading from a file.  The line of the
+        current token is kept for error messages.
+        """
+        if self.reader is None:
+            return
+        cut = self.text.rfind(u'\n', 0, self.start) + 1
+        if cut >= self.chunk_size:
+            self.line_offset += self.text.count(u'\n', 0, cut)
+            self.offset += cut
+            self.text = self.text[cut:]
+            self.pos -= cut
+            self.start -= cut
+
     def off_end(self):
+        if self.pos >= len(self.text):
+            self._need(self.pos + 1)
         return self.pos >= len(self.text)
 
     def conclude(self):
@@ -72,6 +200,8 @@ class AbstractLexer(object):
         self.start = self.pos
 
     def peek(self, n=1):
+        if self.reader is not None:
+            self._need(self.pos + n)
         return self.text[self.pos:self.pos+n]
 
     def advance(self, n=1):
@@ -86,9 +216,11 @@ class AbstractLexer(object):
         self.pos = self.start
 
     def accept(self, *valids):
+        if self.reader is not None:
+            self._need(self.pos + max(map(len, valids)))
         for v in valids:
-            if self.peek(len(v)) == v:
-                self.advance(len(v))
+            if self.text.startswith(v, self.pos):
+                self.pos += len(v)
                 return v
         return u''
 
@@ -99,15 +231,34 @@ class AbstractLexer(object):
         return rune
 
     def accept_run(self, valid):
-        if not callable(valid):
-            valids = list(valid)
-            valid = lambda x: x in valids
+        """
+        Accept a run of characters, each of which either satisfies `valid` if
+        it is callable, or is in `valid` otherwise.
+        """
         start = self.pos
-        while valid(self.advance()):
-            pass
-        self.backup()
+        if callable(valid):
+            while valid(self.advance()):
+                pass
+            self.backup()
+            return self.text[start:self.pos]
+        pattern = run_pattern(valid)
+        self.pos = pattern.match(self.text, self.pos).end()
+        # The run may continue into input not read yet
+        while self.pos == len(self.text) and self._fill():
+            self.pos = pattern.match(self.text, self.pos).end()
         return self.text[start:self.pos]
 
+    def accept_line(self):
+        """
+        Accept everything up to, but not including, the next newline or the
+        end of text.
+        """
+        end = self._find(u'\n', self.pos)
+        if end == -1:
+            end = len(self.text)
+        self.pos = end
+        return self.text[end:end+1]
+
     def drop_run(self, valid):
         ret = self.accept_run(valid)
         self.drop()
@@ -115,6 +266,8 @@ class AbstractLexer(object):
 
 
 class HTMLTag(object):
+    __slots__ = ('name', 'class_', 'id_', 'attr')
+
     def __init__(self, name, class_=None, id_=None, attr=None):
         self.name = name
         self.class_ = class_
@@ -129,6 +282,9 @@ class HTMLTag(object):
 
 
 class ControlTag(object):
+    # var, seen_when and seen_default are set by the compiler on case tags
+    __slots__ = ('name', 'head', 'var', 'seen_when', 'seen_default')
+
     def __init__(self, name, head=None):
         self.name = name
         self.head = head
@@ -144,16 +300,27 @@ control_tag_aliases = {
 
 control_tags = control_tag_aliases.keys() + [
     '//',
-    'doctype', 'extends',
+    'doctype', 'extends', 'include',
     'if', 'elif', 'else', 'for',
     'block', 'append', 'prepend',
-    'case', 'when', 'default'
+    'case', 'when', 'default',
+    'mixin', '+',
+    'cache', 'flush',
 ]
 
 
 whitespace = ' \t\n'
 inline_whitespace = ' \t'
 
+# Characters significant to Parser.expr outside and inside string literals
+expr_opener_of = {u')': u'(', u']': u'[', u'}': u'{'}
+expr_openers = u''.join(expr_opener_of.values())
+expr_special = re.compile(u'[,)\n"\'([{\\]}]')
+expr_in_quote = {
+    u'"': re.compile(u'["\\\\]'),
+    u"'": re.compile(u"['\\\\]"),
+}
+
 
 def allow_eof(f):
     @wraps(f)
@@ -191,11 +358,7 @@ class Parser(AbstractLexer):
         return self.accept_run(self.valid_in_idents)
 
     def _advance_line(self):
-        while True:
-            rune = self.advance()
-            if rune in ('', '\n'):
-                self.backup()
-                return rune
+        return self.accept_line()
 
     def start(self):
         self.compiler.start(self)
@@ -252,6 +415,9 @@ class Parser(AbstractLexer):
             for k in range(0, blocks_to_close):
                 self.compiler.end_block()
 
+        if self.reader is not None:
+            # Nothing before this point is needed any more
+            self.discard()
         self.compiler.newlines(newlines)
         return self.tag
 
@@ -450,21 +616,25 @@ class Parser(AbstractLexer):
         introduced in the Python expression.  Also, both can appear in string
         literals.
         """
-        opener_of = {u')': u'(', u']': u'[', u'}': u'{'}
-        openers = opener_of.values()
-        closers = opener_of.keys()
-
         quote = None
         enclose = []
 
         while True:
-            rune = self.advance()
-            if not rune:
+            # Jump to the next character that matters
+            pattern = expr_in_quote[quote] if quote else expr_special
+            m = pattern.search(self.text, self.pos)
+            if not m and self.reader is not None:
+                m = self._search(pattern)
+            if not m:
+                self.pos = len(self.text) + 1
                 raise self.error('Unterminated Python expression')
+            rune = m.group()
+            self.pos = m.end()
             if quote:
                 if rune == quote:
                     quote = None
-                elif rune == '\\':
+                else:
+                    # backslash
                     if not self.advance():
                         raise self.error('Unterminated string literal')
             elif rune in u',)\n' and not enclose:
@@ -477,15 +647,15 @@ class Parser(AbstractLexer):
                         self.maybe_qualifier)
             elif rune in u'"\'':
                 quote = rune
-            elif rune in openers:
+            elif rune in expr_openers:
                 enclose.append(rune)
-            elif rune in closers:
-                opener = opener_of[rune]
+            elif rune in expr_opener_of:
+                opener = expr_opener_of[rune]
                 if not enclose:
                     raise self.error('No opening %r to close' % opener)
                 elif enclose[-1] != opener:
-                    raise self.error(
-                        "Closing %r doesn't match opening" % (rune, opener))
+                    raise self.error("Closing %r doesn't match opening %r"
+                                     % (rune, enclose[-1]))
                 else:
                     enclose.pop()
 
@@ -538,13 +708,34 @@ class DummyCompiler(object):
         return f
 
 
-def main(compiler):
-    text = stdin.read().decode('utf8')
-    parser = Parser(text, compiler)
+def argument_parser():
+    ap = argparse.ArgumentParser(description='Compile jade from stdin.')
+    ap.add_argument('--profile', action='store_true',
+                    help='print parser statistics to stderr')
+    return ap
+
+
+def main(compiler, argv=None, ap=None):
+    """
+    Parse stdin, feeding events to `compiler`.  Command line tools with
+    options of their own pass their ArgumentParser as `ap`, and a function
+    taking the parsed arguments and returning the compiler as `compiler`.
+    """
+    args = (ap or argument_parser()).parse_args(argv)
+    if ap is not None:
+        compiler = compiler(args)
+
+    parser = Parser(stdin, compiler)
+    if args.profile:
+        from .stats import ParseStats
+        stats = ParseStats()
+        stats.attach(parser)
     try:
         parser()
     except LexError as e:
         print >>stderr, e.pprint()
+    if args.profile:
+        print >>stderr, stats.report()
 
 
 if __name__ == '__main__':
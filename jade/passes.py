@@ -0,0 +1,935 @@
+"""
+Tree passes (see jade.tree).  Pass instances to compile_string, or to
+JadeLoader and the other entry points taking compiler options:
+
+    JadeLoader(loader, passes=[InlineMixins()])
+
+Passes work on the jade tree, without parsing the Jinja2 expressions in it
+beyond what they need; when in doubt, they leave the tree as it is.
+"""
+import os
+import re
+import ast
+import codecs
+import operator
+from copy import deepcopy
+
+from .tree import (Tree, Pass, Control, Literal, Newlines, build, walk,
+                   count_lines)
+from .compile import mixin_call, template_name, include_head, literal_value
+from .parse import LexError
+
+identifier = re.compile(r'(?<![\w.])[A-Za-z_]\w*')
+parameter = re.compile(r'[A-Za-z_]\w*$')
+call_head = re.compile(r'\s*([A-Za-z_]\w*)\s*\((.*)\)\s*$', re.S)
+keyword_argument = re.compile(r'\s*([A-Za-z_]\w*)\s*=(?!=)(.*)$', re.S)
+set_statement = re.compile(r'\s*set\s+(.*?)=', re.S)
+
+
+def names(text):
+    """
+    Return the set of identifiers in Jinja2 source `text`.  Attribute names
+    and words in string literals are included, so the result is a superset
+    of the names `text` uses.
+    """
+    return set(identifier.findall(text or u''))
+
+
+def node_text(node):
+    """
+    Return all source text carried by `node` itself, not its children.
+    """
+    if isinstance(node, Control):
+        return node.head or u''
+    if isinstance(node, Newlines):
+        return u''
+    if hasattr(node, 'text'):
+        return node.text
+    parts = [node.class_ or u'', node.id_ or u'']
+    for a in node.attr:
+        parts.extend([a] if isinstance(a, basestring) else a)
+    return u' '.join(parts)
+
+
+def split_arguments(text):
+    """
+    Split an argument list at top-level commas, returning the stripped
+    arguments.
+    """
+    args = []
+    depth = 0
+    quote = None
+    start = 0
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and not depth:
+            args.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    args.append(text[start:].strip())
+    if not args[-1]:
+        args.pop()
+    return args
+
+
+def parse_call(head):
+    """
+    Split the head of a mixin tag into (name, arguments), where arguments is
+    a list of (keyword or None, source).  Return None if the head doesn't
+    look like a call.
+    """
+    m = call_head.match(mixin_call(head))
+    if not m:
+        return None
+    args = []
+    for arg in split_arguments(m.group(2)):
+        kw = keyword_argument.match(arg)
+        if kw:
+            args.append((kw.group(1), kw.group(2).strip()))
+        else:
+            args.append((None, arg))
+    return m.group(1), args
+
+
+def set_names(nodes):
+    """
+    Return the set of names assigned by set statements in `nodes` and their
+    descendants.
+    """
+    bound = set()
+    for node in walk(nodes):
+        if isinstance(node, Control) and node.name == '-':
+            for child in node.children:
+                m = set_statement.match(getattr(child, 'text', u''))
+                if m:
+                    bound |= names(m.group(1))
+    return bound
+
+
+def scope_names(node):
+    """
+    Return the names Control `node` binds for its children, or None if it
+    doesn't open a scope.
+    """
+    if node.name == 'for':
+        return names(node.head) | set(['loop'])
+    if node.name == 'mixin':
+        return names(node.head) | set(['caller', 'varargs', 'kwargs'])
+    if node.name == 'with':
+        return names(node.head)
+    return None
+
+
+def is_comment(node):
+    """
+    Whether `node` outputs nothing but newlines: a //- comment, or the
+    newlines of nodes a pass dropped (see hidden_lines).
+    """
+    return isinstance(node, Control) and node.name in ('//-', '#')
+
+
+def is_call(node):
+    """
+    Whether `node` is a mixin call without a body.
+    """
+    return (isinstance(node, Control) and node.name in ('mixin', '+') and
+            not node.children)
+
+
+class InlineMixins(Pass):
+    """
+    Replace calls of small mixins by their body, in a `with` block binding
+    the arguments to the parameters.  This saves a macro call, with the
+    context and Markup it creates, at every call.
+
+    Only mixins defined at the top level of the template and spanning at
+    most `max_nodes` nodes are inlined.  Mixins that are recursive, use
+    `caller`, `varargs` or `kwargs`, or whose defaults refer to other
+    parameters stay macros, and so do calls with a body, or with arguments
+    that don't match the parameters.  Since a mixin body doesn't see the
+    variables of its caller, calls are only inlined where no variable the
+    body might use is bound.
+
+    The definitions are kept, since other templates may import them.  Output
+    lines after an inlined call no longer correspond to source lines.
+    """
+    def __init__(self, max_nodes=20):
+        self.max_nodes = max_nodes
+
+    def __call__(self, tree):
+        self.mixins = self.find_mixins(tree)
+        self.expand(tree.children, frozenset(set_names(tree.children)))
+        del self.mixins
+        return tree
+
+    def find_mixins(self, tree):
+        """
+        Return {name: (params, body, used names)} for the mixins that can be
+        inlined.  params is a list of (name, default or None).
+        """
+        mixins = {}
+        defined = set()
+        for node in tree.children:
+            if not (isinstance(node, Control) and node.name == 'mixin' and
+                    node.children):
+                continue
+            call = parse_call(node.head)
+            if not call:
+                continue
+            name, params = call
+            if name in defined:
+                # Defined twice; leave it to Jinja2
+                mixins.pop(name, None)
+                continue
+            defined.add(name)
+            body = list(walk(node.children))
+            size = sum(not isinstance(n, Newlines) for n in body)
+            if size > self.max_nodes:
+                continue
+            param_names = [kw or source for kw, source in params]
+            if not all(parameter.match(p) for p in param_names):
+                # *args or **kwargs
+                continue
+            defaults = u' '.join(source for kw, source in params if kw)
+            if names(defaults) & set(param_names):
+                continue
+            used = set().union(names(defaults),
+                               *(names(node_text(n)) for n in body))
+            if used & set(['caller', 'varargs', 'kwargs']):
+                continue
+            params = [(p, source if kw else None)
+                      for p, (kw, source) in zip(param_names, params)]
+            calls = set(parse_call(n.head)[0] for n in body
+                        if is_call(n) and parse_call(n.head))
+            mixins[name] = (params, node.children, used, calls)
+        # Drop mixins that can reach themselves through calls
+        for name in list(mixins):
+            seen = set()
+            todo = [name]
+            while todo:
+                for callee in mixins.get(todo.pop(), (0, 0, 0, ()))[3]:
+                    if callee == name:
+                        seen.add(name)
+                    elif callee not in seen:
+                        seen.add(callee)
+                        todo.append(callee)
+            if name in seen:
+                del mixins[name]
+        return dict((name, m[:3]) for name, m in mixins.iteritems())
+
+    def expand(self, nodes, bound):
+        """
+        Inline calls in `nodes` and their descendants.  `bound` holds the
+        names that may be bound by enclosing tags.
+        """
+        for i, node in enumerate(nodes):
+            if not isinstance(node, Control):
+                if hasattr(node, 'children'):
+                    self.expand(node.children, bound)
+                continue
+            if is_call(node):
+                inlined = self.inline(node, bound)
+                if inlined:
+                    nodes[i] = inlined
+                    node = inlined
+            inner = scope_names(node)
+            self.expand(node.children, bound | inner if inner else bound)
+
+    def inline(self, node, bound):
+        """
+        Return a with block replacing the call `node`, or None if it can't
+        be inlined.
+        """
+        call = parse_call(node.head)
+        if not call or call[0] not in self.mixins:
+            return None
+        name, args = call
+        params, body, used = self.mixins[name]
+        param_names = [p for p, _ in params]
+        values = {}
+        positional = [source for kw, source in args if kw is None]
+        if len(positional) > len(params) or any(
+                kw is None for kw, _ in args[len(positional):]):
+            return None
+        for p, source in zip(param_names, positional):
+            values[p] = source
+        for kw, source in args[len(positional):]:
+            if kw not in param_names or kw in values:
+                return None
+            values[kw] = source
+        for p, default in params:
+            if p not in values:
+                if default is None:
+                    return None
+                values[p] = default
+        if (used - set(param_names)) & bound:
+            return None
+        head = u', '.join(u'%s=%s' % (p, values[p]) for p in param_names)
+        return Control(u'with', head, deepcopy(body), node.line)
+
+
+class DirectoryResolver(object):
+    """
+    Resolves template names to the jade source of files under `root`, for
+    passes that read other templates.  Returns None for missing files.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def __call__(self, name):
+        try:
+            with codecs.open(os.path.join(self.root, name),
+                             encoding='utf8') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def __repr__(self):
+        return 'DirectoryResolver(%r)' % self.root
+
+
+class CannotFlatten(Exception):
+    """
+    Raised inside FlattenInheritance when the tree is to be left as is.
+    """
+
+
+inheritance_tags = ('block', 'append', 'prepend')
+
+
+def is_definition(node):
+    """
+    Whether `node` is a mixin definition or a code block, which run even in
+    templates that extend another.
+    """
+    return isinstance(node, Control) and (
+        node.name == '-' or node.name == 'mixin' and node.children)
+
+
+class FlattenInheritance(Pass):
+    """
+    Merge templates extending others with their layouts, following the chain
+    of extends tags, so that no block calls super() at render time.
+
+    `resolver` is called with the name of each layout and returns its jade
+    source, or None; DirectoryResolver(root) reads them from files.  The
+    chain is followed up to `max_depth` layouts.
+
+    The result is the outermost layout, with each block replaced by its
+    final contents: the last definition of the block along the chain, with
+    the contents of appends and prepends after it concatenated.  Blocks stay
+    blocks, so that templates extending the result at render time still
+    work; mixin definitions and code at the top level of the extending
+    templates are moved to the start.
+
+    The tree is left as is when a layout can't be resolved or is not a jade
+    template known at compile time, when a template has output before its
+    extends tag or a block defined twice, or when a block calls super()
+    explicitly.  The layouts are added to the dependencies of the tree.
+    Lines of the result correspond to lines of the outermost layout.
+    """
+    reads_templates = True
+
+    def __init__(self, resolver, max_depth=16):
+        self.resolver = resolver
+        self.max_depth = max_depth
+
+    def __call__(self, tree):
+        try:
+            return self.flatten(tree)
+        except CannotFlatten:
+            return tree
+
+    def flatten(self, tree):
+        chain = [tree]
+        layouts = []
+        while True:
+            name = self.parent(chain[-1])
+            if name is None:
+                break
+            if name in layouts or len(layouts) >= self.max_depth:
+                raise CannotFlatten
+            source = self.resolver(name)
+            if source is None:
+                raise CannotFlatten
+            try:
+                chain.append(build(source))
+            except LexError:
+                raise CannotFlatten
+            layouts.append(name)
+        if len(chain) == 1:
+            return tree
+
+        # name -> [(tag, children)], from the outermost layout in
+        self.blocks = {}
+        for t in reversed(chain):
+            seen = set()
+            for node in walk(t.children):
+                if 'super' in names(node_text(node)):
+                    raise CannotFlatten
+                if not (isinstance(node, Control) and
+                        node.name in inheritance_tags):
+                    continue
+                name = node.head.strip()
+                if name in seen:
+                    raise CannotFlatten
+                seen.add(name)
+                self.blocks.setdefault(name, []).append(
+                    (node.name, node.children))
+        self.active = set()
+
+        # Newlines and comments before the extends tags are output, and
+        # definitions run, before the outermost layout
+        children = []
+        for t in chain[:-1]:
+            for i, node in enumerate(t.children):
+                if isinstance(node, Control) and node.name == 'extends':
+                    break
+            children.extend(t.children[:i])
+            children.extend(node for node in t.children if is_definition(node))
+        children.extend(self.substitute(chain[-1].children))
+        del self.blocks, self.active
+        return Tree(children, tree.dependencies + layouts)
+
+    def parent(self, tree):
+        """
+        Return the name of the template `tree` extends, or None if it doesn't
+        extend any.
+        """
+        nodes = [node for node in tree.children
+                 if not isinstance(node, Newlines) and not is_comment(node)]
+        if not (nodes and isinstance(nodes[0], Control) and
+                nodes[0].name == 'extends'):
+            if any(isinstance(node, Control) and node.name == 'extends'
+                   for node in walk(tree.children)):
+                raise CannotFlatten
+            return None
+        for node in nodes[1:]:
+            if is_definition(node) or (isinstance(node, Control) and
+                                       node.name in inheritance_tags):
+                continue
+            # Other output after extends is ignored, unless it has blocks
+            # or code in it
+            if any(is_definition(child) or isinstance(child, Control) and
+                   child.name in inheritance_tags + ('extends',)
+                   for child in walk([node])):
+                raise CannotFlatten
+        name = template_name(nodes[0].head)
+        if not name or not name.endswith('.jade'):
+            raise CannotFlatten
+        return name
+
+    def contents(self, name):
+        """
+        Return the final contents of block `name`.
+        """
+        contents = None
+        for tag, children in self.blocks[name]:
+            if tag == 'block':
+                contents = children
+            elif contents is None:
+                raise CannotFlatten
+            elif tag == 'append':
+                # Mirrors the output of append and prepend tags
+                contents = [Literal(u' ')] + contents + children
+            else:
+                contents = children + contents + [Literal(u' ')]
+        if contents is None:
+            raise CannotFlatten
+        return contents
+
+    def substitute(self, nodes):
+        result = []
+        for node in nodes:
+            if isinstance(node, Control) and node.name in inheritance_tags:
+                name = node.head.strip()
+                if name in self.active:
+                    raise CannotFlatten
+                self.active.add(name)
+                node = Control(u'block', name,
+                               self.substitute(self.contents(name)),
+                               node.line)
+                self.active.discard(name)
+            elif hasattr(node, 'children'):
+                node.children = self.substitute(node.children)
+            result.append(node)
+        return result
+
+
+class InlineIncludes(Pass):
+    """
+    Replace include tags naming jade templates known at compile time by the
+    contents of the templates, so that rendering doesn't look them up and
+    render them separately.  Included templates are inlined recursively,
+    up to `max_depth` levels.
+
+    `resolver` is called with template names and returns their jade source,
+    or None; DirectoryResolver(root) reads them from files.  Includes that
+    would include a template that is already being included stay includes,
+    as do includes of templates that can't be resolved, that define blocks
+    or that extend another template.  When running FlattenInheritance too,
+    run it first, so that includes in layouts are inlined.
+
+    Definitions in included templates don't leak into the including
+    template, since the contents are put in a with block when they have any.
+    Names bound around the include tag, by for, with or set, may not reach
+    an included template as they do inlined, so includes of templates that
+    might use any of them stay includes.
+    The inlined templates are added to the dependencies of the tree.  Output
+    lines after an inlined include no longer correspond to source lines.
+    """
+    reads_templates = True
+
+    def __init__(self, resolver, max_depth=16):
+        self.resolver = resolver
+        self.max_depth = max_depth
+
+    def __call__(self, tree):
+        self.stack = []
+        self.included = []
+        tree.children = self.expand(tree.children,
+                                    frozenset(set_names(tree.children)))
+        for name in self.included:
+            if name not in tree.dependencies:
+                tree.dependencies.append(name)
+        del self.stack, self.included
+        return tree
+
+    def expand(self, nodes, bound):
+        """
+        Inline includes in `nodes` and their descendants.  `bound` holds the
+        names that may be bound around them.
+        """
+        result = []
+        for node in nodes:
+            if (isinstance(node, Control) and node.name == 'include' and
+                    not node.children):
+                inlined = self.inline(node, bound)
+                if inlined is not None:
+                    result.extend(inlined)
+                    continue
+            if hasattr(node, 'children'):
+                inner = isinstance(node, Control) and scope_names(node)
+                node.children = self.expand(node.children,
+                                            bound | inner if inner else bound)
+            result.append(node)
+        return result
+
+    def inline(self, node, bound):
+        """
+        Return the nodes replacing the include tag `node`, or None if it
+        can't be inlined.
+        """
+        name = template_name(include_head(node.head))
+        if (not name or not name.endswith('.jade') or name in self.stack or
+                len(self.stack) >= self.max_depth):
+            return None
+        source = self.resolver(name)
+        if source is None:
+            return None
+        try:
+            included = build(source)
+        except LexError:
+            return None
+        if any(isinstance(n, Control) and
+               n.name in inheritance_tags + ('extends',)
+               for n in walk(included.children)):
+            return None
+
+        self.stack.append(name)
+        count = len(self.included)
+        children = self.expand(included.children, bound)
+        self.stack.pop()
+        if bound & set().union(*(names(node_text(n))
+                                 for n in walk(children))):
+            # Not inlined after all, nor is anything it includes
+            del self.included[count:]
+            return None
+        if name not in self.included:
+            self.included.append(name)
+
+        # Jinja2 drops a single newline at the end of templates
+        if children and isinstance(children[-1], Newlines):
+            text = children[-1].text[:-1]
+            children[-1:] = [Newlines(text)] if text else []
+        if any(is_definition(n) for n in walk(children)):
+            return [Control(u'with', u'', children, node.line)]
+        return children
+
+
+class DispatchCase(Pass):
+    """
+    Compile case blocks with at least `min_whens` when tags, all of whose
+    heads are string or integer literals (or tuples of strings), into a
+    lookup of the index of the matching when tag, followed by a binary
+    search on the index.  A value is then matched with one lookup and a few
+    integer comparisons, instead of a comparison with every when head.
+
+    As with the if chain, the first matching when tag wins, and default is
+    used when none matches.  Values that can't be looked up, such as lists,
+    are compared with every head.
+    """
+    def __init__(self, min_whens=8):
+        self.min_whens = min_whens
+
+    def __call__(self, tree):
+        self.count = 0
+        for node in walk(tree.children):
+            if isinstance(node, Control) and node.name == 'case':
+                self.dispatch(node)
+        del self.count
+        return tree
+
+    def dispatch(self, case):
+        """
+        Rewrite the children of `case`, turning it into a block that only
+        contributes its children, if it qualifies.
+        """
+        # Leading newlines and comments, then one body per when or default
+        # tag, taking the newlines and comments after it
+        leading = []
+        bodies = []
+        heads = []
+        default = None
+        for node in case.children:
+            if isinstance(node, Newlines) or is_comment(node):
+                (bodies[-1] if bodies else leading).append(node)
+            elif (isinstance(node, Control) and node.name == 'when' and
+                    default is None):
+                value = literal_value(node.head or u'')
+                if value is None or isinstance(value, list):
+                    return
+                heads.append(node.head.strip())
+                bodies.append(list(node.children))
+            elif (isinstance(node, Control) and node.name == 'default' and
+                    default is None and bodies):
+                default = list(node.children)
+                bodies.append(default)
+            else:
+                return
+        if len(heads) < self.min_whens:
+            return
+
+        var = u'_jade_case%d' % self.count
+        self.count += 1
+        lookup = Control(u'-', None, [Literal(
+            u'set %s = _jade_case(%s, (%s,))' % (
+                var, case.head.strip(), u', '.join(heads)), case.line)],
+            case.line)
+        if default is None:
+            bodies.append([])
+        case.name = u'|'
+        case.head = None
+        case.children = [lookup] + leading + self.search(var, bodies, 0,
+                                                         len(bodies))
+
+    def search(self, var, bodies, lo, hi):
+        """
+        Return nodes outputting bodies[i] for the value i of `var`, which is
+        between `lo` and `hi`.
+        """
+        if hi - lo == 1:
+            return bodies[lo]
+        mid = (lo + hi) // 2
+        return [Control(u'if', u'%s < %d' % (var, mid),
+                        self.search(var, bodies, lo, mid)),
+                Control(u'else', None, self.search(var, bodies, mid, hi))]
+
+
+# Names Jinja2 treats as constants
+builtin_constants = {'true': True, 'false': False, 'none': None,
+                     'True': True, 'False': False, 'None': None}
+
+comparisons = {ast.Eq: operator.eq, ast.NotEq: operator.ne,
+               ast.Lt: operator.lt, ast.LtE: operator.le,
+               ast.Gt: operator.gt, ast.GtE: operator.ge,
+               ast.In: lambda a, b: a in b,
+               ast.NotIn: lambda a, b: a not in b}
+
+binding_statement = re.compile(r'\s*(?:set|for|import|from|macro)\b')
+
+# Numbers Jinja2 reads as Python does; excludes e.g. 010, 0x10 and 1L
+number_literal = re.compile(r'(?:-\s*)?(?:0|[1-9]\d*)(?:\.\d+)?(?![\w.])')
+
+
+class Unknown(Exception):
+    """
+    Raised when an expression can't be evaluated at compile time.
+    """
+
+
+class FoldConstants(Pass):
+    """
+    Evaluate the heads of if, elif and case tags (and of the when tags of
+    case tags) that depend only on `constants`, a dictionary of the values
+    of names known at compile time, and drop the branches that can't be
+    taken, including everything in them:
+
+        FoldConstants({'DEBUG': False, 'THEME': 'dark'})
+
+    Heads may use the names in `constants`, string and number literals,
+    true, false and none, tuples and lists, comparisons, and, or and not;
+    anything else, such as attributes, filters and tests, is left to
+    render time.  As in Jinja2, `and` and `or` only look at their right
+    operand when needed, so `DEBUG and user.admin` is false when DEBUG is.
+    Names bound anywhere in the template, e.g. by set or for, aren't
+    treated as constants.
+
+    The constants are not made available to templates at render time; pass
+    them as globals too if templates output them.  Dropped branches are
+    replaced by Jinja2 comments holding their newlines, so that compiled
+    lines still correspond to source lines while the rendered output is
+    the same as without the pass.  Run this pass before DispatchCase.
+    """
+    def __init__(self, constants):
+        self.constants = dict(constants)
+
+    def __repr__(self):
+        return 'FoldConstants(constants={%s})' % ', '.join(
+            '%r: %r' % item for item in sorted(self.constants.items()))
+
+    def __call__(self, tree):
+        bound = set()
+        for node in walk(tree.children):
+            if not isinstance(node, Control):
+                continue
+            if node.name in ('for', 'mixin', 'with'):
+                bound |= names(node.head)
+            elif node.name == '-':
+                for child in node.children:
+                    text = getattr(child, 'text', u'')
+                    if binding_statement.match(text):
+                        bound |= names(text)
+        self.known = dict(builtin_constants)
+        self.known.update((name, value)
+                          for name, value in self.constants.iteritems()
+                          if name not in bound)
+        self.source = None
+        tree.children = self.fold(tree.children)
+        del self.known, self.source
+        return tree
+
+    def evaluate(self, head):
+        """
+        Return the value of the Jinja2 expression `head`, raising Unknown if
+        it isn't known at compile time.
+        """
+        self.source = head.strip().encode('utf8')
+        try:
+            expr = ast.parse(self.source, mode='eval').body
+        except SyntaxError:
+            raise Unknown
+        return self.value(expr)
+
+    def value(self, node):
+        if isinstance(node, ast.Name):
+            if node.id not in self.known:
+                raise Unknown
+            return self.known[node.id]
+        if isinstance(node, ast.Str):
+            s = node.s
+            return s.decode('utf8') if isinstance(s, str) else s
+        if isinstance(node, ast.Num):
+            if not number_literal.match(self.source, node.col_offset):
+                raise Unknown
+            return node.n
+        if isinstance(node, ast.Tuple):
+            return tuple(self.value(e) for e in node.elts)
+        if isinstance(node, ast.List):
+            return [self.value(e) for e in node.elts]
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return not self.value(node.operand)
+            operand = self.value(node.operand)
+            if (isinstance(node.op, ast.USub) and
+                    isinstance(operand, (int, long, float))):
+                return -operand
+            raise Unknown
+        if isinstance(node, ast.BoolOp):
+            # Operands after the one deciding the result aren't evaluated
+            for operand in node.values[:-1]:
+                value = self.value(operand)
+                if bool(value) == isinstance(node.op, ast.Or):
+                    return value
+            return self.value(node.values[-1])
+        if isinstance(node, ast.Compare):
+            left = self.value(node.left)
+            for op, right in zip(node.ops, node.comparators):
+                right = self.value(right)
+                if type(op) not in comparisons:
+                    raise Unknown
+                try:
+                    if not comparisons[type(op)](left, right):
+                        return False
+                except Exception:
+                    raise Unknown
+                left = right
+            return True
+        raise Unknown
+
+    def truth(self, head):
+        """
+        Return whether the condition `head` holds, or None if it isn't known
+        at compile time.
+        """
+        try:
+            return bool(self.evaluate(head or u''))
+        except Unknown:
+            return None
+
+    def fold(self, nodes):
+        """
+        Return `nodes` with if chains and case tags in them and their
+        descendants folded.
+        """
+        result = []
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            i += 1
+            if not isinstance(node, Control) or node.name != 'if':
+                if isinstance(node, Control) and node.name == 'case':
+                    folded = self.fold_case(node)
+                    if folded is not None:
+                        result.extend(self.fold(folded))
+                        continue
+                if hasattr(node, 'children'):
+                    node.children = self.fold(node.children)
+                result.append(node)
+                continue
+
+            # The if tag, and the elif and else tags continuing it, which
+            # may only be separated by newlines
+            chain = [node]
+            j = i
+            while j < len(nodes):
+                if isinstance(nodes[j], Newlines):
+                    j += 1
+                elif (isinstance(nodes[j], Control) and
+                        nodes[j].name in ('elif', 'else') and
+                        chain[-1].name != 'else'):
+                    chain.extend(nodes[i:j + 1])
+                    i = j = j + 1
+                else:
+                    break
+            result.extend(self.fold_chain(chain))
+        return result
+
+    def fold_chain(self, chain):
+        """
+        Return the nodes replacing the if chain `chain`.
+        """
+        # Newlines between two branches are output inside the first, before
+        # the elif or else tag, so they are only rendered when it is taken;
+        # they are moved into it, so that this still holds when the branches
+        # around them are dropped
+        branches = []
+        for node in chain:
+            if isinstance(node, Newlines):
+                branches[-1].children.append(node)
+            else:
+                branches.append(node)
+        result = []
+        # The last branch kept as an if, elif or else tag.  The lines of the
+        # branches dropped after it are hidden at its end, since nothing may
+        # come between the branches of the chain.
+        kept = None
+        taken = False
+        for node in branches:
+            if not taken:
+                truth = (True if node.name == 'else' else
+                         self.truth(node.head))
+            if taken or truth is False:
+                (kept.children if kept else result).extend(
+                    hidden_lines(node))
+                continue
+            node.children = self.fold(node.children)
+            if truth is None:
+                node.name = u'elif' if kept else u'if'
+                kept = node
+                result.append(node)
+                continue
+            taken = True
+            if kept:
+                node.name = u'else'
+                node.head = None
+                kept = node
+                result.append(node)
+            else:
+                result.extend(node.children)
+        return result
+
+    def fold_case(self, case):
+        """
+        Return the nodes replacing the case tag `case` if the branch it takes
+        is known at compile time, and None otherwise.
+        """
+        try:
+            value = self.evaluate(case.head or u'')
+        except Unknown:
+            return None
+        branches = [n for n in case.children if not isinstance(n, Newlines)]
+        if not branches or any(
+                not isinstance(n, Control) or
+                n.name not in ('when', 'default') and not is_comment(n)
+                for n in branches):
+            return None
+        whens = [n for n in branches if not is_comment(n)]
+        if (whens[0].name != 'when' or
+                any(n.name == 'default' for n in whens[:-1])):
+            return None
+
+        chosen = None
+        for node in whens:
+            if node.name == 'default':
+                chosen = node
+                break
+            try:
+                if value == self.evaluate(node.head or u''):
+                    chosen = node
+                    break
+            except Unknown:
+                return None
+            except Exception:
+                return None
+
+        # Newlines and comments after a when or default tag are output in
+        # its branch, as with if chains
+        result = []
+        branch = None
+        for node in case.children:
+            if isinstance(node, Control) and node.name in ('when', 'default'):
+                branch = node
+            if branch is None:
+                result.append(node)
+            elif branch is not chosen:
+                result.extend(hidden_lines(node))
+            elif node is chosen:
+                result.extend(node.children)
+            else:
+                result.append(node)
+        return result
+
+
+def hidden_lines(node):
+    """
+    Return the nodes replacing the dropped `node`: a Jinja2 comment with as
+    many newlines as it spans, if any.  The comment keeps compiled lines in
+    correspondence with source lines without rendering anything.
+    """
+    n = count_lines(node)
+    if not n:
+        return []
+    return [Control(u'#', None, [Literal(u'{#%s#}' % (u'\n' * n))])]
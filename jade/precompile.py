@@ -0,0 +1,141 @@
+"""
+Compile a tree of jade templates ahead of time into Python modules, through
+Jinja2's module compilation, so that deployed processes load templates
+without lexing or parsing anything.
+
+    python -m jade.precompile [--compact] [--pyc] [--zip] src_dir target
+
+Workers then load templates with PrecompiledLoader:
+
+    env = Environment(loader=PrecompiledLoader('target'))
+
+Environment options that Jinja2 bakes into compiled code, such as
+autoescape, must be the same at precompile time and at run time.
+"""
+import os
+import sys
+import imp
+import marshal
+import argparse
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+from jinja2 import (Environment, FileSystemLoader, ModuleLoader,
+                    TemplateNotFound, TemplateSyntaxError)
+
+from .loader import JadeLoader
+from .runtime import helpers, install
+
+
+class PrecompiledLoader(ModuleLoader):
+    """
+    A Jinja2 loader serving templates precompiled by precompile from `path`,
+    a directory or zip file.  Installs the jade runtime helpers in the
+    environment.
+    """
+    def load(self, environment, name, globals=None):
+        if not helpers.viewkeys() <= environment.globals.viewkeys():
+            install(environment)
+        return super(PrecompiledLoader, self).load(environment, name,
+                                                   globals)
+
+
+def precompile(src_dir, target, extensions=None, zip=None, py_compile=False,
+               environment_options=None, log_function=None, **options):
+    """
+    Compile every template under `src_dir` into a Python module in `target`,
+    a directory, or a zip file if `zip` is 'deflated' or 'stored'.  With
+    `py_compile` set, .pyc files are written instead of .py files.  The
+    layout is that of Jinja2's Environment.compile_templates.
+
+    Templates ending with .jade are compiled from jade first, with `options`
+    passed to the Compiler.  Only templates ending with one of `extensions`
+    are compiled if it is given.  `environment_options` are passed to the
+    Jinja2 Environment.
+
+    Errors don't stop the run; a list of (name, error) tuples is returned for
+    templates that failed to compile, or to be read or decoded, including
+    ones removed during the run.
+    """
+    env = Environment(loader=JadeLoader(FileSystemLoader(src_dir), **options),
+                      **environment_options or {})
+    log = log_function or (lambda message: None)
+
+    if zip:
+        zip_file = ZipFile(target, 'w', {'deflated': ZIP_DEFLATED,
+                                         'stored': ZIP_STORED}[zip])
+
+        def write(filename, data):
+            info = ZipInfo(filename)
+            info.external_attr = 0o644 << 16
+            zip_file.writestr(info, data)
+            return os.path.join(target, filename)
+    else:
+        if not os.path.isdir(target):
+            os.makedirs(target)
+
+        def write(filename, data):
+            path = os.path.join(target, filename)
+            with open(path, 'wb') as f:
+                f.write(data)
+            return path
+
+    errors = []
+    try:
+        for name in env.list_templates(extensions):
+            try:
+                source, filename, _ = env.loader.get_source(env, name)
+                code = env.compile(source, name, filename, raw=True,
+                                   defer_init=True)
+            except (TemplateSyntaxError, TemplateNotFound, IOError, OSError,
+                    UnicodeDecodeError) as e:
+                errors.append((name, e))
+                continue
+            module = ModuleLoader.get_module_filename(name)
+            if py_compile:
+                # A .pyc without source; the mtime in the header is unused
+                path = write(module + 'c',
+                             imp.get_magic() + '\xff\xff\xff\xff' +
+                             marshal.dumps(compile(code, module, 'exec')))
+            else:
+                path = write(module, code.encode('utf8'))
+            log('Compiled "%s" as %s' % (name, path))
+    finally:
+        if zip:
+            zip_file.close()
+    return errors
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog='python -m jade.precompile',
+        description='Precompile a tree of templates into Python modules.')
+    ap.add_argument('src_dir')
+    ap.add_argument('target', help='output directory, or zip file with --zip')
+    ap.add_argument('--compact', action='store_true',
+                    help='drop newlines and indentation between tags')
+    ap.add_argument('--autoescape', action='store_true',
+                    help='compile with autoescaping turned on')
+    ap.add_argument('--pyc', action='store_true',
+                    help='write .pyc files instead of .py files')
+    ap.add_argument('--zip', action='store_true',
+                    help='write a zip file instead of a directory')
+    ap.add_argument('-v', '--verbose', action='store_true',
+                    help='log every template compiled')
+    args = ap.parse_args(argv)
+
+    def log(message):
+        if args.verbose:
+            print >>sys.stderr, message
+
+    errors = precompile(args.src_dir, args.target,
+                        zip='deflated' if args.zip else None,
+                        py_compile=args.pyc,
+                        environment_options={'autoescape': args.autoescape},
+                        log_function=log, compact=args.compact)
+    for name, error in errors:
+        print >>sys.stderr, '%s: %s' % (name, error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Render-time profiling of templates compiled with the `instrument` compiler
+option:
+
+    env = Environment(loader=JadeLoader(loader, instrument=True))
+    install(env, profiler=Profiler())
+    ...
+    print env.globals['_jade_profile'].report()
+
+Instrumented templates call the Profiler in the `_jade_profile` global (see
+jade.runtime) around loops, mixin calls and definitions, blocks, includes,
+cache tags and `=` and `!=` expressions, tagged with the template name and
+the jade source line.  Without the option, templates compile exactly as
+before and call nothing.
+
+Times are wall-clock times in seconds.  The total time of a line includes
+the lines it runs, e.g. the mixins a loop calls; its own time doesn't.
+"""
+import time
+import threading
+
+
+class Entry(object):
+    """
+    The statistics of a source line or mixin.
+    """
+    __slots__ = ('label', 'calls', 'total', 'own')
+
+    def __init__(self, label):
+        self.label = label
+        self.calls = 0
+        self.total = self.own = 0.0
+
+    def __repr__(self):
+        return 'Entry(%r, calls=%d, total=%f, own=%f)' % (
+            self.label, self.calls, self.total, self.own)
+
+
+class Profiler(object):
+    """
+    Collects the time spent on, and the number of runs of, each instrumented
+    line in `lines`, keyed by (template, line), and of each mixin in
+    `mixins`, keyed by (template, name).  It may be shared between threads.
+
+    The lines a render was running when it raised are never recorded.
+    Instrumented templates call start() before anything else, which drops
+    them from the stack of the thread.
+    """
+    timer = staticmethod(time.time)
+
+    def __init__(self):
+        self.lines = {}
+        self.mixins = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self):
+        """
+        Called when an instrumented template starts to render, unless it is
+        extended or included by another.
+        """
+        self.local.stack = []
+        return u''
+
+    def enter(self, template, line, label, mixin=None):
+        """
+        Called when an instrumented line starts to run.  Returns an empty
+        string, since templates call it in an output tag.
+        """
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        # [template, line, label, mixin, start time, time spent in children]
+        stack.append([template, line, label, mixin, self.timer(), 0.0])
+        return u''
+
+    def leave(self):
+        """
+        Called when the instrumented line entered last has run.
+        """
+        end = self.timer()
+        stack = getattr(self.local, 'stack', None)
+        if not stack:
+            return u''
+        template, line, label, mixin, start, children = stack.pop()
+        elapsed = end - start
+        if stack:
+            stack[-1][5] += elapsed
+        with self.lock:
+            self._record(self.lines, (template, line), label, elapsed,
+                         children)
+            if mixin is not None:
+                self._record(self.mixins, (template, mixin), label, elapsed,
+                             children)
+        return u''
+
+    def _record(self, entries, key, label, elapsed, children):
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = Entry(label)
+        entry.calls += 1
+        entry.total += elapsed
+        entry.own += elapsed - children
+
+    def reset(self):
+        """
+        Forget all statistics, and the open hooks of the current thread.
+        """
+        with self.lock:
+            self.lines.clear()
+            self.mixins.clear()
+        self.local.stack = []
+
+    def report(self, limit=None):
+        """
+        Return a table of the lines and mixins, by decreasing own time, up to
+        `limit` rows each.
+        """
+        out = ['%-40s %8s %10s %10s  %s' % ('line', 'calls', 'total', 'own',
+                                            'code')]
+        with self.lock:
+            lines = sorted(self.lines.items(), key=lambda item: -item[1].own)
+            mixins = sorted(self.mixins.items(),
+                            key=lambda item: -item[1].own)
+        for (template, line), entry in lines[:limit]:
+            out.append('%-40s %8d %8.2fms %8.2fms  %s' % (
+                '%s:%d' % (template, line), entry.calls, entry.total * 1e3,
+                entry.own * 1e3, shorten(entry.label)))
+        if mixins:
+            out.append('')
+            out.append('%-40s %8s %10s %10s' % ('mixin', 'calls', 'total',
+                                                'own'))
+            for (template, name), entry in mixins[:limit]:
+                out.append('%-40s %8d %8.2fms %8.2fms' % (
+                    '%s:%s' % (template, name), entry.calls,
+                    entry.total * 1e3, entry.own * 1e3))
+        return '\n'.join(out)
+
+
+def shorten(text, width=40):
+    text = u' '.join(text.split())
+    if len(text) > width:
+        text = text[:width - 3] + u'...'
+    return text.encode('utf8')
@@ -0,0 +1,942 @@
+"""
+Compile jade straight into a Python render function, without going through
+Jinja2 source.
+
+    python -m jade.render < some.jade
+
+prints the generated Python source.  To render a template:
+
+    from jade.render import Template
+    Template(text).render(name='World')
+
+Templates mean the same as with the Jinja2 compiler, for the part of Jinja2
+whose syntax is also valid Python: expressions with filters (`x|f`,
+`x|f(arg)`) and tests (`x is defined`), `set` statements in code blocks,
+`{{ expr }}` in text, if/elif/else, for, case, mixins, cache and flush.
+Extends, include, append and prepend, and `{% %}` in text are not
+supported.  Blocks are output in place.  The runtime is in jade.runtime.
+"""
+import re
+import ast
+import keyword
+import tokenize
+from sys import stdout
+from StringIO import StringIO
+
+from .compile import (start_tag, mixin_call, doctype, is_sum,
+                      escaped_value)
+from .parse import argument_parser, main as parse_main, Parser, HTMLTag
+from .runtime import Runtime
+from .stream import flush_marker
+
+
+class Unsupported(Exception):
+    """
+    Raised for expressions and statements that can't be translated.
+    """
+
+
+# As remapped by _remap_operators; ast.Add is ~
+binary_operators = {
+    ast.LShift: '+', ast.RShift: '-', ast.Mult: '*', ast.Div: '/',
+    ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**',
+}
+unary_operators = {
+    ast.Not: 'not ', ast.USub: '-', ast.UAdd: '+', ast.Invert: '~',
+}
+comparison_operators = {
+    ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>',
+    ast.GtE: '>=', ast.In: 'in', ast.NotIn: 'not in',
+}
+constants = {
+    'true': 'True', 'false': 'False', 'none': 'None',
+    'True': 'True', 'False': 'False', 'None': 'None',
+}
+
+
+# Binary operators of Jinja2 whose precedence differs from Python's, and the
+# Python operators standing in for them: ~ binds tighter than + and -, and
+# looser than *, like + in Python does relative to << and >> and *
+jinja_operators = {u'+': u'<<', u'-': u'>>', u'~': u'+'}
+# Python operators Jinja2 doesn't have
+foreign_operators = frozenset([u'<<', u'>>', u'&', u'^', u'<>', u'`'])
+# Integer literals with a leading zero, which Jinja2 reads as decimal, and
+# number literals it doesn't have
+octal_literal = re.compile(r'0+(\d+)$')
+foreign_literal = re.compile(r'0[xXoObB]|.*[lLjJ]$')
+
+
+def _ends_operand(tok):
+    """
+    Whether an operator after token `tok` is binary, or a ( starts a call.
+    """
+    return tok is not None and (
+        tok[0] in (tokenize.NUMBER, tokenize.STRING) or
+        tok[0] == tokenize.NAME and not keyword.iskeyword(tok[1]) or
+        tok[1] in u')]}')
+
+
+def _remap_operators(source):
+    """
+    Replace the binary operators of Jinja2 source `source` with the Python
+    operators in jinja_operators, so that Python parses them with Jinja2's
+    precedence.  Unary + and - are left alone.
+
+    Parenthesized expressions become calls of _jade_group, since the
+    parentheses matter to where filters apply and aren't kept in the AST.
+    Integer literals with leading zeros lose them.
+    """
+    tokens = list(tokenize.generate_tokens(StringIO(source).readline))
+    # Indices of ( starting a parenthesized expression, as opposed to a
+    # call or a tuple
+    groups = set()
+    # [index, whether a call, whether a tuple] for each open bracket
+    open_brackets = []
+    prev = None
+    for i, tok in enumerate(tokens):
+        kind, text = tok[:2]
+        if kind == tokenize.OP and text in u'([{':
+            open_brackets.append([i, text != u'(' or _ends_operand(prev),
+                                  False])
+        elif kind == tokenize.OP and text in u')]}' and open_brackets:
+            start, call, is_tuple = open_brackets.pop()
+            if not call and not is_tuple and start + 1 < i:
+                groups.add(start)
+        elif text == u',' and open_brackets:
+            open_brackets[-1][2] = True
+        if kind not in (tokenize.NL, tokenize.COMMENT):
+            prev = tok
+
+    result = []
+    prev = None
+    for i, tok in enumerate(tokens):
+        kind, text = tok[:2]
+        if kind == tokenize.OP and text in foreign_operators:
+            raise Unsupported('no %s operator in Jinja2' % text)
+        if kind == tokenize.NUMBER:
+            if foreign_literal.match(text):
+                raise Unsupported('no literal like %s in Jinja2' % text)
+            text = octal_literal.sub(r'\1', text)
+        if text in jinja_operators and _ends_operand(prev):
+            text = jinja_operators[text]
+        elif i in groups:
+            result.append((tokenize.NAME, u'_jade_group'))
+        result.append((kind, text))
+        if kind not in (tokenize.NL, tokenize.COMMENT):
+            prev = tok
+    return tokenize.untokenize(result)
+
+
+class Filter(ast.AST):
+    """
+    A filter applied to `value`.  `call` is the ast.Call when the filter
+    takes arguments, and None otherwise.
+
+    Filters are AST nodes, so that NodeTransformer keeps them in lists such
+    as call arguments, but without fields, since their operands have been
+    visited when they are made.
+    """
+    _fields = ()
+
+    def __init__(self, value, name, call=None):
+        self.value = value
+        self.name = name
+        self.call = call
+
+
+def _split_right(node):
+    """
+    Return the rightmost operand of `node` that a filter after it applies to
+    in Jinja2, where filters bind tighter than binary operators, and a function
+    rebuilding `node` with that operand replaced.
+    """
+    if (isinstance(node, ast.BinOp) and
+            not isinstance(node.op, ast.BitOr)):
+        operand, rebuild = _split_right(node.right)
+        return operand, lambda x: ast.BinOp(node.left, node.op, rebuild(x))
+    return node, lambda x: x
+
+
+def _split_left(node):
+    """
+    Like _split_right, for the leftmost operand, which is the filter.
+    """
+    if (isinstance(node, ast.BinOp) and
+            not isinstance(node.op, ast.BitOr)):
+        operand, rebuild = _split_left(node.left)
+        return operand, lambda x: ast.BinOp(rebuild(x), node.op, node.right)
+    return node, lambda x: x
+
+
+def _is_power(node):
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow)
+
+
+def _attach_left(node, rebuild):
+    """
+    Return power chain `node` with its leftmost operand passed through
+    `rebuild`.
+    """
+    if _is_power(node):
+        return ast.BinOp(_attach_left(node.left, rebuild), node.op,
+                         node.right)
+    return rebuild(node)
+
+
+class PowerResolver(ast.NodeTransformer):
+    """
+    Make ** left-associative, and bind unary + and - tighter than it, as in
+    Jinja2.  Parenthesized operands are calls of _jade_group, and stay as
+    they are.
+    """
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if _is_power(node) and _is_power(node.right):
+            # a ** (b ** c) -> (a ** b) ** c
+            return _attach_left(node.right,
+                                lambda x: ast.BinOp(node.left, node.op, x))
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.op, (ast.USub, ast.UAdd)) and
+                _is_power(node.operand)):
+            # -(a ** b) -> (-a) ** b
+            return _attach_left(node.operand,
+                                lambda x: ast.UnaryOp(node.op, x))
+        return node
+
+
+class FilterResolver(ast.NodeTransformer):
+    """
+    Turn `|` operators into Filter nodes, moving them to where Jinja2
+    applies them.
+    """
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.BitOr):
+            return node
+        value, rebuild_left = _split_right(node.left)
+        f, rebuild_right = _split_left(node.right)
+        if isinstance(f, ast.Name):
+            f = Filter(value, f.id)
+        elif isinstance(f, ast.Call) and isinstance(f.func, ast.Name):
+            f = Filter(value, f.func.id, f)
+        else:
+            raise Unsupported('bad filter')
+        return rebuild_left(rebuild_right(f))
+
+
+class Translator(object):
+    """
+    Translates Jinja2 expressions into Python expressions for a render
+    function.  Names used are reported to `scope`, which also decides what
+    they translate to, and provides the names of filters and tests.
+    """
+    def __init__(self, scope):
+        self.scope = scope
+
+    def parse(self, source, mode='eval'):
+        try:
+            tree = ast.parse(_remap_operators(source.strip()), mode=mode)
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise Unsupported('%s in %r' % (e.args[0], source.strip()))
+        return FilterResolver().visit(PowerResolver().visit(tree))
+
+    def expr(self, source):
+        return self.py(self.parse(source).body)
+
+    def py(self, node):
+        try:
+            method = getattr(self, 'py_' + node.__class__.__name__)
+        except AttributeError:
+            raise Unsupported('%s not supported' % node.__class__.__name__)
+        return method(node)
+
+    def py_Name(self, node):
+        if node.id in constants:
+            return constants[node.id]
+        return self.scope.name(node.id)
+
+    def py_Num(self, node):
+        return repr(node.n)
+
+    def py_Str(self, node):
+        s = node.s
+        if isinstance(s, str):
+            s = s.decode('utf8')
+        return repr(s)
+
+    def py_Attribute(self, node):
+        return '_jade_attribute(%s, %r)' % (self.py(node.value), node.attr)
+
+    def py_Subscript(self, node):
+        value = self.py(node.value)
+        if isinstance(node.slice, ast.Index):
+            return '_jade_item(%s, %s)' % (value, self.py(node.slice.value))
+        if isinstance(node.slice, ast.Slice):
+            return '%s[%s:%s%s]' % (
+                value,
+                self.py(node.slice.lower) if node.slice.lower else '',
+                self.py(node.slice.upper) if node.slice.upper else '',
+                ':' + self.py(node.slice.step) if node.slice.step else '')
+        raise Unsupported('extended slices not supported')
+
+    def call_args(self, node, extra=()):
+        args = [self.py(a) for a in node.args]
+        args.extend('%s=%s' % (k.arg, self.py(k.value))
+                    for k in node.keywords)
+        args.extend(extra)
+        if node.starargs:
+            args.append('*' + self.py(node.starargs))
+        if node.kwargs:
+            args.append('**' + self.py(node.kwargs))
+        return args
+
+    def call(self, node, extra=()):
+        return '%s(%s)' % (self.py(node.func),
+                           ', '.join(self.call_args(node, extra)))
+
+    def py_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id == '_jade_group':
+            # See _remap_operators
+            return self.py(node.args[0])
+        return self.call(node)
+
+    def py_Filter(self, node):
+        args = [self.py(node.value)]
+        if node.call:
+            args.extend(self.call_args(node.call))
+        return '%s(%s)' % (self.scope.filter(node.name), ', '.join(args))
+
+    def py_BinOp(self, node):
+        if isinstance(node.op, ast.Add):
+            return '(_jade_text(%s) + _jade_text(%s))' % (
+                self.py(node.left), self.py(node.right))
+        return '(%s %s %s)' % (self.py(node.left),
+                               binary_operators[type(node.op)],
+                               self.py(node.right))
+
+    def py_UnaryOp(self, node):
+        return '(%s%s)' % (unary_operators[type(node.op)],
+                           self.py(node.operand))
+
+    def py_BoolOp(self, node):
+        op = ' and ' if isinstance(node.op, ast.And) else ' or '
+        return '(%s)' % op.join(self.py(v) for v in node.values)
+
+    def py_Compare(self, node):
+        if any(isinstance(op, (ast.Is, ast.IsNot)) for op in node.ops):
+            return self.test(node)
+        parts = [self.py(node.left)]
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(comparison_operators[type(op)])
+            parts.append(self.py(right))
+        return '(%s)' % ' '.join(parts)
+
+    def test(self, node):
+        """
+        `x is name` and `x is name(args)` apply the test called name.
+        """
+        if len(node.ops) != 1:
+            raise Unsupported('tests can not be chained')
+        test = node.comparators[0]
+        if isinstance(test, ast.Call) and isinstance(test.func, ast.Name):
+            name, args = test.func.id, self.call_args(test)
+        elif isinstance(test, ast.Name):
+            name, args = test.id, []
+        else:
+            raise Unsupported('bad test')
+        result = '%s(%s)' % (self.scope.test(name), ', '.join(
+            [self.py(node.left)] + args))
+        if isinstance(node.ops[0], ast.IsNot):
+            return '(not %s)' % result
+        return result
+
+    def py_IfExp(self, node):
+        return '(%s if %s else %s)' % (
+            self.py(node.body), self.py(node.test), self.py(node.orelse))
+
+    def py_List(self, node):
+        return '[%s]' % ', '.join(self.py(e) for e in node.elts)
+
+    def py_Tuple(self, node):
+        if len(node.elts) == 1:
+            return '(%s,)' % self.py(node.elts[0])
+        return '(%s)' % ', '.join(self.py(e) for e in node.elts)
+
+    def py_Dict(self, node):
+        return '{%s}' % ', '.join('%s: %s' % (self.py(k), self.py(v))
+                                  for k, v in zip(node.keys, node.values))
+
+    def target(self, node):
+        """
+        Translate an assignment target, which is a name or a tuple of them.
+        """
+        if isinstance(node, ast.Name):
+            return self.scope.bind(node.id)
+        if isinstance(node, (ast.Tuple, ast.List)):
+            return '(%s,)' % ', '.join(self.target(e) for e in node.elts)
+        raise Unsupported('can only assign to names')
+
+    def statement(self, source):
+        """
+        Translate the `set` statement of a code block.
+        """
+        m = re.match(r'\s*set\s+(.*)$', source, re.S)
+        if not m:
+            raise Unsupported('only set statements are supported')
+        tree = self.parse(m.group(1), 'exec')
+        if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign):
+            raise Unsupported('bad set statement')
+        assign = tree.body[0]
+        value = self.py(assign.value)
+        return '%s = %s' % (' = '.join(self.target(t) for t in assign.targets),
+                            value)
+
+    def for_head(self, head):
+        """
+        Translate the head of a for tag into (target, iterable).
+        """
+        tree = self.parse('for %s: pass' % head.strip(), 'exec')
+        loop = tree.body[0]
+        # The iterable doesn't see the names the loop binds
+        iterable = self.py(loop.iter)
+        return self.target(loop.target), iterable
+
+    def signature(self, head):
+        """
+        Translate the head of a mixin definition into (name, parameters).
+        """
+        tree = self.parse('def %s: pass' % mixin_call(head), 'exec')
+        args = tree.body[0].args
+        params = [a.id for a in args.args]
+        defaults = [self.py(d) for d in args.defaults]
+        defaults = ['_jade_missing'] * (len(params) - len(defaults)) + defaults
+        params = ['%s=%s' % p for p in zip(params, defaults)]
+        params.append('caller=_jade_missing')
+        if args.vararg:
+            params.append('*' + args.vararg)
+        if args.kwarg:
+            params.append('**' + args.kwarg)
+        names = [a.id for a in args.args] + ['caller']
+        names += filter(None, [args.vararg, args.kwarg])
+        return tree.body[0].name, params, names
+
+
+class Frame(object):
+    """
+    A function in generated code.  Names used in a frame are looked up in
+    the context when it starts, unless `lookup` is false, in which case they
+    come from the enclosing function.  Names bound in an enclosing function,
+    even after this one is defined, are read from there when used, as Jinja2
+    macros do.
+    """
+    __slots__ = ('used', 'bound', 'params', 'lookup', 'slot', 'depth')
+
+    def __init__(self, params=(), lookup=True, slot=None, depth=0):
+        self.used = set()
+        self.bound = set(params)
+        self.params = set(params)
+        self.lookup = lookup
+        self.slot = slot
+        self.depth = depth
+
+
+class Block(object):
+    """
+    An open tag.  For for tags, `frame` is the index of the frame the loop
+    is in, and `names` maps the names bound in the loop body to the Python
+    names they translate to there.
+    """
+    __slots__ = ('tag', 'writer', 'header', 'loop_used', 'var', 'seen_when',
+                 'seen_default', 'call', 'frame', 'names')
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.loop_used = self.seen_when = self.seen_default = False
+        self.var = None
+
+
+interpolation = re.compile(r'\{\{(.*?)\}\}|\{#.*?#\}|\{%', re.S)
+
+prelude = [
+    '_jade_lookup = _jade_rt.lookup',
+    '_jade_out = _jade_rt.out',
+    '_jade_text = _jade_rt.text',
+    '_jade_escape = _jade_rt.escape',
+    '_jade_attribute = _jade_rt.attribute',
+    '_jade_item = _jade_rt.item',
+    '_jade_loop = _jade_rt.loop',
+    '_jade_markup = _jade_rt.markup',
+    '_jade_class = _jade_rt.jade_class',
+    '_jade_missing = _jade_rt.missing',
+]
+
+
+class PyCompiler(object):
+    """
+    Compiles parser events into the Python source of a module defining
+    root(context, runtime), a generator of the rendered output.  Output is
+    yielded at the flush points of the template body, after the flush
+    marker, and at the end; flush points inside mixins, call bodies, cache
+    tags and filters only output the marker.
+
+    If `stream` is given, the source is written to it when compiling ends;
+    it is always available from source().
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lines = []
+        self.static = []
+        self.depth = 1
+        self.blocks = []
+        self.writers = ['_jade_w']
+        self.frames = [Frame(slot=[], depth=1)]
+        # (frame, enclosing frames) of the functions of mixins, as they end
+        self.functions = []
+        self.filters = set()
+        self.tests = set()
+        self.tmpvar_count = 0
+        self.pending_mixin = None
+        # Newlines after an if or elif block, which go into the block if an
+        # elif or else follows, and after it otherwise
+        self.deferred_branch = None
+        # The tag of the last block closed, for matching else with if
+        self.last_closed = None
+        self.translator = Translator(self)
+
+    # Scope, for the translator
+    def name(self, name):
+        # Names bound in the bodies of enclosing loops, innermost first;
+        # mixins defined in a loop see them too, as closures.  The head of
+        # a for tag is not part of its body.
+        for block in reversed(self.blocks):
+            if block.tag.name != 'for' or block.var is None:
+                continue
+            if name in block.names:
+                if name == 'loop':
+                    block.loop_used = True
+                return block.names[name]
+        for frame in reversed(self.frames):
+            frame.used.add(name)
+            if frame.lookup:
+                break
+        return name
+
+    def bind(self, name):
+        """
+        Bind `name` and return the Python name it translates to.  Names
+        bound in a loop body, including the loop target, are renamed, so
+        that they don't change the names outside the loop.
+        """
+        for block in reversed(self.blocks):
+            if block.tag.name == 'for':
+                if block.frame == len(self.frames) - 1:
+                    if name not in block.names:
+                        block.names[name] = '_jade_%d_%s' % (
+                            self.tmpvar_count, name)
+                        self.tmpvar_count += 1
+                    return block.names[name]
+                break
+        self.frames[-1].bound.add(name)
+        return name
+
+    def filter(self, name):
+        self.filters.add(name)
+        return '_jade_f_' + name
+
+    def test(self, name):
+        self.tests.add(name)
+        return '_jade_t_' + name
+
+    def translate(self, f, *args):
+        try:
+            return f(*args)
+        except Unsupported as e:
+            raise self.parser.error(str(e))
+
+    def expr(self, source):
+        return self.translate(self.translator.expr, source)
+
+    # Output
+    def code(self, line):
+        self.flush_static()
+        self.lines.append('    ' * self.depth + line)
+
+    def flush_static(self):
+        if self.static:
+            text = u''.join(self.static)
+            self.static = []
+            if not text:
+                return
+            self.lines.append('    ' * self.depth + '%s(%r)' % (
+                self.writers[-1], text))
+
+    def write(self, expr):
+        self.code('%s(%s)' % (self.writers[-1], expr))
+
+    def begin(self, header):
+        self.code(header)
+        self.depth += 1
+        self.code('pass')
+
+    def begin_function(self, header, params=(), lookup=True):
+        self.begin(header)
+        slot = []
+        self.lines.append(slot)
+        self.frames.append(Frame(params, lookup, slot, self.depth))
+        self.code('_jade_buf = []')
+        self.code('_jade_w = _jade_buf.append')
+        self.writers.append('_jade_w')
+
+    def end_function(self):
+        self.code('return _jade_markup(u"".join(_jade_buf))')
+        self.writers.pop()
+        frame = self.frames.pop()
+        self.depth -= 1
+        if frame.lookup:
+            # What is bound in enclosing functions is only known at the end
+            self.functions.append((frame, list(self.frames)))
+
+    def fill_slots(self):
+        """
+        Output the lookups starting the functions of mixins, innermost
+        first.
+        """
+        for frame, enclosing in self.functions:
+            # Names bound in enclosing functions are used from there, unless
+            # also bound here; the function binding them looks them up
+            # first, in case the mixin is called before they are bound
+            for name in frame.used - frame.params - frame.bound:
+                for outer in reversed(enclosing):
+                    if name in outer.bound:
+                        outer.used.add(name)
+                        break
+            outer = set().union(*(f.bound for f in enclosing))
+            frame.slot[:] = [
+                '    ' * frame.depth + '%s = _jade_lookup(_jade_ctx, %r)' % (
+                    name, name)
+                for name in sorted(frame.used - frame.params)
+                if name in frame.bound or name not in outer]
+
+    def tmpvar(self):
+        name = '_jade_%d' % self.tmpvar_count
+        self.tmpvar_count += 1
+        return name
+
+    def put_branch(self, inside):
+        """
+        Output newlines deferred after an if or elif block, inside the block
+        if `inside` is true.
+        """
+        if self.deferred_branch is not None:
+            text = self.deferred_branch
+            self.deferred_branch = None
+            if inside:
+                self.depth += 1
+                self.static.append(text)
+                self.flush_static()
+                self.depth -= 1
+            else:
+                self.static.append(text)
+
+    def put_mixin(self):
+        """
+        Output the start of a pending mixin or + tag that has a body.  See
+        Compiler.put_mixin.
+        """
+        if not self.pending_mixin:
+            return
+        block = self.pending_mixin
+        self.pending_mixin = None
+        tag = block.tag
+        if tag.name == 'mixin':
+            name, params, names = self.translate(self.translator.signature,
+                                                 tag.head)
+            name = self.bind(name)
+            self.begin_function('def %s(%s):' % (name, ', '.join(params)),
+                                names)
+        else:
+            block.call = name = '_jade_caller%d' % self.tmpvar_count
+            self.tmpvar_count += 1
+            self.begin_function('def %s():' % name, lookup=False)
+
+    # Compiler interface
+    def start(self, parser):
+        self.parser = parser
+
+    def start_block(self, tag):
+        self.put_mixin()
+        self.put_branch(tag.name in ('elif', 'else'))
+        block = Block(tag)
+        self.blocks.append(block)
+        if isinstance(tag, HTMLTag):
+            for part in start_tag(tag):
+                if isinstance(part, basestring):
+                    self.static.append(part)
+                elif part[1]:
+                    self.write('_jade_escape(_jade_class(%s))' %
+                               self.expr(part[0]))
+                else:
+                    # Sums are escaped as by the Jinja2 backend
+                    value = part[0]
+                    if is_sum(value):
+                        value = escaped_value(value)
+                    self.write('_jade_escape(%s)' % self.expr(value))
+            return
+        name = tag.name
+        if name == 'if':
+            self.begin('if %s:' % self.expr(tag.head))
+        elif name in ('elif', 'else'):
+            prev = self.last_closed
+            if not prev or prev.name not in ('if', 'elif'):
+                raise self.parser.error('%s tag not after if tag' % name)
+            if name == 'elif':
+                self.begin('elif %s:' % self.expr(tag.head))
+            else:
+                self.begin('else:')
+        elif name == 'for':
+            block.frame = len(self.frames) - 1
+            block.names = {'loop': '_jade_loop%d' % self.tmpvar_count}
+            self.tmpvar_count += 1
+            target, iterable = self.translate(self.translator.for_head,
+                                              tag.head)
+            self.flush_static()
+            block.header = len(self.lines)
+            self.begin('for %s in %s:' % (target, iterable))
+            block.var = (target, iterable)
+        elif name == 'case':
+            block.var = self.tmpvar()
+            self.code('%s = %s' % (block.var, self.expr(tag.head)))
+        elif name in ('when', 'default'):
+            case = len(self.blocks) >= 2 and self.blocks[-2]
+            if not case or case.tag.name != 'case':
+                raise self.parser.error('%s tag not child of case tag' % name)
+            if name == 'when':
+                if case.seen_default:
+                    raise self.parser.error('when tag after default tag')
+                if case.seen_when:
+                    self.flush_static()
+                    self.depth -= 1
+                self.begin('%s %s == %s:' % (
+                    'elif' if case.seen_when else 'if', case.var,
+                    self.expr(tag.head)))
+                case.seen_when = True
+            else:
+                if case.seen_default:
+                    raise self.parser.error('duplicate default tag')
+                if not case.seen_when:
+                    raise self.parser.error('default tag before when tag')
+                self.flush_static()
+                self.depth -= 1
+                self.begin('else:')
+                case.seen_default = True
+        elif name in ('mixin', '+'):
+            self.pending_mixin = block
+        elif name == 'cache':
+            block.call = '_jade_caller%d' % self.tmpvar_count
+            self.tmpvar_count += 1
+            self.begin_function('def %s():' % block.call, lookup=False)
+        elif name == ':':
+            buf = '_jade_b%d' % self.tmpvar_count
+            writer = '_jade_w%d' % self.tmpvar_count
+            self.tmpvar_count += 1
+            self.code('%s = []' % buf)
+            self.code('%s = %s.append' % (writer, buf))
+            self.writers.append(writer)
+            block.var = buf
+        elif name == '//':
+            self.static.append(u'<!--%s' % tag.head)
+        elif name == 'doctype':
+            self.static.append(doctype(tag))
+        elif name == 'flush':
+            self.static.append(flush_marker)
+            if len(self.writers) == 1:
+                self.code('yield u"".join(_jade_buf)')
+                self.code('del _jade_buf[:]')
+        elif name in ('extends', 'include', 'append', 'prepend'):
+            raise self.parser.error(
+                '%s is not supported by the Python backend' % name)
+        # Nothing to do for block, verbatim blocks, and | tags
+
+    def end_block(self):
+        self.put_branch(False)
+        block = self.blocks.pop()
+        tag = block.tag
+        self.last_closed = tag
+        name = tag.name
+        if isinstance(tag, HTMLTag):
+            self.static.append(u'</%s>' % name)
+        elif name in ('if', 'elif'):
+            self.flush_static()
+            self.depth -= 1
+            self.deferred_branch = u''
+        elif name in ('else', 'for'):
+            self.flush_static()
+            self.depth -= 1
+            if name == 'for' and block.loop_used:
+                # Only pay for the loop variable when it is used
+                self.lines[block.header] = self.lines[block.header].replace(
+                    'for %s in %s:' % block.var,
+                    'for %s, %s in _jade_loop(%s):' % (
+                        (block.names['loop'],) + block.var), 1)
+        elif name == 'case':
+            if not block.seen_when:
+                raise self.parser.error('case tag has no when child')
+            self.flush_static()
+            self.depth -= 1
+        elif name in ('mixin', '+'):
+            if self.pending_mixin:
+                self.pending_mixin = None
+                call = self.expr(mixin_call(tag.head))
+                self.write('_jade_out(%s)' % call)
+            elif name == 'mixin':
+                self.flush_static()
+                self.end_function()
+            else:
+                self.flush_static()
+                self.end_function()
+                call = self.translate(self.call_with_caller, tag.head,
+                                      block.call)
+                self.write('_jade_out(%s)' % call)
+        elif name == 'cache':
+            self.flush_static()
+            self.end_function()
+            call = self.translate(self.call_with_caller,
+                                  '_jade_fragment(%s)' % tag.head, block.call)
+            self.write('_jade_out(%s)' % call)
+        elif name == ':':
+            self.flush_static()
+            self.writers.pop()
+            self.write('_jade_out(%s(_jade_markup(u"".join(%s))))' % (
+                self.filter(str(tag.head)), block.var))
+        elif name == '//':
+            self.static.append(u'-->')
+
+    def call_with_caller(self, head, caller):
+        tree = self.translator.parse(mixin_call(head))
+        if not isinstance(tree.body, ast.Call):
+            raise Unsupported('bad mixin call')
+        return self.translator.call(tree.body, ['caller=%s' % caller])
+
+    def literal(self, text):
+        self.put_mixin()
+        self.put_branch(False)
+        name = self.blocks and self.blocks[-1].tag.name
+        if name == '//-':
+            # Comments render nothing, not even their newlines
+            pass
+        elif name == '=':
+            self.write('_jade_out(%s)' % self.expr(text))
+        elif name == '!=':
+            self.write('_jade_text(%s)' % self.expr(text))
+        elif name == '-':
+            self.code(self.translate(self.translator.statement, text))
+        else:
+            self.text(text)
+
+    def text(self, text):
+        """
+        Output text, which may contain {{ expr }}.
+        """
+        pos = 0
+        for m in interpolation.finditer(text):
+            self.static.append(text[pos:m.start()])
+            pos = m.end()
+            if m.group(0) == '{%':
+                raise self.parser.error(
+                    'statements in text are not supported by the Python '
+                    'backend')
+            if m.group(1) is not None:
+                self.write('_jade_out(%s)' % self.expr(m.group(1)))
+        self.static.append(text[pos:])
+
+    def newlines(self, text):
+        self.put_mixin()
+        if self.blocks and self.blocks[-1].tag.name == '//-':
+            pass
+        elif self.deferred_branch is not None:
+            self.deferred_branch += text
+        else:
+            self.static.append(text)
+
+    def end(self):
+        self.put_branch(False)
+        # Jinja2 drops a single newline at the end of templates
+        if self.static and self.static[-1].endswith(u'\n'):
+            self.static[-1] = self.static[-1][:-1]
+        self.flush_static()
+        if self.stream is not None:
+            self.stream.write(self.source())
+
+    def source(self):
+        """
+        Return the Python source of the compiled module.
+        """
+        self.fill_slots()
+        root = self.frames[0]
+        root.slot[:] = ['    ' + line for line in prelude]
+        root.slot.extend('    _jade_f_%s = _jade_rt.filters[%r]' % (f, f)
+                         for f in sorted(self.filters))
+        root.slot.extend('    _jade_t_%s = _jade_rt.tests[%r]' % (t, t)
+                         for t in sorted(self.tests))
+        root.slot.extend('    %s = _jade_lookup(_jade_ctx, %r)' % (n, n)
+                         for n in sorted(root.used))
+        root.slot.extend(['    _jade_buf = []',
+                          '    _jade_w = _jade_buf.append'])
+        lines = ['from __future__ import division',
+                 'def root(_jade_ctx, _jade_rt):',
+                 root.slot]
+        lines.extend(self.lines)
+        lines.append('    yield u"".join(_jade_buf)')
+        out = []
+        for line in lines:
+            if isinstance(line, list):
+                out.extend(line)
+            else:
+                out.append(line)
+        return u'\n'.join(out) + u'\n'
+
+
+class Template(object):
+    """
+    A jade template compiled into a Python render function.  The keyword
+    arguments are passed to Runtime.
+    """
+    def __init__(self, text, autoescape=False, globals=None, filters=None,
+                 tests=None, filename='<template>'):
+        compiler = PyCompiler()
+        Parser(text, compiler)()
+        self.source = compiler.source()
+        self.runtime = Runtime(autoescape, globals, filters, tests)
+        for kind, names, known in (
+                ('filter', compiler.filters, self.runtime.filters),
+                ('test', compiler.tests, self.runtime.tests)):
+            for name in sorted(names):
+                if name not in known:
+                    raise ValueError('no %s named %r' % (kind, name))
+        namespace = {}
+        exec compile(self.source, filename, 'exec') in namespace
+        self.root = namespace['root']
+
+    def render(self, *args, **kwargs):
+        """
+        Render the template with the context given as for dict().
+        """
+        return u''.join(self.root(dict(*args, **kwargs), self.runtime))
+
+    def generate(self, *args, **kwargs):
+        """
+        Render the template as an iterator of strings, each produced as
+        rendering reaches a flush point; see jade.stream.
+        """
+        return self.root(dict(*args, **kwargs), self.runtime)
+
+
+def main(argv=None):
+    parse_main(lambda args: PyCompiler(stdout), argv, argument_parser())
+
+
+if __name__ == '__main__':
+    main()
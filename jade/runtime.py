@@ -1,4 +1,463 @@
+"""
+Helpers called by compiled templates.  Register them with a Jinja2
+environment with install(env).
+
+The rest of the module is the runtime of templates compiled to Python by
+jade.render, covering the parts of Jinja2 those templates use.
+"""
+import threading
+
+from .utils import escape
+from .fragments import LRUStore
+from .profiler import Profiler
+
+# Memoized results of _jade_class for tuples and frozensets of strings.
+# Other items aren't memoized: True, 1 and 1.0 are equal keys but join
+# differently.
+_class_cache = {}
+_class_cache_size = 1024
+
+
+def _join_classes(classes):
+    """
+    Join class names, skipping falsy ones and duplicates.
+    """
+    seen = set()
+    names = []
+    for name in classes:
+        if not name:
+            continue
+        if not isinstance(name, basestring):
+            name = unicode(name)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return u' '.join(names)
+
+
 def _jade_class(classes):
-    if isinstance(classes, list):
-        return u' '.join(classes)
+    """
+    Return the value of a class attribute for `classes`, which is either a
+    string, an iterable of class names (list, tuple, set, generator, ...) or
+    a dict mapping class names to conditions.  Falsy names, and names whose
+    condition is falsy, are skipped; duplicates are only kept once.
+    """
+    if isinstance(classes, basestring):
+        return classes
+    if isinstance(classes, (tuple, frozenset)):
+        try:
+            return _class_cache[classes]
+        except KeyError:
+            value = _join_classes(classes)
+            if all(isinstance(name, basestring) for name in classes):
+                if len(_class_cache) >= _class_cache_size:
+                    _class_cache.clear()
+                _class_cache[classes] = value
+            return value
+        except TypeError:
+            # Contains unhashable items
+            return _join_classes(classes)
+    if isinstance(classes, dict):
+        return _join_classes(name for name, cond in classes.iteritems()
+                             if cond)
+    if not classes:
+        return u''
+    if hasattr(classes, '__iter__'):
+        return _join_classes(classes)
     return classes
+
+
+# Memoized tables of _jade_case, by id of the tuple of keys.  Entries hold
+# on to the tuple, so that its id isn't reused while they exist.  Tables
+# are added to _case_tables; when it is full, it becomes _old_case_tables,
+# whose tables are dropped unless they are used again before the next
+# time.  Tables of templates that are gone, e.g. recompiled by auto_reload,
+# are thus freed, while lookups stay a single dict access.
+_case_tables = {}
+_old_case_tables = {}
+_case_tables_size = 256
+
+
+def _case_table(keys):
+    """
+    Return the table mapping each of `keys` to its first index, and keep it
+    in _case_tables.
+    """
+    global _case_tables, _old_case_tables
+    entry = _old_case_tables.get(id(keys))
+    if entry is None or entry[0] is not keys:
+        table = {}
+        for i, key in enumerate(keys):
+            table.setdefault(key, i)
+        entry = (keys, table)
+    if len(_case_tables) >= _case_tables_size:
+        _old_case_tables = _case_tables
+        _case_tables = {}
+    _case_tables[id(keys)] = entry
+    return entry[1]
+
+
+def _jade_case(value, keys):
+    """
+    Return the index of the first of `keys` equal to `value`, or len(keys)
+    if there is none.  `keys` is a constant of the compiled template, so its
+    table is only built once.
+    """
+    entry = _case_tables.get(id(keys))
+    if entry is not None and entry[0] is keys:
+        table = entry[1]
+    else:
+        table = _case_table(keys)
+    try:
+        return table.get(value, len(keys))
+    except TypeError:
+        # Unhashable
+        for i, key in enumerate(keys):
+            if value == key:
+                return i
+        return len(keys)
+
+
+class Fragments(object):
+    """
+    Renders the blocks of cache tags through `store`, a FragmentStore (an
+    LRUStore by default), counting hits and misses.  Errors of the store are
+    counted too, and the block is then rendered as if it weren't cached.
+    """
+    def __init__(self, store=None):
+        self.store = store if store is not None else LRUStore()
+        self.hits = self.misses = self.errors = 0
+        # Guards the counters, since renders in several threads share one
+        # Fragments; the store guards itself
+        self.lock = threading.Lock()
+
+    def __call__(self, key, ttl=None, caller=None):
+        try:
+            value = self.store.get(key)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            return Markup(caller())
+        if value is not None:
+            with self.lock:
+                self.hits += 1
+            return Markup(value)
+        with self.lock:
+            self.misses += 1
+        value = caller()
+        try:
+            self.store.set(key, unicode(value), ttl)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+        return Markup(value)
+
+    def stats(self):
+        """
+        Return a dictionary of hit, miss and error counts, and the counters
+        of the store.
+        """
+        stats = self.store.stats()
+        with self.lock:
+            stats.update(hits=self.hits, misses=self.misses,
+                         errors=self.errors)
+        return stats
+
+
+# The fragment cache of environments not given another one
+default_fragments = Fragments()
+
+# The profiler of environments not given another one, only called by
+# templates compiled with the instrument option
+default_profiler = Profiler()
+
+helpers = {
+    '_jade_case': _jade_case,
+    '_jade_class': _jade_class,
+    '_jade_fragment': default_fragments,
+    '_jade_profile': default_profiler,
+}
+
+
+def install(env, fragments=None, profiler=None):
+    """
+    Register the helpers as globals of Jinja2 environment `env`.  Cache
+    blocks use `fragments`, a Fragments object, or default_fragments.
+    Instrumented templates report to `profiler`, a Profiler, or
+    default_profiler.
+    """
+    env.globals.update(helpers)
+    if fragments is not None:
+        env.globals['_jade_fragment'] = fragments
+    if profiler is not None:
+        env.globals['_jade_profile'] = profiler
+
+
+class Markup(unicode):
+    """
+    Text that is safe to output without escaping, like Jinja2's Markup.
+    """
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    # Text added to markup is escaped
+    def __add__(self, other):
+        if isinstance(other, basestring) or hasattr(other, '__html__'):
+            return Markup(unicode.__add__(self, escape_value(other)))
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, basestring) or hasattr(other, '__html__'):
+            return Markup(unicode.__add__(escape_value(other), self))
+        return NotImplemented
+
+
+class UndefinedError(Exception):
+    """
+    Raised when an undefined value is used in a way that needs a value, like
+    Jinja2's UndefinedError.
+    """
+
+
+class Undefined(object):
+    """
+    The value of names not defined in the context.  It renders as an empty
+    string, is false and iterates as an empty sequence; getting one of its
+    attributes or items, or calling it, raises UndefinedError.
+    """
+    __slots__ = ()
+
+    def __call__(self, *args, **kwargs):
+        raise UndefinedError('an undefined value is not callable')
+
+    def __unicode__(self):
+        return u''
+
+    def __str__(self):
+        return ''
+
+    def __nonzero__(self):
+        return False
+
+    def __len__(self):
+        return 0
+
+    def __iter__(self):
+        return iter(())
+
+    def __repr__(self):
+        return 'missing'
+
+
+missing = Undefined()
+
+
+def to_text(value):
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+
+def escape_value(value):
+    """
+    Escape `value` for HTML, unless it is markup.
+    """
+    if hasattr(value, '__html__'):
+        return value.__html__()
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return escape(value)
+
+
+def get_attribute(obj, name):
+    """
+    obj.name in a template: an attribute, or failing that an item.
+    """
+    if isinstance(obj, Undefined):
+        raise UndefinedError('an undefined value has no attribute %r' % name)
+    try:
+        return getattr(obj, name)
+    except AttributeError:
+        pass
+    try:
+        return obj[name]
+    except (TypeError, LookupError):
+        return missing
+
+
+def get_item(obj, key):
+    """
+    obj[key] in a template: an item, or failing that an attribute.
+    """
+    if isinstance(obj, Undefined):
+        raise UndefinedError('an undefined value has no item %r' % (key,))
+    try:
+        return obj[key]
+    except (TypeError, LookupError):
+        if isinstance(key, basestring):
+            try:
+                return getattr(obj, key)
+            except AttributeError:
+                pass
+        return missing
+
+
+class LoopContext(object):
+    """
+    The `loop` variable inside for loops.
+    """
+    __slots__ = ('index0', 'length')
+
+    def __init__(self, length):
+        self.index0 = -1
+        self.length = length
+
+    index = property(lambda self: self.index0 + 1)
+    revindex = property(lambda self: self.length - self.index0)
+    revindex0 = property(lambda self: self.length - self.index0 - 1)
+    first = property(lambda self: self.index0 == 0)
+    last = property(lambda self: self.index0 == self.length - 1)
+
+    def cycle(self, *args):
+        return args[self.index0 % len(args)]
+
+
+def loop(iterable):
+    """
+    Yield (loop, item) for each item of `iterable`.
+    """
+    items = list(iterable)
+    context = LoopContext(len(items))
+    for item in items:
+        context.index0 += 1
+        yield context, item
+
+
+def string_filter(method):
+    """
+    A filter calling `method` of the text of its argument, keeping markup
+    markup.
+    """
+    def f(s, *args):
+        result = getattr(to_text(s), method)(*args)
+        if hasattr(s, '__html__'):
+            return Markup(result)
+        return result
+    return f
+
+
+def do_default(value, default=u'', boolean=False):
+    if isinstance(value, Undefined) or (boolean and not value):
+        return default
+    return value
+
+
+def do_join(value, d=u''):
+    return d.join(to_text(v) for v in value)
+
+
+def do_first(value):
+    for item in value:
+        return item
+    return missing
+
+
+def do_last(value):
+    for item in reversed(list(value)):
+        return item
+    return missing
+
+
+def do_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+
+def do_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+default_filters = {
+    'abs': abs,
+    'capitalize': string_filter('capitalize'),
+    'count': len,
+    'd': do_default,
+    'default': do_default,
+    'e': lambda s: Markup(escape_value(s)),
+    'escape': lambda s: Markup(escape_value(s)),
+    'first': do_first,
+    'float': do_float,
+    'int': do_int,
+    'join': do_join,
+    'last': do_last,
+    'length': len,
+    'list': list,
+    'lower': string_filter('lower'),
+    'replace': string_filter('replace'),
+    'safe': lambda s: Markup(to_text(s)),
+    'string': to_text,
+    'title': string_filter('title'),
+    'trim': string_filter('strip'),
+    'upper': string_filter('upper'),
+}
+
+default_tests = {
+    'defined': lambda v: not isinstance(v, Undefined),
+    'divisibleby': lambda v, n: v % n == 0,
+    'even': lambda v: v % 2 == 0,
+    'iterable': lambda v: hasattr(v, '__iter__'),
+    'none': lambda v: v is None,
+    'number': lambda v: isinstance(v, (int, long, float, complex)),
+    'odd': lambda v: v % 2 == 1,
+    'string': lambda v: isinstance(v, basestring),
+    'undefined': lambda v: isinstance(v, Undefined),
+}
+
+default_globals = {
+    '_jade_fragment': default_fragments,
+    'dict': dict,
+    'range': range,
+}
+
+
+class Runtime(object):
+    """
+    What templates compiled by jade.render run against: the globals,
+    filters and tests available to them, and helpers.  `globals`, `filters`
+    and `tests` are added to the defaults.
+
+    With `autoescape` set, output of expressions is escaped unless it is
+    markup, as with Jinja2's autoescape setting.
+    """
+    escape = staticmethod(escape_value)
+    text = staticmethod(to_text)
+    attribute = staticmethod(get_attribute)
+    item = staticmethod(get_item)
+    loop = staticmethod(loop)
+    markup = Markup
+    jade_class = staticmethod(_jade_class)
+    missing = missing
+
+    def __init__(self, autoescape=False, globals=None, filters=None,
+                 tests=None):
+        self.autoescape = autoescape
+        self.out = escape_value if autoescape else to_text
+        self.globals = dict(default_globals, **globals or {})
+        self.filters = dict(default_filters, **filters or {})
+        self.tests = dict(default_tests, **tests or {})
+
+    def lookup(self, context, name):
+        try:
+            return context[name]
+        except KeyError:
+            return self.globals.get(name, missing)
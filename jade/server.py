@@ -0,0 +1,302 @@
+"""
+A resident compile server, for tools that would otherwise start a new
+interpreter for every template they compile.
+
+    python -m jade.server [-s PATH] [-j N] [--cache DIR] [--compact]
+
+serves requests on the Unix socket PATH, each connection in its own thread,
+in N processes; without -s, it serves requests from stdin and writes replies
+to stdout.
+
+Requests and replies are JSON objects, each preceded by its length in bytes
+as a 4-byte big-endian integer.  A request is
+
+    {"source": "...", "options": {"compact": true}}
+
+where options are optional and override those of the server.  The reply is
+
+    {"output": "...", "dependencies": ["layout.jade"]}
+
+or, when the source doesn't compile,
+
+    {"error": {"type": "LexError", "message": "...",
+               "line": 3, "column": 5, "context": "..."}}
+
+Other errors have a type of BadRequest or InternalError and a message.  A
+connection may carry any number of requests.  Client talks to a server from
+Python.
+
+Every request is compiled by a new Parser and Compiler, so no state carries
+over from one request to the next.
+"""
+import os
+import sys
+import json
+import errno
+import socket
+import signal
+import struct
+import argparse
+import traceback
+import SocketServer
+
+from .cache import FileCache
+from .compile import compile_string
+from .parse import LexError, LexerBug
+
+header = struct.Struct('>I')
+max_message_size = 64 * 1024 * 1024
+
+# Compiler options requests may set
+request_options = ('compact',)
+
+
+class ProtocolError(Exception):
+    """
+    Raised for malformed messages.
+    """
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    while data and len(data) < size:
+        more = f.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def read_message(f):
+    """
+    Read a message from file-like object `f`.  Returns None at the end of
+    the stream.
+    """
+    data = read_exactly(f, header.size)
+    if not data:
+        return None
+    if len(data) < header.size:
+        raise ProtocolError('truncated header')
+    size, = header.unpack(data)
+    if size > max_message_size:
+        raise ProtocolError('message of %d bytes is too large' % size)
+    data = read_exactly(f, size)
+    if len(data) < size:
+        raise ProtocolError('truncated message')
+    try:
+        return json.loads(data.decode('utf8'))
+    except ValueError as e:
+        raise ProtocolError('bad JSON: %s' % e)
+
+
+def write_message(f, message):
+    data = json.dumps(message)
+    f.write(header.pack(len(data)) + data)
+    f.flush()
+
+
+def error_reply(type, message, **details):
+    details.update(type=type, message=message)
+    return {'error': details}
+
+
+class CompileServer(object):
+    """
+    Compiles requests, with `options` as default Compiler options.  If
+    `cache` is given, it is a FileCache, which may be shared with other
+    servers and processes.
+    """
+    def __init__(self, cache=None, **options):
+        self.cache = cache
+        self.options = options
+
+    def handle(self, request):
+        """
+        Return the reply to `request`.
+        """
+        if (not isinstance(request, dict) or
+                not isinstance(request.get('source'), basestring)):
+            return error_reply('BadRequest', 'no source')
+        options = dict(self.options)
+        extra = request.get('options') or {}
+        if not isinstance(extra, dict):
+            return error_reply('BadRequest', 'options is not an object')
+        for name, value in extra.iteritems():
+            if name not in request_options:
+                return error_reply('BadRequest', 'unknown option %s' % name)
+            options[str(name)] = value
+
+        deps = []
+        try:
+            if self.cache is not None:
+                output = self.cache.compile(request['source'], deps,
+                                            **options)
+            else:
+                output = compile_string(request['source'], deps, **options)
+        except LexError as e:
+            return error_reply(e.__class__.__name__, e.msg, line=e.pos[0],
+                               column=e.pos[1], context=e.line)
+        except Exception as e:
+            traceback.print_exc()
+            return error_reply('InternalError', '%s: %s' % (
+                e.__class__.__name__, e))
+        return {'output': output, 'dependencies': deps}
+
+    def serve(self, rfile, wfile):
+        """
+        Serve requests from `rfile` until it ends, writing replies to
+        `wfile`.
+        """
+        while True:
+            try:
+                request = read_message(rfile)
+            except ProtocolError as e:
+                # The stream can't be trusted any more
+                write_message(wfile, error_reply('BadRequest', str(e)))
+                return
+            if request is None:
+                return
+            write_message(wfile, self.handle(request))
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            self.server.compile_server.serve(self.rfile, self.wfile)
+        except socket.error as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class Shutdown(Exception):
+    """
+    Raised in the main process of serve_unix when it is asked to stop.
+    """
+
+
+def shutdown(signum, frame):
+    raise Shutdown
+
+
+def serve_unix(compile_server, path, processes=1):
+    """
+    Serve on the Unix socket `path` until interrupted or terminated, in
+    `processes` processes sharing the socket.  On SIGTERM or SIGINT, the
+    main process stops the others, waits for them and removes the socket.
+    """
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    server = UnixServer(path, RequestHandler)
+    server.compile_server = compile_server
+    children = []
+    for i in range(processes - 1):
+        pid = os.fork()
+        if not pid:
+            children = None
+            break
+        children.append(pid)
+    if children is not None:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, shutdown)
+    try:
+        server.serve_forever()
+    except Shutdown:
+        pass
+    finally:
+        if children is not None:
+            # Don't get interrupted while cleaning up
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_IGN)
+        server.server_close()
+        if children is not None:
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in children:
+                while True:
+                    try:
+                        os.waitpid(pid, 0)
+                    except OSError as e:
+                        if e.errno == errno.EINTR:
+                            continue
+                    break
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+class Client(object):
+    """
+    A connection to the compile server listening on the Unix socket `path`.
+    """
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+
+    def compile(self, source, dependencies=None, **options):
+        """
+        Like compile_string, but compiled by the server.  LexError is raised
+        for errors in the source, and ProtocolError for other errors.
+        """
+        write_message(self.wfile, {'source': source, 'options': options})
+        reply = read_message(self.rfile)
+        if reply is None:
+            raise ProtocolError('connection closed')
+        if 'error' in reply:
+            error = reply['error']
+            if error['type'] in ('LexError', 'LexerBug'):
+                cls = LexerBug if error['type'] == 'LexerBug' else LexError
+                raise cls(error['message'], (error['line'], error['column']),
+                          error['context'])
+            raise ProtocolError('%s: %s' % (error['type'], error['message']))
+        if dependencies is not None:
+            dependencies.extend(reply['dependencies'])
+        return reply['output']
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog='python -m jade.server',
+        description='Serve compile requests, on a Unix socket or on stdin '
+                    'and stdout.')
+    ap.add_argument('-s', '--socket',
+                    help='path of the Unix socket to listen on')
+    ap.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes serving the socket')
+    ap.add_argument('--cache', help='directory of a shared FileCache')
+    ap.add_argument('--compact', action='store_true',
+                    help='compile with compact output by default')
+    args = ap.parse_args(argv)
+
+    cache = FileCache(args.cache) if args.cache else None
+    compile_server = CompileServer(cache, compact=args.compact)
+    try:
+        if args.socket:
+            serve_unix(compile_server, args.socket, args.jobs)
+        else:
+            compile_server.serve(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
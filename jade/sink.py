@@ -0,0 +1,94 @@
+import re
+
+jinja_delimiter = re.compile(r'\{[{%#]')
+# Spaces or tabs starting the last line, which lstrip_blocks would strip
+# before an endraw tag
+trailing_indent = re.compile(r'\n[ \t]+$')
+
+
+def raw(text):
+    """
+    Return Jinja2 source that outputs `text` as is.
+    """
+    if not jinja_delimiter.search(text):
+        return text
+    # Whitespace goes inside the block: outside, trim_blocks would strip a
+    # newline after the endraw tag, and lstrip_blocks indentation before the
+    # raw tag.  Indentation before the endraw tag would still be stripped.
+    if 'endraw' not in text and not trailing_indent.search(text):
+        return u'{%% raw %%}%s{%% endraw %%}' % text
+    # The text can't go in a raw block; use a string literal, which no
+    # whitespace control applies to
+    text = text.replace('\\', '\\\\').replace("'", "\\'")
+    return u"{{ '%s' |safe}}" % text
+
+
+class Sink(object):
+    """
+    Collects compiler output in a buffer and passes it on to `target` in
+    large blocks.
+
+    Output is either Jinja2 source, written with write, or static text that
+    is to be output as is, written with write_static.  Consecutive static
+    text is coalesced into one chunk, which is wrapped in a raw block when it
+    contains Jinja2 delimiters.
+
+    `target` may be a file-like object, a socket (output is then encoded as
+    UTF-8), any callable taking a string, or None, in which case everything
+    is kept in memory and is available from getvalue.
+
+    Output is passed on when flush is called, or when maybe_flush is called
+    and at least `bufsize` characters are buffered.
+    """
+    def __init__(self, target=None, bufsize=64 * 1024):
+        self.target = target
+        self.bufsize = bufsize
+        self.chunks = []
+        self.static = []
+        self.size = 0
+        if target is None:
+            self._emit = None
+        elif hasattr(target, 'sendall'):
+            self._emit = lambda data: target.sendall(data.encode('utf8'))
+        elif hasattr(target, 'write'):
+            self._emit = target.write
+        else:
+            self._emit = target
+
+    def write(self, text):
+        if self.static:
+            self._end_static()
+        self.chunks.append(text)
+        self.size += len(text)
+
+    def write_static(self, text):
+        self.static.append(text)
+        self.size += len(text)
+
+    def _end_static(self):
+        self.chunks.append(raw(u''.join(self.static)))
+        self.static = []
+
+    def maybe_flush(self):
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if self.static:
+            self._end_static()
+        if self._emit is None or not self.chunks:
+            return
+        data = u''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        self._emit(data)
+
+    def getvalue(self):
+        """
+        Return everything written so far, when there is no target.
+        """
+        if self.static:
+            self._end_static()
+        data = u''.join(self.chunks)
+        self.chunks = [data]
+        return data
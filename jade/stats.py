@@ -0,0 +1,76 @@
+from time import time
+from collections import defaultdict
+
+
+class CountingCompiler(object):
+    """
+    Wraps a compiler, counting calls to each of its callbacks in `counts`.
+    """
+    def __init__(self, compiler, counts):
+        self._compiler = compiler
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._compiler, name)
+        if not callable(attr):
+            return attr
+        counts = self._counts
+
+        def f(*args, **kwargs):
+            counts[name] += 1
+            return attr(*args, **kwargs)
+        return f
+
+
+class ParseStats(object):
+    """
+    Statistics collected from a lexer with profiling turned on:
+
+    * `states` maps state names to [calls, cumulative time, chars consumed];
+
+    * `transitions` maps (from, to) pairs of state names to counts, with the
+      initial transition coming from None;
+
+    * `callbacks` maps compiler callback names to counts.
+    """
+    timer = staticmethod(time)
+
+    def __init__(self):
+        self.states = defaultdict(lambda: [0, 0.0, 0])
+        self.transitions = defaultdict(int)
+        self.callbacks = defaultdict(int)
+
+    def attach(self, lexer):
+        """
+        Turn on profiling for `lexer`, counting callbacks to its compiler if
+        it has one.
+        """
+        lexer.stats = self
+        if hasattr(lexer, 'compiler'):
+            lexer.compiler = CountingCompiler(lexer.compiler, self.callbacks)
+
+    def record(self, prev, name, elapsed, chars):
+        entry = self.states[name]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += chars
+        self.transitions[prev, name] += 1
+
+    def report(self):
+        lines = ['%-20s %8s %10s %10s' % ('state', 'calls', 'time', 'chars')]
+        for name, (calls, elapsed, chars) in sorted(
+                self.states.items(), key=lambda item: -item[1][1]):
+            lines.append('%-20s %8d %8.2fms %10d' % (
+                name, calls, elapsed * 1e3, chars))
+        lines.append('')
+        lines.append('%-44s %8s' % ('transition', 'count'))
+        for (prev, name), count in sorted(
+                self.transitions.items(), key=lambda item: -item[1]):
+            lines.append('%-44s %8d' % ('%s -> %s' % (prev, name), count))
+        if self.callbacks:
+            lines.append('')
+            lines.append('%-20s %8s' % ('callback', 'calls'))
+            for name, count in sorted(self.callbacks.items(),
+                                      key=lambda item: -item[1]):
+                lines.append('%-20s %8d' % (name, count))
+        return '\n'.join(lines)
@@ -0,0 +1,64 @@
+"""
+Streaming rendered templates in chunks that end at flush points, so that a
+server can send the start of a page, such as its head, before the rest is
+rendered.
+
+Flush points are put in templates with the flush tag:
+
+    html
+      head
+        ...
+      flush
+      body
+        ...
+
+or after the closing tags of elements named in the `flush_after` compiler
+option, e.g. JadeLoader(loader, flush_after=('head',)).  They compile to
+flush_marker, an HTML comment, which stream and chunks remove:
+
+    for chunk in stream(env.get_template('page.jade'), user=user):
+        send(chunk.encode('utf8'))
+"""
+
+flush_marker = u'<!--jade:flush-->'
+
+
+def chunks(items, size=None):
+    """
+    Join the strings of the iterable `items`, such as the output of a Jinja2
+    template's generate method, into chunks ending at flush markers, which
+    are removed.  If `size` is given, a chunk also ends as soon as it is at
+    least `size` characters long.  Empty chunks are skipped.
+    """
+    buf = []
+    buffered = 0
+    for item in items:
+        if flush_marker in item:
+            parts = item.split(flush_marker)
+            for part in parts[:-1]:
+                buf.append(part)
+                data = u''.join(buf)
+                if data:
+                    yield data
+                buf = []
+                buffered = 0
+            item = parts[-1]
+        if item:
+            buf.append(item)
+            buffered += len(item)
+            if size is not None and buffered >= size:
+                yield u''.join(buf)
+                buf = []
+                buffered = 0
+    if buf:
+        yield u''.join(buf)
+
+
+def stream(template, *args, **kwargs):
+    """
+    Render the Jinja2 template `template` in chunks; see chunks.  The `size`
+    keyword argument is passed to chunks, and other arguments to the
+    template's generate method.
+    """
+    size = kwargs.pop('size', None)
+    return chunks(template.generate(*args, **kwargs), size)
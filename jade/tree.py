@@ -0,0 +1,305 @@
+"""
+A tree representation of jade templates, for optimizations that need to look
+at more than one parser event at a time.
+
+TreeBuilder is a compiler target that records parser events as a Tree.  Tree
+passes transform the tree, and replay feeds the result to a real compiler as
+if it came from the parser:
+
+    tree = build(text)
+    for p in passes:
+        tree = p(tree)
+    replay(tree, Compiler(stream))
+
+Nodes use __slots__, so that trees of large templates stay small.  Element
+and Control nodes are HTMLTag and ControlTag objects themselves, with
+children, and are passed to the compiler as is.
+"""
+from abc import ABCMeta, abstractmethod
+from sys import stdin, stderr
+
+from .parse import Parser, HTMLTag, ControlTag, LexError
+
+
+class Tree(object):
+    """
+    The root of a template.  `dependencies` holds the names of templates
+    that passes removed references to, such as inlined includes.
+    """
+    __slots__ = ('children', 'dependencies')
+
+    def __init__(self, children=None, dependencies=None):
+        self.children = children or []
+        self.dependencies = dependencies or []
+
+    def __repr__(self):
+        return 'Tree(%r)' % self.children
+
+
+class Attribute(object):
+    """
+    A key=value attribute.  Unpacks like the (key, value) tuples the parser
+    produces.
+    """
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def __iter__(self):
+        return iter((self.key, self.value))
+
+    def __repr__(self):
+        return 'Attribute(%r, %r)' % (self.key, self.value)
+
+
+class Element(HTMLTag):
+    __slots__ = ('children', 'line')
+
+    def __init__(self, name, class_=None, id_=None, attr=None,
+                 children=None, line=None):
+        super(Element, self).__init__(name, class_, id_, attr)
+        self.children = children or []
+        self.line = line
+
+    @classmethod
+    def from_tag(cls, tag, line):
+        attr = [a if isinstance(a, basestring) else Attribute(*a)
+                for a in tag.attr]
+        return cls(tag.name, tag.class_, tag.id_, attr, line=line)
+
+    def __repr__(self):
+        return 'Element(%r, class_=%r, id_=%r, attr=%r, children=%r)' % (
+            self.name, self.class_, self.id_, self.attr, self.children)
+
+
+class Control(ControlTag):
+    __slots__ = ('children', 'line')
+
+    def __init__(self, name, head=None, children=None, line=None):
+        super(Control, self).__init__(name, head)
+        self.children = children or []
+        self.line = line
+
+    @classmethod
+    def from_tag(cls, tag, line):
+        return cls(tag.name, tag.head, line=line)
+
+    def __repr__(self):
+        return 'Control(%r, head=%r, children=%r)' % (
+            self.name, self.head, self.children)
+
+
+class Literal(object):
+    __slots__ = ('text', 'line')
+
+    def __init__(self, text, line=None):
+        self.text = text
+        self.line = line
+
+    def __repr__(self):
+        return 'Literal(%r)' % self.text
+
+
+class Newlines(object):
+    """
+    Newlines that are part of the indent.  Passes that drop nodes keep these
+    so that output lines still correspond to source lines.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return 'Newlines(%r)' % self.text
+
+
+def count_lines(node):
+    """
+    Return the number of newlines `node` and its children span.
+    """
+    if isinstance(node, (Literal, Newlines)):
+        return node.text.count(u'\n')
+    n = 0
+    if isinstance(node, Element):
+        n = sum(a.count(u'\n') for a in node.attr
+                if isinstance(a, basestring))
+    return n + sum(count_lines(child) for child in node.children)
+
+
+class TreeBuilder(object):
+    """
+    A compiler target that builds a Tree from parser events.  The result is
+    in `tree` once parsing has ended.
+    """
+    def __init__(self):
+        self.tree = None
+
+    def start(self, parser):
+        self.tree = Tree()
+        self.stack = [self.tree]
+        self.line = 1
+
+    def start_block(self, tag):
+        if isinstance(tag, HTMLTag):
+            node = Element.from_tag(tag, self.line)
+            self.line += sum(a.count(u'\n') for a in node.attr
+                             if isinstance(a, basestring))
+        else:
+            node = Control.from_tag(tag, self.line)
+        self.stack[-1].children.append(node)
+        self.stack.append(node)
+
+    def end_block(self):
+        self.stack.pop()
+
+    def literal(self, text):
+        self.stack[-1].children.append(Literal(text, self.line))
+        self.line += text.count(u'\n')
+
+    def newlines(self, text):
+        self.stack[-1].children.append(Newlines(text))
+        self.line += text.count(u'\n')
+
+    def end(self):
+        del self.stack
+
+
+def build(text):
+    """
+    Parse jade source `text` (a string or a file-like object) into a Tree.
+    LexError is propagated to the caller.
+    """
+    builder = TreeBuilder()
+    Parser(text, builder)()
+    return builder.tree
+
+
+class Replay(object):
+    """
+    Stands in for the parser while a tree is replayed, so that errors raised
+    by the compiler point at the line of the offending node.
+    """
+    def __init__(self):
+        self.line = 1
+
+    def error(self, msg):
+        return LexError(msg, (self.line, 1), u'')
+
+
+def replay(tree, compiler):
+    """
+    Feed `tree` to `compiler` as parser events.
+    """
+    source = Replay()
+    compiler.start(source)
+    # An explicit stack, since trees can be deeper than the recursion limit
+    stack = [iter(tree.children)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, Newlines):
+                compiler.newlines(node.text)
+            elif isinstance(node, Literal):
+                source.line = node.line or source.line
+                compiler.literal(node.text)
+            else:
+                source.line = node.line or source.line
+                compiler.start_block(node)
+                stack.append(iter(node.children))
+                break
+        else:
+            stack.pop()
+            if stack:
+                compiler.end_block()
+    compiler.end()
+
+
+def walk(nodes):
+    """
+    Yield all nodes in `nodes` and their descendants, parents first.
+    """
+    stack = [iter(nodes)]
+    while stack:
+        for node in stack[-1]:
+            yield node
+            if isinstance(node, (Element, Control)):
+                stack.append(iter(node.children))
+                break
+        else:
+            stack.pop()
+
+
+class Pass(object):
+    """
+    Base class of tree passes.  A pass is called with a Tree and returns the
+    transformed tree, which may be the same object modified in place.
+
+    Passes are part of the compiler options, and so of cache keys; their
+    repr must therefore identify their configuration.  The default repr is
+    built from the instance dictionary.
+
+    Passes that read other templates set `reads_templates`, since their
+    output then depends on more than the source of the template.
+    """
+    __metaclass__ = ABCMeta
+
+    reads_templates = False
+
+    @abstractmethod
+    def __call__(self, tree):
+        """
+        Return the transformed `tree`.
+        """
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in sorted(self.__dict__.items())))
+
+
+def run_passes(tree, passes):
+    for p in passes:
+        tree = p(tree)
+    return tree
+
+
+def dump(node, indent=0):
+    """
+    Return a readable outline of `node` and its children.
+    """
+    def line(node):
+        # Nodes made by passes may have no source line
+        return '?' if node.line is None else str(node.line)
+
+    lines = []
+    stack = [(node, indent)]
+    while stack:
+        node, indent = stack.pop()
+        if isinstance(node, Tree):
+            label = 'Tree'
+        elif isinstance(node, Element):
+            label = '%s: <%s>%s%s %s' % (
+                line(node), node.name,
+                node.id_ and '#' + node.id_ or '',
+                node.class_ and '.' + node.class_.replace(' ', '.') or '',
+                ' '.join('%s=%s' % tuple(a) for a in node.attr
+                         if not isinstance(a, basestring)))
+        elif isinstance(node, Control):
+            label = '%s: %s %s' % (line(node), node.name, node.head or '')
+        elif isinstance(node, Literal):
+            label = '%s: %r' % (line(node), node.text)
+        else:
+            label = 'newlines %d' % node.text.count(u'\n')
+        lines.append('  ' * indent + label.rstrip())
+        if isinstance(node, (Tree, Element, Control)):
+            stack.extend((child, indent + 1)
+                         for child in reversed(node.children))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    try:
+        print dump(build(stdin))
+    except LexError as e:
+        print >>stderr, e.pprint()
@@ -12,14 +12,9 @@ def repr_calling(args, kwargs):
     return ', '.join(li)
 
 
-def find_all(s, sub):
+def escape(s):
     """
-    Find all occurences of `sub` in `s`.
+    Escape `s` for HTML the same way as Jinja2's escape filter.
     """
-    i = 0
-    while True:
-        i = s.find(sub, i)
-        if i == -1:
-            return
-        yield i
-        i += 1
+    return (s.replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;')
+            .replace("'", '&#39;').replace('"', '&#34;'))
@@ -0,0 +1,321 @@
+"""
+Templates and helpers for the differential tests, which render the same
+templates through plain compiled Jinja2 and through another backend or
+compiler option, and check that the outputs agree.
+
+The corpus is made of the documents of the conformity tests, which put
+several jade sources in one file after `// name.jade` lines, and of the
+templates below, which exercise what the passes and backends rewrite.
+"""
+import io
+import os
+import re
+import glob
+
+from jinja2 import Environment, DictLoader
+
+from jade.loader import JadeLoader
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+separator = re.compile(r'// (?:alternative )?([\w./-]+\.jade|another jade '
+                       r'source)\n')
+
+templates = {
+    'layout.jade': u'''\
+doctype html
+html
+  head
+    title= title
+    block scripts
+      script(src='/jquery.js')
+  body
+    block content
+    block foot
+      #footer
+        p some footer content
+''',
+    'page.jade': u'''\
+extends "layout.jade"
+
+block append scripts
+  script(src='/page.js')
+
+block content
+  h1= title
+  for pet in pets
+    include "pet.jade"
+''',
+    'pet.jade': u'''\
+p.pet= pet
+''',
+    'partials.jade': u'''\
+include "heading.jade"
+for pet in pets
+  include "pet.jade"
+''',
+    'heading.jade': u'''\
+h1= title
+''',
+    'counted.jade': u'''\
+for pet in pets
+  include "numbered.jade"
+''',
+    'numbered.jade': u'''\
+p= loop.index
+''',
+    'pets.jade': u'''\
+extends "page.jade"
+
+block foot
+  p= pets|length
+''',
+    'sidebar.jade': u'''\
+extends "page.jade"
+
+block content
+  .sidebar
+    block sidebar
+      p nothing
+  .primary
+    = super()
+''',
+    'flags.jade': u'''\
+if DEBUG
+  p debug
+
+p end
+if not DEBUG
+  p release
+elif THEME == 'dark'
+  p dark
+
+else
+  p light
+pre
+  if DEBUG
+    | debug
+  else
+    | release
+  = title
+case THEME
+  //- themes
+  when 'dark'
+    p.theme dark
+
+  when 'light'
+    p.theme light
+  default
+    p.theme other
+p= title
+''',
+    'cases.jade': u'''\
+for n in range(12)
+  case n
+    when 0
+      p zero
+    when 1
+      p one
+    when 2
+      p two
+    when 3
+      p three
+    when 4
+      p four
+    when 5
+      p five
+    when 6
+      p six
+    when 7
+      p seven
+    when 8
+      p eight
+    default
+      p many
+case name
+  when 'N'
+    p N
+  when 'M'
+    p M
+  when 'O'
+    p O
+  when 'P'
+    p P
+  when 'Q'
+    p Q
+  when 'R'
+    p R
+  when 'S'
+    p S
+  when 'T'
+    p T
+''',
+    'mixins.jade': u'''\
+mixin pet(name)
+  li.pet= name
+
+mixin link(href, text='link')
+  a(href=href)= text
+
+mixin box(title)
+  .box
+    h2= title
+    = caller()
+
+ul
+  for p in pets
+    +pet(p)
+  +pet('hamster')
++link('/a')
++link('/b', text='b')
++box('Box')
+  p inside
+''',
+    'loops.jade': u'''\
+- set total = 0
+for item in items
+  - set total = total + item
+  p= total
+  for pet in pets
+    p(class=loop.cycle('odd', 'even'))= loop.index ~ pet ~ item
+p= total
+for item in items
+  if loop.first
+    p first
+  p= item
+''',
+    'expressions.jade': u'''\
+a(href='/users/' ~ name ~ '/' ~ (1 + 2))= name ~ 2 * 3
+p= (name ~ 1) + '!'
+p(title=(items|length) - 1)= (1 + 2)|string
+p(class=['a', 'b'] + ['c'])= title|upper ~ '!'
+p= '<b>' ~ name
+''',
+    'streams.jade': u'''\
+html
+  head
+    title= title
+  flush
+  body
+    for pet in pets
+      p= pet
+      flush
+''',
+    'fragments.jade': u'''\
+cache ('pets', title), 60
+  ul
+    for pet in pets
+      li= pet
+cache 'footer'
+  p= name
+''',
+}
+
+
+class User(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+context = dict(
+    title=u'My Site',
+    name=u'N',
+    foo=u'bar',
+    pets=[u'cat', u'dog'],
+    items=[1, 2, 3],
+    friends=3,
+    layout=u'layout.jade',
+    user=User(name=u'Tobi', occupation=u'Ferret', pets=[u'cat'],
+              role=u'admin', isAnonymous=False, id=1, roles=[u'a']),
+    users=[User(name=u'Tobi', occupation=u'Ferret', pets=[], role=u'admin',
+                isAnonymous=False, id=1, roles=[u'admin']),
+           User(name=u'Loki', occupation=u'Cat', pets=[u'mouse'],
+                role=u'user', isAnonymous=True, id=2, roles=[])],
+    DEBUG=False,
+    THEME=u'dark',
+)
+
+
+def split(text, name):
+    """
+    Split the text of a conformity test file into documents, returned as a
+    list of (name, source) pairs.  Documents following a `// name.jade` line
+    are named after it, and the others after `name`.
+    """
+    parts = separator.split(u'\n' + text)
+    documents = []
+    if parts[0].strip():
+        documents.append((name + u'-0.jade', parts[0].lstrip(u'\n')))
+    for i in range(1, len(parts), 2):
+        if parts[i] == u'another jade source':
+            doc = u'%s-%d.jade' % (name, i // 2 + 1)
+        else:
+            doc = parts[i]
+        documents.append((doc, parts[i + 1]))
+    return documents
+
+
+def conformity():
+    """
+    Return the documents of the conformity tests as a dictionary mapping
+    their names to their sources.  Documents with the same name as an
+    earlier one, such as an alternative head.jade, are left out.
+    """
+    documents = {}
+    pattern = os.path.join(root, 'conformity-tests', '*.jade')
+    for path in sorted(glob.glob(pattern)):
+        with io.open(path, encoding='utf8') as f:
+            text = f.read()
+        name = os.path.basename(path)[:-len('.jade')]
+        for doc, source in split(text, name):
+            documents.setdefault(doc, source)
+    return documents
+
+
+def corpus():
+    """
+    Return all the templates of the corpus as a dictionary mapping their
+    names to their sources.
+    """
+    documents = conformity()
+    documents.update(templates)
+    return documents
+
+
+def environment(documents, **options):
+    """
+    Return a Jinja2 environment loading `documents` through JadeLoader, with
+    `options` passed to it.
+    """
+    return Environment(loader=JadeLoader(DictLoader(documents), **options))
+
+
+def outcome(render):
+    """
+    Call `render` and return its output, or the class of the exception it
+    raised.
+    """
+    try:
+        return render()
+    except Exception as e:
+        return type(e)
+
+
+def render(env, name, **kwargs):
+    return outcome(lambda: env.get_template(name).render(context, **kwargs))
+
+
+def renders(documents, **options):
+    """
+    Render all of `documents` through JadeLoader with `options` and return a
+    dictionary mapping their names to the outcomes.
+    """
+    env = environment(documents, **options)
+    return dict((name, render(env, name)) for name in documents)
+
+
+def rendered(outcomes):
+    """
+    Return the names of the templates of `outcomes` that rendered.
+    """
+    return sorted(name for name, result in outcomes.items()
+                  if isinstance(result, unicode))
@@ -0,0 +1,110 @@
+"""
+Tests of compile_tree, the parallel batch compiler.
+"""
+import os
+import codecs
+import shutil
+import tempfile
+
+import pytest
+
+from jinja2 import Environment, FileSystemLoader
+
+from jade.batch import GRAPH_FILE, compile_tree
+from jade.deps import DependencyGraph
+
+sources = {
+    'layout.jade': u'html\n  block body\n',
+    'page.jade': u'extends "layout.jade"\nblock body\n  include "part.jade"\n',
+    'part.jade': u'p part\n',
+    'sub/other.jade': u'p= x\n',
+}
+
+
+@pytest.fixture
+def tree():
+    src = tempfile.mkdtemp()
+    dst = tempfile.mkdtemp()
+    for path, source in sources.items():
+        write(os.path.join(src, path), source)
+    yield src, dst
+    shutil.rmtree(src)
+    shutil.rmtree(dst)
+
+
+def write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with codecs.open(path, 'w', encoding='utf8') as f:
+        f.write(text)
+
+
+def backdate(path, seconds=10):
+    t = os.path.getmtime(path) - seconds
+    os.utime(path, (t, t))
+
+
+def read(path):
+    with codecs.open(path, encoding='utf8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_compile_tree(tree, processes):
+    src, dst = tree
+    results = compile_tree(src, dst, processes)
+    assert sorted(results) == [(path, None) for path in sorted(sources)]
+    assert read(os.path.join(dst, 'sub', 'other.jade')) == (
+        u'<p>{{ x }}</p>\n')
+    assert read(os.path.join(dst, 'page.jade')) == (
+        u'{% extends "layout.jade" %}\n{% block body %}\n'
+        u'{% include "part.jade" %}{% endblock %}\n')
+    graph = DependencyGraph.load(os.path.join(dst, GRAPH_FILE))
+    assert graph.dependencies('page.jade') == set(['layout.jade',
+                                                  'part.jade'])
+
+
+def test_render_output(tree):
+    # The output tree is served as is, with references between templates
+    src, dst = tree
+    compile_tree(src, dst, 1)
+    env = Environment(loader=FileSystemLoader(dst))
+    assert env.get_template('page.jade').render() == (
+        u'<html>\n\n<p>part</p></html>')
+    compile_tree(src, dst, 1, suffix='.html')
+    assert read(os.path.join(dst, 'sub', 'other.html')) == (
+        u'<p>{{ x }}</p>\n')
+
+
+def test_errors(tree):
+    src, dst = tree
+    write(os.path.join(src, 'bad.jade'), u'div\n    p\n  p\n')
+    results = dict(compile_tree(src, dst, 2))
+    assert 'Bad indentation' in results.pop('bad.jade')
+    assert results == dict((path, None) for path in sources)
+    assert not os.path.exists(os.path.join(dst, 'bad.jade'))
+
+
+def test_fresh(tree):
+    src, dst = tree
+    compile_tree(src, dst, 1)
+    assert compile_tree(src, dst, 1) == []
+    assert sorted(compile_tree(src, dst, 1, force=True)) == [
+        (path, None) for path in sorted(sources)]
+    assert compile_tree(src, dst, 1, names=['sub/other.jade'],
+                        force=True) == [('sub/other.jade', None)]
+
+
+def test_dependents(tree):
+    src, dst = tree
+    compile_tree(src, dst, 1)
+    for path in sources:
+        backdate(os.path.join(src, path))
+    # Output of templates depending on a changed one is stale too
+    write(os.path.join(src, 'part.jade'), u'p changed\n')
+    assert sorted(compile_tree(src, dst, 1)) == [('page.jade', None),
+                                                 ('part.jade', None)]
+    backdate(os.path.join(src, 'part.jade'))
+    write(os.path.join(src, 'layout.jade'), u'body\n  block body\n')
+    assert sorted(compile_tree(src, dst, 1)) == [('layout.jade', None),
+                                                 ('page.jade', None)]
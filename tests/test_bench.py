@@ -0,0 +1,35 @@
+"""
+Tests of the benchmark harness, on templates small enough to run quickly.
+"""
+import pytest
+
+from jade.bench import bench, compare, generators, parse_and_compile
+
+
+@pytest.mark.parametrize('generator', generators)
+def test_generators(generator):
+    text = generator()
+    assert text.endswith(u'\n')
+    parse_and_compile(text)
+
+
+def test_bench():
+    results = bench([(u'ok', u'p a\np b\n'), (u'bad', u'div\n    p\n  p\n')],
+                    repeat=1)
+    assert results[u'bad'] == {'error': 'Bad indentation'}
+    ok = results[u'ok']
+    assert (ok['chars'], ok['lines']) == (8, 3)
+    assert ok['total_time'] > 0
+    assert ok['total_time'] >= ok['compile_time'] >= 0
+    assert ok['chars_per_sec'] == 8 / ok['total_time']
+    assert isinstance(ok['peak_kb'], int)
+
+
+def test_compare():
+    old = {'a': {'total_time': 1.0}, 'b': {'total_time': 1.0},
+           'c': {'error': 'x'}, 'gone': {'total_time': 1.0}}
+    new = {'a': {'total_time': 1.05}, 'b': {'total_time': 1.5},
+           'c': {'total_time': 1.0}, 'd': {'total_time': 1.0}}
+    assert list(compare(old, new)) == [('a', 1.0, 1.05, False),
+                                       ('b', 1.0, 1.5, True)]
+    assert list(compare(old, new, threshold=0.01))[0][3]
@@ -0,0 +1,121 @@
+"""
+Tests of FileCache.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from jade.cache import FileCache, tables_fingerprint
+from jade.compile import compile_string, control_blocks
+
+
+@pytest.fixture
+def directory():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def entries(directory):
+    return [name for name in os.listdir(directory)
+            if name.endswith(FileCache.suffix)]
+
+
+def test_prune_lists_once(directory, monkeypatch):
+    cache = FileCache(directory)
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir',
+                        lambda path: listed.append(path) or listdir(path))
+    for i in range(50):
+        cache.compile(u'p %d\n' % i)
+    assert listed == [directory]
+    assert len(entries(directory)) == 50
+
+
+def test_prune_over_max_size(directory):
+    size = len('[]\n<p>00</p>\n')
+    cache = FileCache(directory, max_size=10 * size)
+    for i in range(10):
+        cache.compile(u'p %02d\n' % i)
+    assert len(entries(directory)) == 10
+    cache.compile(u'p 10\n')
+    # Evicted down to low_water
+    assert len(entries(directory)) == 7
+    assert cache.size == 7 * size
+    assert cache.get(u'p 10\n') == u'<p>10</p>\n'
+    assert cache.get(u'p 00\n') is None
+
+
+def test_size_threads(directory):
+    # Writes from concurrent threads all count towards the estimate
+    cache = FileCache(directory)
+    cache.set(u'p\n', u'<p></p>\n')
+
+    def run(n):
+        for i in range(200):
+            cache.set(u'p %d %d\n' % (n, i), u'<p>%d %d</p>\n' % (n, i))
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.size == sum(os.path.getsize(os.path.join(directory, name))
+                             for name in entries(directory))
+
+
+def test_round_trip(directory):
+    cache = FileCache(directory)
+    assert cache.get(u'p a\n') is None
+    deps = []
+    assert cache.compile(u'include "b"\np a\n', deps) == (
+        u'{% include "b" %}\n<p>a</p>\n')
+    assert deps == [u'b']
+    deps = []
+    assert FileCache(directory).get(u'include "b"\np a\n', deps) == (
+        u'{% include "b" %}\n<p>a</p>\n')
+    assert deps == [u'b']
+
+
+def test_options(directory):
+    cache = FileCache(directory)
+    cache.set(u'p a\n', u'plain')
+    cache.set(u'p a\n', u'compact', compact=True)
+    assert cache.get(u'p a\n') == u'plain'
+    assert cache.get(u'p a\n', compact=True) == u'compact'
+    assert cache.key(u'p a\n') != cache.key(u'p a\n', {'compact': True})
+
+
+@pytest.mark.parametrize('data', ['', '{}\n<p>a</p>\n', '[]\n\xff\n'])
+def test_corrupt_entry(directory, data):
+    cache = FileCache(directory)
+    cache.set(u'p a\n', u'<p>a</p>\n')
+    [name] = entries(directory)
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(data)
+    assert cache.get(u'p a\n') is None
+    assert entries(directory) == []
+
+
+def test_fingerprint():
+    # Compiling doesn't change keys, even though looking up tags without an
+    # entry adds them to control_blocks
+    fingerprint = tables_fingerprint()
+    compile_string(u'if x\n  for y in z\n    block b\n')
+    assert tables_fingerprint() == fingerprint
+
+
+def test_fingerprint_tables_changed(monkeypatch):
+    # The fingerprint is remembered, but follows changes to the tables
+    fingerprint = tables_fingerprint()
+    assert tables_fingerprint() is fingerprint
+    monkeypatch.setitem(control_blocks, 'tt', ('<tt>', '</tt>'))
+    assert tables_fingerprint() != fingerprint
+    monkeypatch.setitem(control_blocks, '=', ('{{ (', ') }}'))
+    changed = tables_fingerprint()
+    monkeypatch.undo()
+    assert tables_fingerprint() == fingerprint != changed
@@ -0,0 +1,108 @@
+"""
+Tests of the Jinja2 source output by jade.compile.
+"""
+from jinja2 import Environment, DictLoader
+
+from jade.compile import Compiler, compile_string
+from jade.parse import Parser
+
+
+def render(source, **context):
+    return Environment().from_string(compile_string(source)).render(context)
+
+
+def test_attribute_escape():
+    # The whole value is escaped, not only its last operand
+    assert (render(u'a(href=x ~ y)\n', x=u'<', y=u'>') ==
+            u'<a href="&lt;&gt;"></a>')
+    assert render(u'a(href=(n + 1))\n', n=1) == u'<a href="2"></a>'
+    # Sums concatenate, escaping every operand, as they always have
+    assert compile_string(u'a(href="/u/" + id)\n') == (
+        u'<a href="{{ "/u/" + id |escape}}"></a>\n')
+    assert (render(u'a(href="<" + id)\n', id=1) ==
+            u'<a href="&lt;1"></a>')
+    assert (render(u'a(href=x + "+" + y)\n', x=u'&', y=u'>') ==
+            u'<a href="&amp;+&gt;"></a>')
+
+
+def test_include():
+    # Bare paths are quoted, with .jade added when they have no extension
+    dependencies = []
+    assert compile_string(u'include includes/head\ninclude a.jade\n'
+                          u'include b.html\ninclude "c"\ninclude user.name\n',
+                          dependencies) == (
+        u'{% include "includes/head.jade" %}\n{% include "a.jade" %}\n'
+        u'{% include "b.html" %}\n{% include "c" %}\n'
+        u'{% include user.name %}\n')
+    assert dependencies == [u'includes/head.jade', u'a.jade', u'b.html',
+                            u'c']
+    env = Environment(loader=DictLoader({'includes/head.jade': u'<i>h</i>'}))
+    assert env.from_string(compile_string(u'p\n  include includes/head\n')
+                           ).render() == u'<p>\n<i>h</i></p>'
+
+
+def test_literal_attributes():
+    # Literal values are escaped at compile time, anything else at render
+    # time
+    assert compile_string(u'a(href="/x", title=\'<&>\', n=1) t\n') == (
+        u'<a href="/x" title="&lt;&amp;&gt;" n="1">t</a>\n')
+    assert compile_string(u'p(a=x, b="y", c=true)\n') == (
+        u'<p a="{{ (x) |escape}}" b="y" c="{{ (true) |escape}}"></p>\n')
+
+
+def test_static_chunks():
+    # Static markup reaches the target in one piece, in a raw block when it
+    # looks like Jinja2 source
+    out = []
+    source = u'div\n  p(a="1")\n  a(title="{{ x }}") t\n'
+    Parser(source, Compiler(out.append))()
+    assert out == [u'{% raw %}<div>\n<p a="1"></p>\n<a title="{{ x }}">'
+                   u'{% endraw %}t</a></div>\n']
+
+
+def test_endif_closing_parent():
+    # The endif goes before the end tag of the element the if block is in
+    source = u'div\n  if x\n    p a\np b\n'
+    assert render(source, x=False) == u'<div>\n</div>\n<p>b</p>'
+    assert render(source, x=True) == u'<div>\n\n<p>a</p></div>\n<p>b</p>'
+
+
+def test_silent_comment():
+    # Comments render nothing, not even the newlines they span
+    assert render(u'//- a\n   b\np x\n') == u'\n<p>x</p>'
+    assert (render(u'pre\n  | a\n  //- note\n    more\n  | b\n') ==
+            u'<pre>\na\n\nb</pre>')
+    assert (compile_string(u'div\n  //-\n    foo\n    bar\n  p x\n') ==
+            u'<div>\n{#\n\n#}\n<p>x</p></div>\n')
+    assert (compile_string(u'p a\n//- c\n  d\np b\n', compact=True) ==
+            u'<p>a</p><p>b</p>')
+
+
+def compact(source):
+    return compile_string(source, compact=True)
+
+
+def test_compact():
+    assert compact(u'div\n  p a\n\n\n  span= x\n') == (
+        u'<div><p>a</p><span>{{ x }}</span></div>')
+    # Text spanning lines keeps a single space
+    assert compact(u'p\n  | a\n  |   b\n  em c\n') == u'<p>a b <em>c</em></p>'
+    assert compact(u'if x\n  p a\nelse\n  p b\n') == (
+        u'{% if x %}<p>a</p>{% else %}<p>b</p>{% endif %}')
+
+
+def test_compact_inline():
+    # Newlines next to inline elements and text render as a space
+    assert compact(u'p\n  | Click\n  a(href="/x") here\n  | to go\n') == (
+        u'<p>Click <a href="/x">here</a> to go</p>')
+    assert compact(u'p\n  span a\n  span b\n') == (
+        u'<p><span>a</span> <span>b</span></p>')
+    assert compact(u'p\n  | a\n  = x\n') == u'<p>a {{ x }}</p>'
+    assert compact(u'ul\n  li\n    a x\n  li b\n') == (
+        u'<ul><li><a>x</a></li><li>b</li></ul>')
+
+
+def test_compact_preformatted():
+    assert compact(u'pre\n  | a\n  |   b\n') == u'<pre>\na\nb</pre>'
+    assert compact(u'div\n  textarea\n    | x\n    | y\n') == (
+        u'<div><textarea>\nx\ny</textarea></div>')
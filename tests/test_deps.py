@@ -0,0 +1,47 @@
+"""
+Tests of DependencyGraph.
+"""
+import os
+import tempfile
+
+from jade.deps import DependencyGraph
+
+
+def graph():
+    return DependencyGraph({
+        'page': ['layout', 'nav'],
+        'layout': ['base', 'nav'],
+        'nav': ['links'],
+        'other': ['nav'],
+        'loop': ['loop'],
+    })
+
+
+def test_dependencies():
+    g = graph()
+    assert g.dependencies('page') == set(['layout', 'nav', 'base', 'links'])
+    assert g.dependencies('links') == set()
+    assert g.dependencies('loop') == set()
+    assert g.dependencies('unknown') == set()
+
+
+def test_dependents():
+    g = graph()
+    assert g.dependents(['links']) == set(['links', 'nav', 'layout', 'page',
+                                           'other'])
+    assert g.dependents(['base', 'unknown']) == set(
+        ['base', 'layout', 'page', 'unknown'])
+    g.update('other', [])
+    g.remove('page')
+    assert g.dependents(['nav']) == set(['nav', 'layout'])
+
+
+def test_save_load():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        graph().save(path)
+        assert DependencyGraph.load(path).deps == graph().deps
+    finally:
+        os.remove(path)
+    assert DependencyGraph.load(path).deps == {}
@@ -0,0 +1,120 @@
+"""
+Tests of the fragment cache: LRUStore and Fragments on their own, then the
+corpus, whose cache tags have to render the same whether their fragments
+are rendered or read from the store, with both backends.
+"""
+import threading
+
+import pytest
+from jinja2 import Environment
+
+from jade.compile import compile_string
+from jade.fragments import LRUStore
+from jade.render import Template
+from jade.runtime import Fragments, install
+
+from corpus import corpus, context, environment, render, renders, rendered
+
+
+class Clock(object):
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def test_lru_store():
+    store = LRUStore(max_entries=2, max_size=10)
+    store.set('a', u'aaa')
+    store.set('b', u'bbb')
+    assert store.get('a') == u'aaa'
+    # b is the least recently used
+    store.set('c', u'ccc')
+    assert (store.get('a'), store.get('b'), store.get('c')) == (
+        u'aaa', None, u'ccc')
+    store.set('d', u'dddddd')
+    assert store.get('a') is None
+    assert store.stats() == {'entries': 2, 'size': 9, 'evictions': 2,
+                             'expirations': 0}
+    store.set('e', u'x' * 11)
+    assert store.get('e') is None
+    store.delete('c')
+    assert store.stats()['size'] == 6
+    store.clear()
+    assert store.stats()['entries'] == store.stats()['size'] == 0
+
+
+def test_lru_store_ttl():
+    clock = Clock()
+    store = LRUStore(default_ttl=10, clock=clock)
+    store.set('a', u'a')
+    store.set('b', u'b', 20)
+    clock.time = 10
+    assert (store.get('a'), store.get('b')) == (None, u'b')
+    clock.time = 20
+    assert store.get('b') is None
+    assert store.stats()['expirations'] == 2
+    assert store.stats()['size'] == 0
+
+
+def test_cache_tag():
+    env = Environment()
+    fragments = Fragments()
+    install(env, fragments=fragments)
+    template = env.from_string(compile_string(
+        u"cache 'k', 60\n  p= x\np= x\n"))
+    assert template.render(x=1) == u'\n<p>1</p>\n<p>1</p>'
+    assert template.render(x=2) == u'\n<p>1</p>\n<p>2</p>'
+    assert fragments.stats() == {'hits': 1, 'misses': 1, 'errors': 0,
+                                 'entries': 1, 'size': 9, 'evictions': 0,
+                                 'expirations': 0}
+
+
+def test_fragments_threads():
+    # Counts from concurrent renders add up
+    fragments = Fragments()
+    fragments(u'k', caller=lambda: u'v')
+
+    def run():
+        for i in range(2000):
+            fragments(u'k', caller=lambda: u'v')
+
+    threads = [threading.Thread(target=run) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (fragments.hits, fragments.misses) == (16000, 1)
+
+
+class FailingStore(LRUStore):
+    def get(self, key):
+        raise IOError(key)
+
+
+@pytest.mark.parametrize('store', [LRUStore, FailingStore])
+def test_fragments(store):
+    documents = corpus()
+    plain = renders(documents)
+    assert 'fragments.jade' in rendered(plain)
+    env = environment(documents)
+    fragments = Fragments(store())
+    install(env, fragments=fragments)
+    for i in range(2):
+        for name in documents:
+            assert render(env, name) == plain[name], name
+    if store is LRUStore:
+        assert fragments.hits and fragments.misses
+    else:
+        assert fragments.errors and not fragments.hits
+
+
+def test_fragments_python():
+    source = corpus()['fragments.jade']
+    expected = render(environment({'a.jade': source}), 'a.jade')
+    fragments = Fragments()
+    template = Template(source, globals={'_jade_fragment': fragments})
+    for i in range(2):
+        assert template.render(context) == expected
+    assert fragments.hits == fragments.misses == 2
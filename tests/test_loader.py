@@ -0,0 +1,136 @@
+"""
+Tests of JadeLoader.  The corpus, loaded through it with or without a
+FileCache, has to render as it does when each template is compiled with
+compile_string and handed to Jinja2 as is.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+from jinja2 import (Environment, DictLoader, FileSystemLoader,
+                    TemplateSyntaxError)
+
+from jade import loader
+from jade.cache import FileCache
+from jade.compile import compile_string
+from jade.loader import JadeLoader
+from jade.parse import LexError
+from jade.runtime import install
+
+from corpus import corpus, environment, render, renders, rendered
+
+
+def plain_renders(documents):
+    """
+    Compile `documents` with compile_string and render them through plain
+    Jinja2, returning a dictionary mapping their names to the outcomes.
+    """
+    compiled = {}
+    for name, source in documents.items():
+        try:
+            compiled[name] = compile_string(source)
+        except LexError:
+            pass
+    env = Environment(loader=DictLoader(compiled))
+    install(env)
+    return dict((name, render(env, name) if name in compiled else None)
+                for name in documents)
+
+
+@pytest.fixture
+def directory():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def check(documents, outcomes, plain):
+    for name in documents:
+        if plain[name] is None:
+            assert not isinstance(outcomes[name], unicode), name
+        else:
+            assert outcomes[name] == plain[name], name
+
+
+def test_loader():
+    documents = corpus()
+    plain = plain_renders(documents)
+    assert 'page.jade' in rendered(plain)
+    check(documents, renders(documents), plain)
+
+
+def test_file_cache(directory):
+    documents = corpus()
+    plain = plain_renders(documents)
+    cold = renders(documents, cache=FileCache(directory))
+    check(documents, cold, plain)
+    warm = renders(documents, cache=FileCache(directory))
+    check(documents, warm, plain)
+
+
+def test_dependencies(directory):
+    documents = corpus()
+    env = environment(documents, cache=FileCache(directory))
+    assert render(env, 'page.jade') == plain_renders(documents)['page.jade']
+    documents['pet.jade'] = u'p.animal= pet\n'
+    documents['layout.jade'] = documents['layout.jade'].replace(
+        u'some footer content', u'another footer')
+    outcome = render(env, 'page.jade')
+    assert outcome == plain_renders(documents)['page.jade']
+    assert u'animal' in outcome and u'another footer' in outcome
+    assert env.loader.graph.dependencies('page.jade') >= set(
+        ['layout.jade', 'pet.jade'])
+
+
+def test_recompile(directory, monkeypatch):
+    compiled = []
+
+    def compile(source, *args, **kwargs):
+        compiled.append(source)
+        return compile_string(source, *args, **kwargs)
+    monkeypatch.setattr(loader, 'compile_string', compile)
+    path = os.path.join(directory, 'a.jade')
+    with open(path, 'w') as f:
+        f.write('p= x\n')
+    with open(os.path.join(directory, 'b.html'), 'w') as f:
+        f.write('<p>{{ x }}</p>')
+    env = Environment(loader=JadeLoader(FileSystemLoader(directory)),
+                      auto_reload=True, cache_size=0)
+    for i in range(2):
+        assert env.get_template('a.jade').render(x=1) == u'<p>1</p>'
+        assert env.get_template('b.html').render(x=1) == u'<p>1</p>'
+    assert compiled == [u'p= x\n']
+    with open(path, 'w') as f:
+        f.write('div\n    p\n  p\n')
+    os.utime(path, (0, 0))
+    with pytest.raises(TemplateSyntaxError) as e:
+        env.get_template('a.jade')
+    assert (e.value.message, e.value.lineno, e.value.name) == (
+        'Bad indentation', 3, 'a.jade')
+
+
+def test_dependency_reads(directory):
+    # Dependencies are only read again once they change
+    reads = []
+
+    class Counting(FileSystemLoader):
+        def get_source(self, environment, template):
+            reads.append(template)
+            return FileSystemLoader.get_source(self, environment, template)
+    path = os.path.join(directory, 'b.jade')
+    with open(os.path.join(directory, 'a.jade'), 'w') as f:
+        f.write('include b.jade\n')
+    with open(path, 'w') as f:
+        f.write('p b\n')
+    env = Environment(loader=JadeLoader(Counting(directory)))
+    for i in range(3):
+        uptodate = env.loader.get_source(env, 'a.jade')[2]
+        assert uptodate()
+    assert reads.count('b.jade') == 1
+    with open(path, 'w') as f:
+        f.write('p c\n')
+    os.utime(path, (0, 0))
+    assert not uptodate()
+    env.loader.get_source(env, 'a.jade')
+    assert reads.count('b.jade') == 2
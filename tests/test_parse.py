@@ -0,0 +1,137 @@
+"""
+Tests of the lexer: its scanning helpers, attribute expressions, and reading
+the source from a file in chunks.
+"""
+import io
+
+import pytest
+
+from jade.compile import Compiler
+from jade.parse import AbstractLexer, LexError, Parser
+from jade.sink import Sink
+
+from corpus import corpus
+
+
+class Reader(object):
+    """
+    A file returning at most `size` bytes per read.
+    """
+    def __init__(self, text, size):
+        self.f = io.BytesIO(text.encode('utf8'))
+        self.size = size
+
+    def read(self, n):
+        return self.f.read(min(n, self.size))
+
+
+class Recorder(object):
+    """
+    A compiler recording the events it gets, except for the parser passed
+    to start.
+    """
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        def f(*args):
+            self.events.append((name,) + tuple(
+                arg for arg in args if not isinstance(arg, Parser)))
+        return f
+
+
+def events(source):
+    recorder = Recorder()
+    Parser(source, recorder)()
+    return recorder.events
+
+
+def test_accept_run():
+    lexer = AbstractLexer(u'  \txx y')
+    assert lexer.accept_run(u' \t') == u'  \t'
+    assert lexer.accept_run(u'y') == u''
+    assert lexer.accept_run(lambda c: c == u'x') == u'xx'
+    assert lexer.accept_run(u' ') == u' '
+    assert lexer.conclude() == u'  \txx '
+    assert lexer.accept_run(u'y') == u'y'
+    assert lexer.off_end()
+
+
+def test_accept_line():
+    lexer = AbstractLexer(u'ab\ncd')
+    assert lexer.accept_line() == u'\n'
+    assert lexer.conclude() == u'ab'
+    assert lexer.accept(u'x', u'\n') == u'\n'
+    lexer.drop()
+    assert lexer.accept_line() == u''
+    assert lexer.conclude() == u'cd'
+
+
+def test_attribute_expressions():
+    [start, block] = events(u'a(href=f(1, 2), title="a,b)", x=\'\\\'\','
+                            u' y=[1, (2)]) t\n')[:2]
+    assert block[1].attr == [(u'href', u'f(1, 2)'), '',
+                             (u'title', u'"a,b)"'), '',
+                             (u'x', u"'\\''"), '',
+                             (u'y', u'[1, (2)]')]
+    block = events(u'a(x={1: (2, "]")}\n  y=2)\n')[1]
+    assert block[1].attr == [(u'x', u'{1: (2, "]")}'), u'\n', '',
+                             (u'y', u'2')]
+
+
+@pytest.mark.parametrize('source, error', [
+    (u'a(x=(1]\n', u"Closing u']' doesn't match opening u'('"),
+    (u'a(x=1])\n', u"No opening u'[' to close"),
+    (u'a(x="abc\n', u'Unterminated Python expression'),
+])
+def test_attribute_errors(source, error):
+    with pytest.raises(LexError) as e:
+        events(source)
+    assert e.value.args[0] == error
+
+
+def parse(source, chunk_size=None):
+    sink = Sink()
+    parser = Parser(source, Compiler(sink))
+    if chunk_size:
+        parser.chunk_size = chunk_size
+    parser()
+    return sink.getvalue(), parser
+
+
+def outcome(source, chunk_size=None):
+    try:
+        return parse(source, chunk_size)[0]
+    except LexError as e:
+        return e.args
+
+
+@pytest.mark.parametrize('chunk_size, size', [(1, 1), (3, 2), (16, 5),
+                                              (4096, 4096)])
+def test_chunks(chunk_size, size):
+    for name, source in sorted(corpus().items()):
+        assert outcome(Reader(source, size), chunk_size) == (
+            outcome(source)), name
+
+
+def test_discard_nested():
+    line = u'p %s\n' % (u'x' * 20)
+    source = u'div\n  div\n' + u''.join(u'    ' + line for i in range(500))
+    compiled, parser = parse(Reader(source, 7), 64)
+    assert compiled == parse(source)[0]
+    # Only a bounded tail of the source is buffered at the end
+    assert parser.offset > len(source) - 256
+    assert len(parser.text) < 256
+
+
+def test_long_line():
+    source = u'p ' + u'\xe9' * 10000 + u'\n'
+    compiled, parser = parse(Reader(source, 3), 2)
+    assert compiled == u'<p>' + u'\xe9' * 10000 + u'</p>\n'
+
+
+def test_error_position():
+    source = u'div\n' + u'  p a\n' * 100 + u' p b\n'
+    expected = outcome(source)
+    assert expected[1][0] == 102
+    assert outcome(Reader(source, 5), 8) == expected
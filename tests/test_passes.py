@@ -0,0 +1,175 @@
+"""
+Tests of the tree passes.  Each pass is checked on small templates against
+the exact Jinja2 source it should produce, and the corpus has to render the
+same with the pass as without it.
+"""
+import pytest
+
+from jade.compile import compile_string
+from jade.passes import (FoldConstants, InlineMixins, FlattenInheritance,
+                         InlineIncludes, DispatchCase)
+
+from corpus import corpus, environment, render, renders, rendered
+
+
+def check_pass(passes, changed):
+    """
+    Check that the corpus renders the same with `passes` as without, and
+    that the passes changed the compiled source of the template `changed`.
+    """
+    documents = corpus()
+    plain = renders(documents)
+    assert changed in rendered(plain)
+    assert (compile_string(documents[changed], passes=passes) !=
+            compile_string(documents[changed]))
+    outcomes = renders(documents, passes=passes)
+    for name in documents:
+        assert outcomes[name] == plain[name], name
+
+
+constants = [
+    {'DEBUG': False, 'THEME': u'dark'},
+    {'DEBUG': True, 'THEME': u'dark'},
+    {'DEBUG': False, 'THEME': u'light'},
+    {'DEBUG': False, 'THEME': u'blue'},
+]
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('values', constants)
+def test_fold_constants(values, compact):
+    documents = corpus()
+    plain = environment(documents, compact=compact)
+    folded = environment(documents, compact=compact,
+                         passes=[FoldConstants(values)])
+    outcomes = dict((name, render(plain, name, **values))
+                    for name in documents)
+    assert 'flags.jade' in rendered(outcomes)
+    for name in documents:
+        assert render(folded, name, **values) == outcomes[name], name
+
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_fold_constants_lines(debug):
+    source = u'if DEBUG\n  p debug\n\np end\n'
+    passes = [FoldConstants({'DEBUG': debug})]
+    folded = compile_string(source, passes=passes)
+    assert folded.count(u'\n') == compile_string(source).count(u'\n')
+    documents = {'a.jade': source}
+    assert (renders(documents, passes=passes) ==
+            dict((name, render(environment(documents), name, DEBUG=debug))
+                 for name in documents))
+
+
+def fold(source, **constants):
+    return compile_string(source, passes=[FoldConstants(constants)])
+
+
+def test_fold_case():
+    source = u'case THEME\n  when "light"\n    p l\n  when "dark"\n    p d\n'
+    assert fold(source, THEME=u'dark') == u'\n{#\n#}{#\n#}\n<p>d</p>\n'
+    assert fold(source, THEME=u'light') == u'\n\n<p>l</p>\n{#\n#}\n'
+    # Unknown names are left to Jinja2
+    assert fold(source, DEBUG=True) == compile_string(source)
+
+
+def test_fold_dropped_elif():
+    # The lines of dropped branches are hidden in the branch before them,
+    # never between two branches
+    assert fold(u'if x\n  p a\nelif DEBUG\n  p d\nelif y\n  p y\n',
+                DEBUG=False) == (
+        u'{% if x %}\n<p>a</p>\n{#\n\n#}{% elif y %}\n<p>y</p>{% endif %}\n')
+    assert fold(u'if x\n  p a\nelif DEBUG\n  p d\nelse\n  p e\n',
+                DEBUG=False) == (
+        u'{% if x %}\n<p>a</p>\n{#\n\n#}{% else %}\n<p>e</p>{% endif %}\n')
+    assert fold(u'if DEBUG\n  p d\nelif x\n  p a\nelse\n  p e\n',
+                DEBUG=False) == (
+        u'{#\n\n#}{% if x %}\n<p>a</p>\n{% else %}\n<p>e</p>{% endif %}\n')
+    assert fold(u'if x\n  p a\nelif not DEBUG\n  p d\nelse\n  p e\n',
+                DEBUG=False) == (
+        u'{% if x %}\n<p>a</p>\n{% else %}\n<p>d</p>\n{#\n#}{% endif %}\n')
+
+
+def test_inline_mixin_calls():
+    source = u'mixin m(a)\n  p= a\n+m(1)\n+m(x)\n'
+    assert compile_string(source, passes=[InlineMixins()]) == (
+        u'{% macro m(a) %}\n<p>{{ a }}</p>{% endmacro %}\n'
+        u'{% with a=1 %}\n<p>{{ a }}</p>{% endwith %}\n'
+        u'{% with a=x %}\n<p>{{ a }}</p>{% endwith %}\n')
+    # Mixins over max_nodes, and calls with a body, are left alone
+    source = u'mixin m(a)\n  p= a\n  p= a\n+m(1)\n'
+    assert (compile_string(source, passes=[InlineMixins(2)]) ==
+            compile_string(source))
+    source = u'mixin m()\n  div= caller()\n+m()\n  i b\n'
+    assert (compile_string(source, passes=[InlineMixins()]) ==
+            compile_string(source))
+
+
+@pytest.mark.parametrize('max_nodes', [20, 1000])
+def test_inline_mixins(max_nodes):
+    check_pass([InlineMixins(max_nodes)], 'mixins.jade')
+
+
+templates = {
+    'layout.jade': u'html\n  block t\n    p t\n  block b\n',
+    'inc.jade': u'p inc\n  i= x\n',
+}
+
+
+def test_flatten_inheritance_source():
+    source = (u'extends "layout.jade"\nblock b\n  p b\n'
+              u'block append t\n  p u\n')
+    assert (compile_string(source,
+                           passes=[FlattenInheritance(templates.get)]) ==
+            u'<html>\n{% block t %} \n<p>t</p>\n<p>u</p>{% endblock %}\n'
+            u'{% block b %}\n<p>b</p>{% endblock %}</html>\n')
+    # Parents that can't be read are left to Jinja2
+    source = u'extends "missing.jade"\nblock b\n  p b\n'
+    assert (compile_string(source,
+                           passes=[FlattenInheritance(templates.get)]) ==
+            compile_string(source))
+
+
+def test_flatten_inheritance():
+    check_pass([FlattenInheritance(corpus().get)], 'page.jade')
+
+
+def test_inline_includes_source():
+    source = u'div\n  include "inc.jade"\n'
+    assert (compile_string(source, passes=[InlineIncludes(templates.get)]) ==
+            u'<div>\n<p>inc\n<i>{{ x }}</i></p></div>\n')
+    source = u'div\n  include "missing.jade"\n'
+    assert (compile_string(source, passes=[InlineIncludes(templates.get)]) ==
+            compile_string(source))
+    # Templates that may use names bound around the include stay included
+    source = u'for x in xs\n  include "inc.jade"\n'
+    assert (compile_string(source, passes=[InlineIncludes(templates.get)]) ==
+            compile_string(source))
+
+
+def test_inline_includes():
+    check_pass([InlineIncludes(corpus().get)], 'partials.jade')
+    check_pass([FlattenInheritance(corpus().get),
+                InlineIncludes(corpus().get)], 'pets.jade')
+
+
+def test_dispatch_case_source():
+    source = (u'case x\n  when 1\n    p a\n  when "b"\n    p b\n'
+              u'  default\n    p c\n')
+    assert compile_string(source, passes=[DispatchCase(1)]) == (
+        u'{% set _jade_case0 = _jade_case(x, (1, "b",)) %}\n'
+        u'{% if _jade_case0 < 1 %}\n<p>a</p>\n'
+        u'{% else %}{% if _jade_case0 < 2 %}\n<p>b</p>\n'
+        u'{% else %}\n<p>c</p>{% endif %}{% endif %}\n')
+    # Fewer whens than min_whens
+    assert (compile_string(source, passes=[DispatchCase(3)]) ==
+            compile_string(source))
+    env = environment({'a.jade': source}, passes=[DispatchCase(1)])
+    for x, output in [(1, u'a'), (u'b', u'b'), (2, u'c'), ([1], u'c')]:
+        assert render(env, 'a.jade', x=x).strip() == (
+            u'<p>%s</p>' % output)
+
+
+@pytest.mark.parametrize('min_whens', [1, 8])
+def test_dispatch_case(min_whens):
+    check_pass([DispatchCase(min_whens)], 'cases.jade')
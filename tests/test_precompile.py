@@ -0,0 +1,84 @@
+"""
+Tests of precompile and PrecompiledLoader: templates precompiled to Python
+modules render as they do when loaded from jade source.
+"""
+import os
+import codecs
+import shutil
+import tempfile
+
+import pytest
+from jinja2 import Environment, FileSystemLoader, ModuleLoader
+
+from jade.loader import JadeLoader
+from jade.precompile import PrecompiledLoader, precompile
+
+sources = {
+    'layout.jade': u'html\n  body\n    block content\n',
+    'page.jade': u'extends "layout.jade"\nblock content\n'
+                 u'  p(class=cs)= x\n  include "plain.html"\n',
+    'plain.html': u'<i>{{ x }}</i>',
+    'bad.jade': u'div\n    p\n  p\n',
+}
+
+
+@pytest.fixture
+def tree():
+    src = tempfile.mkdtemp()
+    target = tempfile.mkdtemp()
+    for name, source in sources.items():
+        with codecs.open(os.path.join(src, name), 'w', encoding='utf8') as f:
+            f.write(source)
+    yield src, target
+    shutil.rmtree(src)
+    shutil.rmtree(target)
+
+
+@pytest.mark.parametrize('zip, py_compile', [(None, False), (None, True),
+                                             ('deflated', False),
+                                             ('stored', True)])
+def test_precompile(tree, zip, py_compile):
+    src, target = tree
+    if zip:
+        target = os.path.join(target, 'templates.zip')
+    errors = precompile(src, target, zip=zip, py_compile=py_compile,
+                        environment_options={'autoescape': True})
+    assert [name for name, error in errors] == ['bad.jade']
+    assert errors[0][1].message == 'Bad indentation'
+    jade = Environment(autoescape=True,
+                       loader=JadeLoader(FileSystemLoader(src)))
+    env = Environment(autoescape=True, loader=PrecompiledLoader(target))
+    context = {'cs': [u'a', None], 'x': u'<b>'}
+    for name in ('layout.jade', 'page.jade', 'plain.html'):
+        assert env.get_template(name).render(context) == (
+            jade.get_template(name).render(context)), name
+    assert env.get_template('page.jade').render(context) == (
+        u'<html>\n<body>\n\n<p class="a">&lt;b&gt;</p>\n'
+        u'<i>&lt;b&gt;</i></body></html>')
+
+
+def test_compact(tree):
+    src, target = tree
+    errors = precompile(src, target, extensions=['jade'], compact=True)
+    assert [name for name, error in errors] == ['bad.jade']
+    assert sorted(os.listdir(target)) == sorted(
+        ModuleLoader.get_module_filename(name)
+        for name in ('layout.jade', 'page.jade'))
+    env = Environment(loader=PrecompiledLoader(target))
+    assert env.get_template('layout.jade').render() == (
+        u'<html><body></body></html>')
+
+
+def test_unreadable(tree):
+    # Templates that can't be read or decoded are reported, and the others
+    # still compiled
+    src, target = tree
+    with open(os.path.join(src, 'latin1.jade'), 'wb') as f:
+        f.write(b'p caf\xe9\n')
+    os.symlink(os.path.join(src, 'missing'), os.path.join(src, 'gone.jade'))
+    errors = dict(precompile(src, target, extensions=['jade']))
+    assert sorted(errors) == ['bad.jade', 'gone.jade', 'latin1.jade']
+    assert isinstance(errors['latin1.jade'], UnicodeDecodeError)
+    env = Environment(loader=PrecompiledLoader(target))
+    assert env.get_template('layout.jade').render() == (
+        u'<html>\n<body>\n</body></html>')
@@ -0,0 +1,92 @@
+"""
+Tests of the render-time profiler: its bookkeeping with a fake clock, the
+hooks instrumented templates call, and the corpus, which has to render the
+same instrumented as not.
+"""
+import pytest
+
+from jade.compile import compile_string
+from jade.passes import InlineMixins
+from jade.profiler import Profiler
+from jade.runtime import install
+
+from corpus import corpus, environment, render, renders, rendered
+
+
+class Clock(object):
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_times():
+    profiler = Profiler()
+    profiler.timer = clock = Clock()
+    profiler.enter('a', 1, u'for x in xs')
+    for i in range(2):
+        clock.time += 1
+        profiler.enter('a', 2, u'+item(x)', u'item')
+        clock.time += 2
+        profiler.leave()
+    clock.time += 1
+    profiler.leave()
+    assert [(key, entry.calls, entry.total, entry.own)
+            for key, entry in sorted(profiler.lines.items())] == [
+        (('a', 1), 1, 7.0, 3.0), (('a', 2), 2, 4.0, 4.0)]
+    [entry] = profiler.mixins.values()
+    assert (entry.label, entry.calls, entry.total) == (u'+item(x)', 2, 4.0)
+    report = profiler.report().split('\n')
+    assert report[1].split() == ['a:2', '2', '4000.00ms', '4000.00ms',
+                                 '+item(x)']
+    assert report[-1].split() == ['a:item', '2', '4000.00ms', '4000.00ms']
+    profiler.reset()
+    assert profiler.lines == profiler.mixins == {}
+
+
+def test_instrument():
+    source = u'ul\n  for x in xs\n    li= x\n'
+    assert compile_string(source, instrument='a.jade') == (
+        u'{% if _jade_profiled is not defined %}'
+        u'{{ _jade_profile.start() }}{% endif %}'
+        u'{% set _jade_profiled = true %}<ul>\n'
+        u'{{ _jade_profile.enter("a.jade", 2, "for x in xs") }}'
+        u'{% for x in xs %}\n'
+        u'<li>{{ _jade_profile.enter("a.jade", 3, "=") }}{{ x }}'
+        u'{{ _jade_profile.leave() }}</li>{% endfor %}'
+        u'{{ _jade_profile.leave() }}</ul>\n')
+
+
+@pytest.mark.parametrize('options', [{}, {'compact': True},
+                                     {'passes': [InlineMixins()]}])
+def test_profiler(options):
+    documents = corpus()
+    plain = renders(documents, **options)
+    env = environment(documents, instrument=True, **options)
+    profiler = Profiler()
+    install(env, profiler=profiler)
+    names = rendered(plain)
+    for name in documents:
+        assert render(env, name) == plain[name], name
+        if name in names:
+            assert profiler.local.stack == [], name
+    for name in ('mixins.jade', 'loops.jade', 'page.jade'):
+        assert any(template == name for template, line in profiler.lines)
+    assert profiler.mixins
+
+
+def test_profiler_after_error():
+    env = environment({'a.jade': u'ul\n  for x in xs\n    li= 1 / x\n'},
+                      instrument=True)
+    profiler = Profiler()
+    install(env, profiler=profiler)
+    template = env.get_template('a.jade')
+    with pytest.raises(ZeroDivisionError):
+        template.render(xs=[0])
+    assert len(profiler.local.stack) == 2
+    assert template.render(xs=[1, 2]) == (
+        u'<ul>\n\n<li>1.0</li>\n<li>0.5</li></ul>')
+    assert profiler.local.stack == []
+    assert sorted((line, entry.calls) for (template, line), entry
+                  in profiler.lines.items()) == [(2, 1), (3, 2)]
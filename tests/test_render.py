@@ -0,0 +1,155 @@
+"""
+Tests of the Python backend.  Besides checking a few outputs directly, the
+corpus and lists of tricky expressions and scoping cases are rendered by
+jade.render and through Jinja2, and the outputs compared.
+"""
+import pytest
+from jinja2 import Environment, DictLoader
+from jinja2.exceptions import UndefinedError
+
+from jade.compile import compile_string
+from jade.loader import JadeLoader
+from jade.parse import LexError
+from jade.render import Template
+from jade.runtime import UndefinedError as PyUndefinedError
+
+from corpus import corpus, context, outcome, render
+
+expressions = [
+    u"'a' ~ (1 + 2)",
+    u"('a' ~ 1) ~ (1 + 2)",
+    u"'a' ~ 2 * 3",
+    u"2 ** 3 ~ '!'",
+    u"'x' ~ (2 - 1) ~ 'y'",
+    u"1 - -2",
+    u"10 - 2 - 3",
+    u"-3 + 4 * 2",
+    u"(1 + 2) * 3",
+    u"x|length ~ 'n' ~ x|join('-')",
+    u"[1, 2]|join(',') ~ 'z'",
+    u"(x|length) - 1",
+    u"(1 + 2)|string ~ 'q'",
+    u"((1 + 2)|string ~ 'a') * 2",
+    u"-(1 - 3)|abs",
+    u"(1, 2)|join('-')",
+    u"x|join((x|length)|string)",
+    u"1 if true else -1",
+    u"2 ** 3 ** 2",
+    u"2 ** (3 ** 2)",
+    u"-2 ** 2",
+    u"2 ** -1 ** 2 ~ '!'",
+    u"-2 ** 2 ** 3|abs",
+    u"010 + 007 + 0",
+    u"0.5 + 00.5",
+]
+
+scopes = [
+    u"for i in [1, 2]\n  p= i\np= i\n",
+    u"for i in [1, 2]\n  - set x = i\n  p= x\np= x\n",
+    u"for i in [1, 2]\n  p= x\n  - set x = x ~ i\n  p= x\np= x\n",
+    u"for i in [1, 2]\n  for j in [3, 4]\n    p= loop.index ~ i ~ j\n"
+    u"  p= loop.index\n",
+    u"for i in i\n  p= i\np= i\n",
+    u"for i in [1, 2]\n  if true\n    - set x = i\n  p= x\np= x\n",
+    u"mixin m(a)\n  p= a ~ x\nfor x in [1, 2]\n  +m(x)\n",
+    u"mixin m()\n  div= caller()\nfor x in [1, 2]\n  +m()\n"
+    u"    p= x ~ loop.index\np= x\n",
+    u"- set x = 1\nfor i in [1]\n  mixin n()\n    p= i\n  +n()\np= x\n",
+    u"for a, b in [(1, 2), (3, 4)]\n  p= a ~ b\np= a ~ b\n",
+    u"- set x = 1\nmixin m()\n  p= x\n+m()\n- set x = 2\n+m()\n",
+    u"mixin m()\n  p= x\n- set x = 2\n+m()\n",
+    u"mixin a()\n  +b()\nmixin b()\n  p= x\n+a()\n",
+]
+
+
+def check(documents, autoescape=False, **kwargs):
+    """
+    Render `documents` with both backends and check that the outputs agree,
+    skipping those the Jinja2 backend fails on or the Python backend
+    doesn't support.  Return the names of the documents compared.
+    """
+    env = Environment(autoescape=autoescape,
+                      loader=JadeLoader(DictLoader(documents)))
+    compared = []
+    for name, source in sorted(documents.items()):
+        expected = render(env, name, **kwargs)
+        if not isinstance(expected, unicode):
+            continue
+        try:
+            template = Template(source, autoescape=autoescape)
+        except LexError:
+            continue
+        assert outcome(lambda: template.render(context, **kwargs)) == (
+            expected), name
+        compared.append(name)
+    return compared
+
+
+@pytest.mark.parametrize('autoescape', [False, True])
+def test_corpus(autoescape):
+    compared = check(corpus(), autoescape)
+    for name in ('expressions.jade', 'loops.jade', 'mixins.jade',
+                 'cases.jade', 'flags.jade'):
+        assert name in compared
+
+
+def test_expressions():
+    documents = dict(('%d.jade' % i, u'p= %s\n' % expr)
+                     for i, expr in enumerate(expressions))
+    assert len(check(documents, x=[1, 2])) == len(documents)
+
+
+def test_scopes():
+    documents = dict(('%d.jade' % i, source)
+                     for i, source in enumerate(scopes))
+    compared = check(documents, x=u'X', i=u'I', a=u'A', b=u'B')
+    assert len(compared) == len(documents)
+
+
+def test_render():
+    source = u'ul\n  for x in xs\n    li= loop.index ~ x\n'
+    assert Template(source).render(xs=u'ab') == (
+        u'<ul>\n\n<li>1a</li>\n<li>2b</li></ul>')
+    source = u'mixin m(a, b=2)\n  p= a + b\n+m(1)\n+m(1, 3)\n'
+    assert Template(source).render() == u'\n\n<p>3</p>\n\n<p>4</p>'
+    source = u'case x\n  when 1\n    p one\n  default\n    p other\n'
+    assert Template(source).render(x=2) == u'\n\n<p>other</p>'
+    assert Template(u'- set y = x ~ 1\np= y\n').render(x=u'a') == (
+        u'\n<p>a1</p>')
+    assert Template(u'p {{ x|upper }}\n').render(x=u'a') == u'<p>A</p>'
+
+
+def test_autoescape():
+    source = u'p= x\np\n  != x\n'
+    assert Template(source).render(x=u'<b>') == u'<p><b></p>\n<p>\n<b></p>'
+    assert Template(source, autoescape=True).render(x=u'<b>') == (
+        u'<p>&lt;b&gt;</p>\n<p>\n<b></p>')
+
+
+def test_unsupported():
+    with pytest.raises(LexError) as e:
+        Template(u'extends "a"\n')
+    assert e.value.args[0] == (
+        'extends is not supported by the Python backend')
+
+
+def test_silent_comment():
+    assert Template(u'//- a\n   b\np x\n').render() == u'\n<p>x</p>'
+    assert (Template(u'div\n  //-\n    foo\n    bar\n  p x\n').render() ==
+            u'<div>\n\n<p>x</p></div>')
+
+
+@pytest.mark.parametrize('source, result', [
+    (u'p= x.y\n', UndefinedError),
+    (u"p= x['y']\n", UndefinedError),
+    (u'p= d.y.z\n', UndefinedError),
+    (u'p= x()\n', UndefinedError),
+    (u'p= d.y ~ d[0]\n', u'<p></p>'),
+    (u'p= x|default(1)\n', u'<p>1</p>'),
+])
+def test_undefined(source, result):
+    jinja = Environment().from_string(compile_string(source))
+    assert outcome(lambda: jinja.render(d={})) == result
+    if result is UndefinedError:
+        result = PyUndefinedError
+    assert outcome(lambda: Template(source).render(d={})) == result
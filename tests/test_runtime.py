@@ -0,0 +1,50 @@
+"""
+Unit tests of the helpers in jade.runtime.
+"""
+from jinja2 import Environment
+
+from jade.compile import compile_string
+from jade.runtime import Markup, _jade_class, install
+
+
+def test_class():
+    assert _jade_class(u'a b') == u'a b'
+    assert _jade_class([u'a', None, u'b', u'a', u'']) == u'a b'
+    assert _jade_class({u'a': True, u'b': 0}) == u'a'
+    assert _jade_class(x for x in (u'a', u'b')) == u'a b'
+    assert _jade_class(frozenset([u'a'])) == u'a'
+    assert _jade_class(()) == u''
+    assert _jade_class(None) == u''
+
+
+def test_class_memo():
+    # Equal tuples whose items convert to different strings
+    assert _jade_class((u'a', True)) == u'a True'
+    assert _jade_class((u'a', 1)) == u'a 1'
+    assert _jade_class((1.0,)) == u'1.0'
+    assert _jade_class((1,)) == u'1'
+    assert _jade_class((u'a', u'b')) == u'a b'
+    assert _jade_class((u'a', u'b')) == u'a b'
+    assert _jade_class(([u'a'],)) == u"[u'a']"
+
+
+def render(source, **context):
+    env = Environment()
+    install(env)
+    return env.from_string(compile_string(source)).render(context)
+
+
+def test_class_attribute():
+    assert render(u'div.x(class=cs)\n', cs=(u'a', None, u'a', 1)) == (
+        u'<div class="x a 1"></div>')
+    assert render(u'div(class={"a": 1, "b": 0})\n') == (
+        u'<div class="a"></div>')
+    assert render(u'div(class=cs)\n', cs=[u'<b>']) == (
+        u'<div class="&lt;b&gt;"></div>')
+
+
+def test_markup_add():
+    # As with Jinja2's Markup, text added to markup is escaped
+    assert u'<' + Markup(u'<b>') == Markup(u'&lt;<b>')
+    assert Markup(u'<b>') + u'&' == Markup(u'<b>&amp;')
+    assert isinstance(Markup(u'a') + Markup(u'b'), Markup)
@@ -0,0 +1,182 @@
+"""
+Tests of jade.server, run in a separate process where they need one.
+"""
+import io
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+from jade.cache import FileCache
+from jade.parse import LexError
+from jade.server import (Client, CompileServer, ProtocolError, RequestHandler,
+                         UnixServer, header, read_message, write_message)
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def children(pid):
+    """
+    Return the pids of the processes whose parent is `pid`.
+    """
+    result = []
+    for name in os.listdir('/proc'):
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except (IOError, OSError):
+            continue
+        # The command name, in parentheses, may contain spaces
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[1]) == pid:
+            result.append(int(name))
+    return result
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.fixture
+def directory():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_handle(directory, cached):
+    server = CompileServer(FileCache(directory) if cached else None)
+    for i in range(2):
+        assert server.handle({'source': u'include "a"\np= x\n'}) == {
+            'output': u'{% include "a" %}\n<p>{{ x }}</p>\n',
+            'dependencies': [u'a']}
+    assert server.handle({'source': u'p a\np b\n',
+                          'options': {'compact': True}}) == {
+        'output': u'<p>a</p><p>b</p>', 'dependencies': []}
+    assert server.handle({'source': u'div\n    p\n  p\n'}) == {
+        'error': {'type': 'LexError', 'message': 'Bad indentation',
+                  'line': 3, 'column': 3, 'context': u'  p'}}
+
+
+def test_handle_defaults():
+    server = CompileServer(compact=True)
+    source = u'p a\np b\n'
+    assert server.handle({'source': source})['output'] == u'<p>a</p><p>b</p>'
+    assert server.handle({'source': source, 'options': {'compact': False}})[
+        'output'] == u'<p>a</p>\n<p>b</p>\n'
+
+
+@pytest.mark.parametrize('message, error', [
+    ([], 'no source'),
+    ({'source': 1}, 'no source'),
+    ({'source': u'', 'options': [1]}, 'options is not an object'),
+    ({'source': u'', 'options': {'instrument': True}},
+     'unknown option instrument'),
+])
+def test_bad_request(message, error):
+    assert CompileServer().handle(message) == {
+        'error': {'type': 'BadRequest', 'message': error}}
+
+
+def serve(data):
+    """
+    Serve the requests in `data` and return the replies.
+    """
+    wfile = io.BytesIO()
+    CompileServer().serve(io.BytesIO(data), wfile)
+    rfile = io.BytesIO(wfile.getvalue())
+    return list(iter(lambda: read_message(rfile), None))
+
+
+def test_serve():
+    requests = io.BytesIO()
+    write_message(requests, {'source': u'p a\n'})
+    write_message(requests, {'source': u'p b\n'})
+    assert serve(requests.getvalue()) == [
+        {'output': u'<p>a</p>\n', 'dependencies': []},
+        {'output': u'<p>b</p>\n', 'dependencies': []}]
+
+
+@pytest.mark.parametrize('data, message', [
+    ('\0\0', 'truncated header'),
+    (header.pack(10) + '{}', 'truncated message'),
+    (header.pack(2) + '{,', 'bad JSON: '),
+    (header.pack(2 ** 31), 'message of 2147483648 bytes is too large'),
+])
+def test_serve_errors(data, message):
+    [reply] = serve(data)
+    assert reply['error']['type'] == 'BadRequest'
+    assert reply['error']['message'].startswith(message)
+
+
+def test_serve_stops():
+    # Nothing is read after a malformed message
+    requests = io.BytesIO()
+    write_message(requests, {'source': u'p a\n'})
+    [reply] = serve(header.pack(2) + '{,' + requests.getvalue())
+    assert reply['error']['message'].startswith('bad JSON: ')
+
+
+def test_client(directory):
+    path = os.path.join(directory, 'jade.sock')
+    server = UnixServer(path, RequestHandler)
+    server.compile_server = CompileServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        client = Client(path)
+        deps = []
+        assert client.compile(u'extends "a"\n', deps) == (
+            u'{% extends "a" %}\n')
+        assert deps == [u'a']
+        with pytest.raises(LexError) as e:
+            client.compile(u'div\n    p\n  p\n')
+        assert e.value.args == ('Bad indentation', (3, 3), u'  p')
+        with pytest.raises(ProtocolError) as e:
+            client.compile(u'p\n', instrument=True)
+        assert str(e.value) == 'BadRequest: unknown option instrument'
+        assert client.compile(u'p\n') == u'<p></p>\n'
+        client.close()
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='needs /proc')
+@pytest.mark.parametrize('signum', [signal.SIGTERM, signal.SIGINT])
+def test_stop(directory, signum):
+    path = os.path.join(directory, 'jade.sock')
+    server = subprocess.Popen([sys.executable, '-m', 'jade.server',
+                               '-s', path, '-j', '2'], cwd=root)
+    workers = []
+    try:
+        for i in range(100):
+            if os.path.exists(path) and children(server.pid):
+                break
+            time.sleep(0.05)
+        client = Client(path)
+        assert client.compile(u'p= x\n') == u'<p>{{ x }}</p>\n'
+        client.close()
+        workers = children(server.pid)
+        assert len(workers) == 1
+        server.send_signal(signum)
+        assert server.wait() == 0
+        assert not any(alive(pid) for pid in workers)
+        assert not os.path.exists(path)
+    finally:
+        for pid in [server.pid] + workers:
+            if alive(pid):
+                os.kill(pid, signal.SIGKILL)
+        server.wait()
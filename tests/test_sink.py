@@ -0,0 +1,48 @@
+"""
+Tests of Sink, the buffer compiler output goes through.
+"""
+from jinja2 import Environment
+
+from jade.sink import Sink, raw
+
+
+def test_raw():
+    assert raw(u'<p>a</p>') == u'<p>a</p>'
+    assert raw(u'\n {{ x }} {#\n') == u'{% raw %}\n {{ x }} {#\n{% endraw %}'
+    text = u"{% endraw %}{{ '\\ }}"
+    assert Environment().from_string(raw(text)).render() == text
+
+
+def test_raw_whitespace_control():
+    # Whitespace around the text survives trim_blocks and lstrip_blocks
+    env = Environment(trim_blocks=True, lstrip_blocks=True)
+    for text in (u'<p>{{ x }}</p>\n', u'  <p>{{ x }}</p>\n  ',
+                 u'\n\t{% x %}\n\n'):
+        source = raw(text) + u'{{ y }}' + raw(text)
+        assert env.from_string(source).render(y=u'y') == text + u'y' + text
+
+
+def test_coalesce():
+    sink = Sink()
+    sink.write_static(u'<p>{{')
+    sink.write_static(u' x }}</p>')
+    sink.write(u'{{ y }}')
+    sink.write_static(u'\n')
+    assert sink.getvalue() == (
+        u'{% raw %}<p>{{ x }}</p>{% endraw %}{{ y }}\n')
+    assert sink.getvalue() == (
+        u'{% raw %}<p>{{ x }}</p>{% endraw %}{{ y }}\n')
+
+
+def test_flush():
+    out = []
+    sink = Sink(out.append, bufsize=4)
+    sink.write(u'ab')
+    sink.maybe_flush()
+    assert out == []
+    sink.write_static(u'cd')
+    sink.maybe_flush()
+    sink.write(u'e')
+    sink.flush()
+    sink.flush()
+    assert out == [u'abcd', u'e']
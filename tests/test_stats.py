@@ -0,0 +1,45 @@
+"""
+Tests of the lexer's state-machine profiling.
+"""
+from jade.compile import Compiler
+from jade.parse import Parser
+from jade.sink import Sink
+from jade.stats import ParseStats
+
+source = u'div\n  p(a=1) text\n  p= x\n'
+
+
+def profile(text):
+    sink = Sink()
+    parser = Parser(text, Compiler(sink))
+    stats = ParseStats()
+    stats.attach(parser)
+    parser()
+    return stats, sink.getvalue()
+
+
+def test_stats():
+    stats, compiled = profile(source)
+    sink = Sink()
+    Parser(source, Compiler(sink))()
+    assert compiled == sink.getvalue()
+    assert sum(chars for calls, elapsed, chars in stats.states.values()) == (
+        len(source))
+    assert stats.states['expr'][:1] == [1]
+    assert stats.transitions[None, 'start'] == 1
+    assert stats.transitions['after_attr_key', 'expr'] == 1
+    assert (sum(stats.transitions.values()) ==
+            sum(calls for calls, elapsed, chars in stats.states.values()))
+    # p= x is a p tag holding an = tag
+    assert dict(stats.callbacks) == {'start': 1, 'start_block': 4,
+                                     'end_block': 4, 'literal': 2,
+                                     'newlines': 3, 'end': 1}
+
+
+def test_report():
+    stats, compiled = profile(source)
+    lines = stats.report().split('\n')
+    assert lines[0].split() == ['state', 'calls', 'time', 'chars']
+    assert 'None -> start' in stats.report()
+    assert [line.split() for line in lines if line.startswith('start_block')
+            ] == [['start_block', '4']]
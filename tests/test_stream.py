@@ -0,0 +1,74 @@
+"""
+Tests of flush points and streamed rendering.  Besides concrete chunks, the
+chunks of each corpus template have to add up to its rendered output without
+the flush markers, with both backends.
+"""
+import pytest
+
+from jade.compile import compile_string
+from jade.render import Template
+from jade.stream import chunks, flush_marker, stream
+
+from corpus import corpus, context, environment, render, rendered
+
+
+def test_flush_points():
+    source = (u'html\n  head\n    title t\n  body\n    p a\n    flush\n'
+              u'    p b\n')
+    assert compile_string(source, flush_after=('head',)) == (
+        u'<html>\n<head>\n<title>t</title></head><!--jade:flush-->\n'
+        u'<body>\n<p>a</p>\n<!--jade:flush-->\n<p>b</p></body></html>\n')
+    assert compile_string(u'html\n  head\n  body\n', compact=True,
+                          flush_after=('head',)) == (
+        u'<html><head></head><!--jade:flush--><body></body></html>')
+
+
+def test_chunks():
+    items = [u'a', u'b' + flush_marker + u'c', flush_marker, u'd', u'',
+             u'efg', flush_marker]
+    assert list(chunks(items)) == [u'ab', u'c', u'defg']
+    assert list(chunks(items, size=2)) == [u'ab', u'c', u'defg']
+    assert list(chunks([u'a', u'b', u'c', u'de', u'f'], size=2)) == [
+        u'ab', u'cde', u'f']
+    assert list(chunks([flush_marker * 2])) == []
+
+
+@pytest.mark.parametrize('size', [None, 1, 16])
+def test_stream(size):
+    documents = corpus()
+    env = environment(documents, flush_after=('head',))
+    names = rendered(dict((name, render(env, name)) for name in documents))
+    assert 'streams.jade' in names
+    for name in names:
+        template = env.get_template(name)
+        output = template.render(context)
+        chunks = list(stream(template, context, size=size))
+        assert u''.join(chunks) == output.replace(flush_marker, u''), name
+        assert all(chunks)
+
+
+def test_stream_python():
+    source = corpus()['streams.jade']
+    template = Template(source)
+    assert template.render(context) == render(
+        environment({'a.jade': source}), 'a.jade')
+    assert list(stream(template, context)) == [
+        u'<html>\n<head>\n<title>My Site</title></head>\n',
+        u'\n<body>\n\n<p>cat</p>\n',
+        u'\n<p>dog</p>\n',
+        u'</body></html>',
+    ]
+    assert u''.join(stream(template, context, size=1)) == (
+        template.render(context).replace(flush_marker, u''))
+
+
+def test_stream_python_lazily():
+    # The head is sent before the body is rendered
+    calls = []
+    template = Template(u'html\n  head\n    title t\n  flush\n  body\n'
+                        u'    for x in items()\n      p= x\n')
+    chunks = stream(template, items=lambda: calls.append(1) or [u'a'])
+    assert next(chunks) == u'<html>\n<head>\n<title>t</title></head>\n'
+    assert calls == []
+    assert list(chunks) == [u'\n<body>\n\n<p>a</p></body></html>']
+    assert calls == [1]
@@ -0,0 +1,65 @@
+"""
+Tests of the tree representation: building, walking and replaying.
+"""
+from jade.compile import Compiler, compile_string
+from jade.parse import LexError
+from jade.sink import Sink
+from jade.tree import (Control, Element, Literal, Newlines, build,
+                       count_lines, dump, replay, walk)
+
+from corpus import corpus
+
+source = u'div(a=1,\n    b=2)\n  if x\n    p text\n\nspan\n'
+
+
+def test_build():
+    tree = build(source)
+    [div, newlines, span, end] = tree.children
+    assert isinstance(div, Element) and div.line == 1
+    assert [tuple(a) for a in div.attr if not isinstance(a, basestring)] == [
+        (u'a', u'1'), (u'b', u'2')]
+    [nl, if_] = div.children
+    assert isinstance(if_, Control) and (if_.name, if_.head, if_.line) == (
+        u'if', u'x', 3)
+    [nl, p] = if_.children
+    [text] = p.children
+    assert isinstance(text, Literal) and (text.text, text.line) == (
+        u'text', 4)
+    assert isinstance(newlines, Newlines) and newlines.text == u'\n\n'
+    assert span.line == 6
+    assert count_lines(tree) == source.count(u'\n')
+    assert [node.name for node in walk(tree.children)
+            if isinstance(node, (Element, Control))] == [
+        u'div', u'if', u'p', u'span']
+
+
+def test_slots():
+    node = build(u'p a\n').children[0]
+    assert not hasattr(node, '__dict__')
+    assert not hasattr(node.children[0], '__dict__')
+
+
+def test_replay():
+    # Replaying an untouched tree compiles like the parser
+    for name, text in sorted(corpus().items()):
+        try:
+            expected = compile_string(text)
+        except LexError:
+            continue
+        sink = Sink()
+        replay(build(text), Compiler(sink))
+        assert sink.getvalue() == expected, name
+
+
+def test_deep():
+    text = u''.join(u'  ' * i + u'div\n' for i in range(2000))
+    sink = Sink()
+    replay(build(text), Compiler(sink))
+    assert sink.getvalue() == compile_string(text)
+
+
+def test_dump():
+    tree = build(u'p(a=1) x\n')
+    tree.children.insert(0, Control(u'with', u'y=1', [], None))
+    assert dump(tree) == (
+        u"Tree\n  ?: with y=1\n  1: <p> a=1\n    1: u'x'\n  newlines 1")